@@ -0,0 +1,228 @@
+"""Бенчмарк рендера на синтетическом каталоге.
+
+    python benchmarks/bench_pipeline.py --rows 300 --sizes 800x600,4000x3000 \\
+        --latency-ms 30 --dup-ratio 0.3 --workers 2 --stages --json result.json
+
+Генерирует каталог, поднимает локальный сервер фото (benchmarks/synthetic.py)
+и прогоняет рендер целиком через RenderEngine.run_rows(); с --stages
+дополнительно замеряет стадии по отдельности (загрузка, декодирование, удаление
+фона, масштабирование, сборка карточки, кодирование). Результат — JSON (stdout
+или --json): строк в секунду, p50/p95 задержки строки (row_latency: от момента,
+когда engine взял строку из файла данных, до её готовности) и стадий, пиковый RSS.
+Сравнивайте JSON разных коммитов на одних и тех же параметрах.
+"""
+import argparse
+import copy
+import io
+import json
+import math
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import PhotoServer, catalogue_rows, parse_sizes, write_catalogue  # noqa: E402
+
+from imagegen import RenderEngine, load_config  # noqa: E402
+from imagegen.memo import MemoryCache  # noqa: E402
+from imagegen.prepare import prepare_source  # noqa: E402
+from imagegen.sources import open_rows  # noqa: E402
+from imagegen.writer import write_image  # noqa: E402
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """p-й процентиль (ближайший ранг); None для пустого списка."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, math.ceil(p / 100.0 * len(ordered)) - 1))
+    return ordered[k]
+
+
+def summarize(seconds: List[float]) -> Dict[str, Any]:
+    ms = [s * 1000.0 for s in seconds]
+    return {
+        "count": len(ms),
+        "mean_ms": round(sum(ms) / len(ms), 3) if ms else None,
+        "p50_ms": round(percentile(ms, 50), 3) if ms else None,
+        "p95_ms": round(percentile(ms, 95), 3) if ms else None,
+    }
+
+
+def peak_rss_mb() -> Dict[str, Optional[float]]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return {"self": None, "children": None}
+    # ru_maxrss: килобайты в Linux, байты в macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_config(args: argparse.Namespace) -> Dict[str, Any]:
+    config = load_config(args.config)
+    config.setdefault("cache", {})["enabled"] = bool(args.disk_cache)
+    config["cache"]["dir"] = None
+    config.setdefault("incremental", {})["enabled"] = False
+    config.setdefault("parallel", {})["workers"] = args.workers
+    return config
+
+
+def end_to_end(config: Dict[str, Any], input_path: str, out_dir: str, search_dirs: List[str]) -> Dict[str, Any]:
+    """Прогон целиком; задержка строки — от выдачи строки engine до её события.
+
+    В задержку входят ожидание в окне упреждающей загрузки, загрузка, рендер,
+    запись и (при --workers > 1) очередь пула процессов.
+    """
+    started = time.perf_counter()
+    engine = RenderEngine(config, out_dir, search_dirs=search_dirs)
+    engine.check()
+    source = open_rows(input_path, config)
+    taken: Dict[int, float] = {}
+    latencies: List[float] = []
+    rendered = failed = 0
+    stats: Dict[str, int] = {}
+
+    def stamped():
+        for idx, row in source:
+            taken[idx] = time.perf_counter()
+            yield idx, row
+
+    for ev in engine.run_rows(stamped(), source.total):
+        if ev.kind in ("row", "error"):
+            latencies.append(time.perf_counter() - taken.pop(ev.index))
+            if ev.kind == "row":
+                rendered += 1
+            else:
+                failed += 1
+        elif ev.kind == "done":
+            stats = ev.stats
+    seconds = time.perf_counter() - started
+    return {
+        "rows": rendered + failed,
+        "failed": failed,
+        "seconds": round(seconds, 3),
+        "rows_per_sec": round((rendered + failed) / seconds, 2) if seconds else None,
+        "row_latency": summarize(latencies),
+        "stats": stats,
+    }
+
+
+def timed(samples: List[float], fn: Callable[[], Any]) -> Any:
+    t = time.perf_counter()
+    value = fn()
+    samples.append(time.perf_counter() - t)
+    return value
+
+
+def stages(config: Dict[str, Any], rows: List[Dict[str, str]], out_dir: str,
+           search_dirs: List[str]) -> Dict[str, Any]:
+    """Стадии строки по отдельности, в одном потоке, без кэшей."""
+    from PIL import Image
+
+    cfg = copy.deepcopy(config)
+    cfg["cache"]["memory_mb"] = 0
+    engine = RenderEngine(cfg, out_dir, search_dirs=search_dirs)
+    engine.check()
+    plan = engine.plan
+    ib = plan.image_box
+    times: Dict[str, List[float]] = {k: [] for k in
+                                     ("download", "decode", "remove_bg", "resize", "compose", "encode")}
+    os.makedirs(out_dir, exist_ok=True)
+    for idx, row in enumerate(rows):
+        url = engine.source_url(row)
+        data = timed(times["download"], lambda: engine.http.get(url))
+
+        def decode():
+            with Image.open(io.BytesIO(data)) as img:
+                out = prepare_source(img, ib.prepare_box, ib.oversample)
+                out.load()
+                return out.copy() if out is img else out
+
+        src = timed(times["decode"], decode)
+        src = timed(times["remove_bg"], lambda: engine._process_source(src, ib, url))
+        fitted = timed(times["resize"], lambda: engine.fit_image(src, ib, plan.size))
+        # сборка карточки без работы с фото: вписанное фото уже лежит в памяти прогона
+        engine.photos = MemoryCache(1 << 40, lambda v: 0, prefix="photo")
+        engine.photos.get_or_compute(engine._photo_key(url), lambda: fitted)
+        img = timed(times["compose"], lambda: engine.render_row(idx, row))
+        engine.photos = None
+        name = engine.output_name(idx, row)
+        timed(times["encode"], lambda: write_image(img, os.path.join(out_dir, name), plan.output))
+    return {k: summarize(v) for k, v in times.items()}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарк рендера на синтетическом каталоге")
+    parser.add_argument("--rows", type=int, default=200, help="Строк в каталоге")
+    parser.add_argument("--sizes", default="800x600,1600x1200,4000x3000", help="Размеры фото WxH через запятую")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Задержка ответа сервера фото")
+    parser.add_argument("--dup-ratio", type=float, default=0.0, help="Доля строк с повторным фото")
+    parser.add_argument("--workers", type=int, default=1, help="parallel.workers")
+    parser.add_argument("--input-format", choices=("csv", "xlsx"), default="csv")
+    parser.add_argument("--config", default=os.path.join(ROOT, "test_conf.json"))
+    parser.add_argument("--disk-cache", action="store_true", help="Не выключать дисковый кэш фото")
+    parser.add_argument("--stages", action="store_true", help="Замерить стадии по отдельности")
+    parser.add_argument("--stage-rows", type=int, default=30, help="Строк для замера стадий")
+    parser.add_argument("--json", help="Куда записать результат (по умолчанию stdout)")
+    parser.add_argument("--keep", action="store_true", help="Не удалять временную папку")
+    args = parser.parse_args()
+
+    from PIL import __version__ as pillow_version
+
+    work = tempfile.mkdtemp(prefix="imagegen-bench-")
+    search_dirs = [ROOT]
+    config = bench_config(args)
+    report: Dict[str, Any] = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "pillow": pillow_version,
+        "cpu_count": os.cpu_count(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("json", "keep")},
+    }
+    try:
+        with PhotoServer(latency=args.latency_ms / 1000.0) as server:
+            rows = catalogue_rows(args.rows, server.base_url, parse_sizes(args.sizes), args.dup_ratio)
+            input_path = write_catalogue(os.path.join(work, "catalogue." + args.input_format), rows)
+            report["end_to_end"] = end_to_end(config, input_path, os.path.join(work, "out"), search_dirs)
+            report["end_to_end"]["photo_requests"] = server.requests
+            if args.stages:
+                report["stages"] = stages(config, rows[:max(1, args.stage_rows)],
+                                          os.path.join(work, "stages"), search_dirs)
+        report["peak_rss_mb"] = peak_rss_mb()
+    finally:
+        if args.keep:
+            print(f"Временная папка: {work}", file=sys.stderr)
+        else:
+            shutil.rmtree(work, ignore_errors=True)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""Сравнение удаления фона: прежняя реализация и imagegen.background.
+
+    python benchmarks/bench_remove_bg.py [--size 1746x1168] [--repeat 5]
+
+Кадр синтетический: товар на белом фоне с JPEG-шумом и белой деталью внутри.
+Печатает время на кадр и долю пикселей, ставших прозрачными.
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from imagegen.background import alpha_bbox, remove_background
+
+
+def legacy_remove_bg(src_img, color, tol, auto_crop=True):
+    """Код из RenderEngine._process_source до выделения imagegen.background."""
+    rgba = src_img.convert("RGBA")
+    arr = np.array(rgba)
+    rt, gt, bt = color
+    r, g, b, a = arr[..., 0], arr[..., 1], arr[..., 2], arr[..., 3]
+    mask = (np.abs(r-rt) <= tol) & (np.abs(g-gt) <= tol) & (np.abs(b-bt) <= tol)
+    arr[..., 3] = np.where(mask, 0, a)
+    out = Image.fromarray(arr)
+    if auto_crop:
+        bbox = out.split()[3].getbbox()
+        if bbox:
+            out = out.crop(bbox)
+    return out
+
+
+def new_remove_bg(src_img, color, tol, mode, feather=0, auto_crop=True):
+    out = remove_background(src_img, color, tol, mode, feather)
+    if auto_crop:
+        bbox = alpha_bbox(out)
+        if bbox:
+            out = out.crop(bbox)
+    return out
+
+
+def synthetic_photo(w, h):
+    img = Image.new("RGB", (w, h), "white")
+    d = ImageDraw.Draw(img)
+    d.ellipse((w // 8, h // 8, w * 7 // 8, h * 7 // 8), fill=(200, 60, 30))
+    d.ellipse((w * 3 // 8, h * 3 // 8, w * 5 // 8, h * 5 // 8), fill="white")
+    d.rectangle((w // 2, h // 16, w // 2 + w // 20, h * 15 // 16), fill=(10, 10, 10))
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=85)
+    with Image.open(io.BytesIO(buf.getvalue())) as jpeg:
+        return jpeg.convert("RGB")
+
+
+def transparent_share(img) -> float:
+    alpha = np.asarray(img.getchannel("A"))
+    return float(np.count_nonzero(alpha == 0)) / alpha.size
+
+
+def bench(name, fn, repeat):
+    fn()
+    t = time.perf_counter()
+    for _ in range(repeat):
+        out = fn()
+    dt = (time.perf_counter() - t) / repeat
+    print(f"{name:<22} {dt * 1000:8.1f} мс  прозрачно {transparent_share(out):6.1%}  размер {out.size}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", default="1746x1168")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--tolerance", type=int, default=20)
+    args = parser.parse_args()
+    w, h = (int(v) for v in args.size.lower().split("x"))
+    img = synthetic_photo(w, h)
+    white = (255, 255, 255)
+    bench("прежний", lambda: legacy_remove_bg(img, white, args.tolerance), args.repeat)
+    bench("color", lambda: new_remove_bg(img, white, args.tolerance, "color"), args.repeat)
+    bench("edge", lambda: new_remove_bg(img, white, args.tolerance, "edge"), args.repeat)
+    bench("edge + feather 1.5", lambda: new_remove_bg(img, white, args.tolerance, "edge", 1.5), args.repeat)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
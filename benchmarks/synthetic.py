@@ -0,0 +1,154 @@
+"""Синтетические данные для бенчмарков: каталог и локальный сервер фото.
+
+write_catalogue() пишет CSV/XLSX с колонками, которые ждёт test_conf.json
+(Артикул, Товар, Применимость по КК, Ссылка на фото). PhotoServer отдаёт
+сгенерированные JPEG по адресам /photo/<w>x<h>/<n>.jpg с заданной задержкой,
+изображая сервер поставщика.
+"""
+import csv
+import io
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+BRANDS = ("Toyota", "Nissan", "Honda", "Mazda", "Mitsubishi", "Isuzu", "Suzuki", "Subaru")
+COLUMNS = ("Код", "Товар", "Бренд", "Артикул", "Применимость по КК", "Ссылка на фото")
+
+
+def parse_sizes(text: str) -> List[Tuple[int, int]]:
+    """'800x600,3000x2000' -> [(800, 600), (3000, 2000)]."""
+    sizes = []
+    for part in text.split(","):
+        w, h = part.lower().strip().split("x")
+        sizes.append((int(w), int(h)))
+    return sizes
+
+
+def catalogue_rows(rows: int, base_url: str, sizes: Sequence[Tuple[int, int]],
+                   dup_ratio: float = 0.0, seed: int = 1) -> List[Dict[str, str]]:
+    """Строки каталога; dup_ratio — доля строк, повторяющих фото предыдущих строк."""
+    rnd = random.Random(seed)
+    out = []
+    photos: List[str] = []
+    for i in range(rows):
+        if photos and rnd.random() < dup_ratio:
+            url = rnd.choice(photos)
+        else:
+            w, h = sizes[i % len(sizes)]
+            url = f"{base_url}/photo/{w}x{h}/{i}.jpg"
+            photos.append(url)
+        models = [f"{rnd.choice(BRANDS)} Model{rnd.randint(1, 99)} {rnd.randint(1985, 2015)} - {rnd.randint(2000, 2024)}"
+                  for _ in range(rnd.randint(1, 9))]
+        out.append({
+            "Код": str(1000 + i),
+            "Товар": f"Фильтр масляный {i}",
+            "Бренд": "NITTO",
+            "Артикул": f"{rnd.choice('ABCDEFGH')}{rnd.randint(1, 9)}-{i:05d}",
+            "Применимость по КК": " / ".join(models),
+            "Ссылка на фото": url,
+        })
+    return out
+
+
+def write_catalogue(path: str, rows: List[Dict[str, str]]) -> str:
+    """Пишет строки в CSV или XLSX (по расширению path)."""
+    if path.lower().endswith(".csv"):
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+        return path
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(list(COLUMNS))
+    for row in rows:
+        ws.append([row[c] for c in COLUMNS])
+    wb.save(path)
+    return path
+
+
+def synthetic_photo(w: int, h: int, seed: int = 0) -> bytes:
+    """JPEG: товар (эллипс и планка) на белом фоне."""
+    from PIL import Image, ImageDraw
+
+    rnd = random.Random(seed)
+    img = Image.new("RGB", (w, h), "white")
+    d = ImageDraw.Draw(img)
+    color = (rnd.randint(60, 220), rnd.randint(20, 120), rnd.randint(20, 120))
+    d.ellipse((w // 8, h // 8, w * 7 // 8, h * 7 // 8), fill=color)
+    d.rectangle((w // 2, h // 16, w // 2 + max(1, w // 20), h * 15 // 16), fill=(20, 20, 20))
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=85)
+    return buf.getvalue()
+
+
+class PhotoServer:
+    """HTTP-сервер на 127.0.0.1 со сгенерированными фото и задержкой ответа."""
+
+    def __init__(self, latency: float = 0.0, port: int = 0) -> None:
+        self.latency = latency
+        self.requests = 0
+        self._photos: Dict[Tuple[int, int, int], bytes] = {}
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                body = server._photo(self.path)
+                if server.latency:
+                    time.sleep(server.latency)
+                if body is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "image/jpeg")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._httpd.server_address[1]}"
+
+    def _photo(self, path: str) -> Optional[bytes]:
+        parts = path.strip("/").split("/")
+        if len(parts) != 3 or parts[0] != "photo":
+            return None
+        try:
+            w, h = (int(v) for v in parts[1].lower().split("x"))
+            n = int(parts[2].split(".")[0])
+        except ValueError:
+            return None
+        with self._lock:
+            self.requests += 1
+            # фото генерируется один раз; разные n с одним размером различаются цветом
+            key = (w, h, n % 16)
+            body = self._photos.get(key)
+            if body is None:
+                body = self._photos[key] = synthetic_photo(w, h, seed=n % 16)
+        return body
+
+    def __enter__(self) -> "PhotoServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
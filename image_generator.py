@@ -1,83 +1,37 @@
+from __future__ import annotations
+
 import os
+import queue
 import sys
 import threading
-import re
-import io
-from urllib.request import urlopen, Request
+import time
 import traceback
 from dataclasses import dataclass
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 
-import tkinter as tk
-from tkinter import filedialog, messagebox
-from tkinter import ttk
+try:
+    import tkinter as tk
+    from tkinter import filedialog, messagebox
+    from tkinter import ttk
+except ImportError:
+    # сервер рендера без Tk: модуль нужен только для CLI (python -m image_generator render ...)
+    # и процессов-воркеров пула, которые заново импортируют главный модуль
+    tk = filedialog = messagebox = ttk = None
 
+from imagegen.config import DEFAULT_CONFIG, deep_merge, get_base_dir, get_run_dir
 
-def get_base_dir() -> str:
-    """Возвращает базовую директорию для ресурсов в обычном и frozen-режиме.
 
-    - В обычном запуске: директория файла скрипта
-    - В PyInstaller (frozen): sys._MEIPASS (временная распаковка) либо директория exe
-    """
-    meipass = getattr(sys, "_MEIPASS", None)
-    if meipass and os.path.isdir(meipass):
-        return meipass
-    if getattr(sys, "frozen", False):
-        return os.path.dirname(sys.executable)
-    return os.path.dirname(os.path.abspath(__file__))
-
-
-def get_run_dir() -> str:
-    """Директория запуска для файлов вывода (папка с exe или со скриптом)."""
-    if getattr(sys, "frozen", False):
-        return os.path.dirname(sys.executable)
-    return os.path.dirname(os.path.abspath(__file__))
-
-
-# GUI-only bootstrap; data processing and Pillow/pandas will be imported lazily
-
-
-
-
-DEFAULT_CONFIG = {
-    "template": "template.jpg",
-    "output_dir": "output",
-    "fields": [
-        {"name": "Артикул", "x": 0.58, "y": 0.12, "font_size": 0.070, "font_ref": "w", "font_units": "rel", "color": "#000000", "anchor": "la"},
-    ],
-    "multiline_fields": [
-        {
-            "name": "Применимость по КК",
-            "x": 0.62,
-            "y": 0.42,
-            "font_size": 0.050,
-            "font_ref": "w",
-            "font_units": "rel",
-            "color": "#000000",
-            "anchor": "la",
-            "delimiter": "/",
-            "max_lines": 6,
-            "overflow_text": "и т.д.",
-            "line_spacing": 1.25
-        }
-    ],
-    "image_box": {
-        "source_column": "Ссылка на фото",
-        "x": 0.05,
-        "y": 0.28,
-        "width": 0.58,
-        "height": 0.52,
-        "fit": "contain",
-        "remove_bg": True,
-        "remove_bg_color": "#FFFFFF",
-        "remove_bg_tolerance": 20,
-        "auto_crop": True
-    },
-    "font": {
-        "ttf_path": None,
-    },
-    "filename_pattern": "{article_clean}.jpg",
-}
+# GUI-only bootstrap; data processing and Pillow/openpyxl will be imported lazily
+
+# как часто цикл Tk забирает события потока рендера, мс
+POLL_MS = 100
+# сколько событий разбирается за один тик, чтобы окно не замирало
+MAX_EVENTS_PER_TICK = 5000
+# редактор зон: пауза колеса до быстрого кадра и до качественного, мс
+WHEEL_DEBOUNCE_MS = 30
+ZOOM_SETTLE_MS = 250
+# превью строки: пауза после правки параметров зоны, мс
+PREVIEW_DEBOUNCE_MS = 50
 
 
 class ImageGeneratorApp:
@@ -90,7 +44,15 @@ class ImageGeneratorApp:
         self.output_dir: Optional[str] = None
         self.config: Dict[str, Any] = DEFAULT_CONFIG.copy()
 
+        # Поток рендера не трогает виджеты: сообщения лога идут через очередь,
+        # прогресс — последним значением; и то и другое забирает _drain_events()
+        self._events: "queue.SimpleQueue[Tuple[str, Any]]" = queue.SimpleQueue()
+        self._progress: Optional[float] = None
+        self._running = False
+        self._log_file = None
+
         self._build_ui()
+        self.root.after(POLL_MS, self._drain_events)
 
     def _build_ui(self) -> None:
         pad = 8
@@ -138,9 +100,75 @@ class ImageGeneratorApp:
         self.output_entry.insert(0, default_output)
 
     def _log(self, msg: str) -> None:
-        self.log_text.insert(tk.END, msg + "\n")
+        """Добавляет строку в лог; можно вызывать из любого потока."""
+        self._events.put(("log", msg))
+
+    def _set_progress(self, value: float) -> None:
+        # промежуточные значения не нужны: окно покажет последнее
+        self._progress = value
+
+    def _drain_events(self) -> None:
+        lines: List[str] = []
+        try:
+            for _ in range(MAX_EVENTS_PER_TICK):
+                kind, payload = self._events.get_nowait()
+                if kind == "log":
+                    lines.append(payload)
+                    continue
+                self._append_log(lines)
+                lines = []
+                if kind == "error":
+                    messagebox.showerror("Ошибка", payload)
+                elif kind == "finished":
+                    self._finish_run()
+        except queue.Empty:
+            pass
+        finally:
+            self._append_log(lines)
+            progress, self._progress = self._progress, None
+            if progress is not None:
+                self.progress_var.set(progress)
+            self.root.after(POLL_MS, self._drain_events)
+
+    def _append_log(self, lines: List[str]) -> None:
+        """Пишет строки в файл лога (все) и в окно (не больше log.max_lines последних)."""
+        if not lines:
+            return
+        if self._log_file is not None:
+            self._log_file.write("\n".join(lines) + "\n")
+            self._log_file.flush()
+        max_lines = int((self.config.get("log", {}) or {}).get("max_lines", 2000) or 0)
+        if max_lines > 0:
+            lines = lines[-max_lines:]
+        self.log_text.insert(tk.END, "\n".join(lines) + "\n")
+        if max_lines > 0:
+            # после последней строки в Text всегда есть пустая
+            count = int(self.log_text.index("end-1c").split(".")[0]) - 1
+            if count > max_lines:
+                self.log_text.delete("1.0", f"{count - max_lines + 1}.0")
         self.log_text.see(tk.END)
-        self.root.update_idletasks()
+
+    def _open_log_file(self) -> None:
+        path = (self.config.get("log", {}) or {}).get("file")
+        if not path:
+            return
+        if not os.path.isabs(path):
+            path = os.path.join(get_run_dir(), path)
+        try:
+            folder = os.path.dirname(path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            self._log_file = open(path, "a", encoding="utf-8")
+            self._log_file.write(f"=== {time.strftime('%Y-%m-%d %H:%M:%S')} {self.input_path} ===\n")
+        except OSError as e:
+            self._log_file = None
+            self._log(f"Не удалось открыть файл лога {path}: {e}")
+
+    def _finish_run(self) -> None:
+        self._running = False
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
 
     def _choose_input(self) -> None:
         filetypes = [
@@ -164,17 +192,6 @@ class ImageGeneratorApp:
 
     def _load_config(self) -> None:
         import json
-        
-        def deep_merge(base: Dict[str, Any], override: Dict[str, Any]) -> Dict[str, Any]:
-            """Рекурсивное слияние словарей: сохраняет вложенные ключи из base,
-            если в override нет значений. Значения в override имеют приоритет."""
-            result = base.copy()
-            for k, v in (override or {}).items():
-                if isinstance(v, dict) and isinstance(result.get(k), dict):
-                    result[k] = deep_merge(result[k], v)
-                else:
-                    result[k] = v
-            return result
 
         path = filedialog.askopenfilename(title="Выберите JSON конфиг", filetypes=[("JSON", "*.json")])
         if not path:
@@ -207,6 +224,9 @@ class ImageGeneratorApp:
             messagebox.showerror("Ошибка", f"Не удалось сохранить конфиг: {e}")
 
     def _start(self) -> None:
+        if self._running:
+            messagebox.showwarning("Внимание", "Генерация уже идёт")
+            return
         self.input_path = self.input_entry.get().strip() or self.input_path
         self.output_dir = self.output_entry.get().strip() or self.output_dir
 
@@ -222,6 +242,8 @@ class ImageGeneratorApp:
 
         os.makedirs(self.output_dir, exist_ok=True)
 
+        self._running = True
+        self._open_log_file()
         # Run processing in a background thread to keep UI responsive
         thread = threading.Thread(target=self._process_safe, daemon=True)
         thread.start()
@@ -232,16 +254,11 @@ class ImageGeneratorApp:
             # Пытаемся получить список колонок из выбранного файла
             if self.input_path and os.path.isfile(self.input_path):
                 try:
-                    import pandas as pd
-                    path_lower = self.input_path.lower()
-                    if path_lower.endswith(".csv"):
-                        dfh = pd.read_csv(self.input_path, nrows=0)
-                    else:
-                        dfh = pd.read_excel(self.input_path, nrows=0)
-                    columns = [str(c) for c in list(dfh.columns)]
+                    from imagegen.sources import read_columns
+                    columns = read_columns(self.input_path, self.config)
                 except Exception:
                     columns = None
-            ZoneEditor(self.root, self.config, columns)
+            ZoneEditor(self.root, self.config, columns, input_path=self.input_path)
         except Exception:
             self._log(traceback.format_exc())
 
@@ -250,318 +267,97 @@ class ImageGeneratorApp:
             self._process()
         except Exception:
             self._log(traceback.format_exc())
-            messagebox.showerror("Ошибка", "Произошла ошибка, детали в логе.")
+            self._events.put(("error", "Произошла ошибка, детали в логе."))
+        finally:
+            self._events.put(("finished", None))
 
     def _process(self) -> None:
-        import pandas as pd
-        from PIL import Image, ImageDraw, ImageFont
+        from imagegen.engine import RenderEngine
 
         self._log("Чтение данных...")
-        path_lower = self.input_path.lower()
-        if path_lower.endswith(".csv"):
-            df = pd.read_csv(self.input_path)
-        else:
-            df = pd.read_excel(self.input_path)
-
-        if df.empty:
-            self._log("Файл данных пуст.")
-            return
-
-        base_dir = get_base_dir()
-        template_path = self.config.get("template", "template.jpg")
-        if not os.path.isabs(template_path):
-            template_path = os.path.join(base_dir, template_path)
-
-        if not os.path.isfile(template_path):
-            raise FileNotFoundError(f"Не найден шаблон: {template_path}")
+        engine = RenderEngine(self.config, self.output_dir)
+        for ev in engine.run(self.input_path):
+            if ev.kind == "start":
+                if ev.total == 0:
+                    self._log("Файл данных пуст.")
+                    return
+                self._log("Начало генерации изображений...")
+            elif ev.kind == "row":
+                self._set_progress(ev.progress)
+                self._log(f"Сохранено: {', '.join(ev.out_names)}")
+            elif ev.kind == "skip":
+                self._set_progress(ev.progress)
+            elif ev.kind == "error":
+                self._set_progress(ev.progress)
+                self._log(f"Ошибка в строке {ev.index}: {ev.message}")
+            elif ev.kind == "done" and ev.message:
+                self._log(ev.message)
+
+        self._set_progress(100.0)
+        self._log("Готово.")
 
-        font_cfg = self.config.get("font", {}) or {}
-        ttf_path = font_cfg.get("ttf_path")
 
-        def load_font(size: int):
-            from PIL import ImageFont
-            if ttf_path and os.path.isfile(ttf_path):
-                try:
-                    return ImageFont.truetype(ttf_path, size)
-                except Exception:
-                    pass
-            candidates = [
-                os.path.join(os.environ.get("WINDIR", "C:/Windows"), "Fonts", "arial.ttf"),
-                os.path.join(os.environ.get("WINDIR", "C:/Windows"), "Fonts", "segoeui.ttf"),
-            ]
-            for p in candidates:
-                if os.path.isfile(p):
-                    try:
-                        return ImageFont.truetype(p, size)
-                    except Exception:
-                        continue
-            try:
-                return ImageFont.truetype("DejaVuSans.ttf", size)
-            except Exception:
-                return ImageFont.load_default()
-        filename_pattern = self.config.get("filename_pattern", "image_{row_index:04d}.jpg")
-
-        self._log("Начало генерации изображений...")
-        total = len(df.index)
-        for idx, row in df.iterrows():
-            with Image.open(template_path).convert("RGB") as base_img:
-                draw = ImageDraw.Draw(base_img)
-                W, H = base_img.size
-
-                def resolve_coord(val, total):
-                    try:
-                        f = float(val)
-                        if 0.0 < f <= 1.0:
-                            return int(f * total)
-                        return int(f)
-                    except Exception:
-                        return int(val)
-
-                def resolve_font_size(val, ref_dim: str = "w", units: str = "rel"):
-                    try:
-                        f = float(val)
-                        if (units or "rel").lower() == "rel" and 0.0 < f <= 1.0:
-                            base = W if (ref_dim or "w").lower() == "w" else H
-                            return max(8, int(f * base))
-                        return int(f)
-                    except Exception:
-                        return int(val)
-
-                # вставка изображения по URL
-                img_box = (self.config.get("image_box") or {}).copy()
-                if img_box:
-                    src_col = img_box.get("source_column")
-                    url = str(row.get(src_col, "") or "").strip() if src_col else ""
-                    if url:
-                        try:
-                            req = Request(url, headers={"User-Agent": "Mozilla/5.0"})
-                            with urlopen(req, timeout=10) as resp:
-                                data = resp.read()
-                            from PIL import Image as PILImage
-                            with PILImage.open(io.BytesIO(data)) as src_img:
-                                remove_bg = bool(img_box.get("remove_bg", True))
-                                if remove_bg:
-                                    try:
-                                        import numpy as np
-                                        rgba = src_img.convert("RGBA")
-                                        arr = np.array(rgba)
-                                        hexcol = (img_box.get("remove_bg_color", "#FFFFFF") or "#FFFFFF").lstrip('#')
-                                        rt = int(hexcol[0:2], 16)
-                                        gt = int(hexcol[2:4], 16)
-                                        bt = int(hexcol[4:6], 16)
-                                        tol = int(img_box.get("remove_bg_tolerance", 18))
-                                        r, g, b, a = arr[..., 0], arr[..., 1], arr[..., 2], arr[..., 3]
-                                        mask = (np.abs(r-rt) <= tol) & (np.abs(g-gt) <= tol) & (np.abs(b-bt) <= tol)
-                                        arr[..., 3] = np.where(mask, 0, a)
-                                        src_img = PILImage.fromarray(arr)
-                                        if bool(img_box.get("auto_crop", True)):
-                                            alpha = src_img.split()[3]
-                                            bbox = alpha.getbbox()
-                                            if bbox:
-                                                src_img = src_img.crop(bbox)
-                                    except Exception:
-                                        src_img = src_img.convert("RGB")
-                                else:
-                                    src_img = src_img.convert("RGB")
-                                x = resolve_coord(img_box.get("x", 0), W)
-                                y = resolve_coord(img_box.get("y", 0), H)
-                                bw = max(1, resolve_coord(img_box.get("width", src_img.width), W))
-                                bh = max(1, resolve_coord(img_box.get("height", src_img.height), H))
-                                fit = (img_box.get("fit", "contain") or "contain").lower()
-                                scale_w = bw / src_img.width
-                                scale_h = bh / src_img.height
-                                scale = max(scale_w, scale_h) if fit == "cover" else min(scale_w, scale_h)
-                                new_w = max(1, int(src_img.width * scale))
-                                new_h = max(1, int(src_img.height * scale))
-                                resized = src_img.resize((new_w, new_h))
-                                off_x = x + (bw - new_w) // 2
-                                off_y = y + (bh - new_h) // 2
-                                if resized.mode == "RGBA":
-                                    base_img.paste(resized, (off_x, off_y), mask=resized.split()[3])
-                                else:
-                                    base_img.paste(resized, (off_x, off_y))
-
-                        except Exception:
-                            pass
-                for field in self.config.get("fields", []):
-                    name = field.get("name")
-                    x = resolve_coord(field.get("x", 0), W)
-                    y = resolve_coord(field.get("y", 0), H)
-                    fx = x
-                    fy = y
-                    fw = resolve_coord(field.get("width", 0), W)
-                    fh = resolve_coord(field.get("height", 0), H)
-                    font_ref = (field.get("font_ref") or "w").lower()
-                    font_units = (field.get("font_units") or "rel").lower()
-                    font_size = resolve_font_size(field.get("font_size", 32), font_ref, font_units)
-                    color = field.get("color", "#000000")
-                    anchor = field.get("anchor", "la")
-
-                    value = row.get(name, "")
-                    text = "" if value is None else str(value)
-
-                    font = load_font(font_size)
-
-                    if fw > 0 and fh > 0:
-                        words = text.split()
-                        line = ""
-                        is_article = (name or "").strip().lower() in ("артикул", "article", "арт", "артикуль")
-                        cursor_y = fy
-                        try:
-                            ascent, descent = font.getmetrics()
-                            step = int((ascent + descent) * 1.1)
-                        except Exception:
-                            step = int(font_size * 1.1)
-                        for w in words:
-                            test = (line + " " + w).strip()
-                            tw, th = font.getbbox(test)[2:4]
-                            if tw > fw and line:
-                                if is_article:
-                                    lw, _ = font.getbbox(line)[2:4]
-                                    cx = fx + (fw - lw) // 2
-                                    draw.text((cx, cursor_y), line, font=font, fill=color, anchor="la")
-                                else:
-                                    draw.text((fx, cursor_y), line, font=font, fill=color, anchor="la")
-                                cursor_y += step
-                                line = w
-                                if cursor_y > fy + fh - step:
-                                    break
-                            else:
-                                line = test
-                        if cursor_y <= fy + fh - step and line:
-                            lw, _ = font.getbbox(line)[2:4]
-                            if is_article:
-                                cx = fx + (fw - lw) // 2
-                                total_height = step
-                                if cursor_y == fy:
-                                    cursor_y = fy + (fh - total_height) // 2
-                                draw.text((cx, cursor_y), line, font=font, fill=color, anchor="la")
-                            else:
-                                draw.text((fx, cursor_y), line, font=font, fill=color, anchor="la")
-                    else:
-                        draw.text((x, y), text, font=font, fill=color, anchor=anchor)
-
-                # многострочные поля
-                for mfield in self.config.get("multiline_fields", []):
-                    name = mfield.get("name")
-                    raw = row.get(name, "")
-                    text_value = "" if raw is None else str(raw)
-                    delimiter = mfield.get("delimiter", "/")
-                    
-                    parts = [p.strip() for p in str(text_value).split(delimiter) if p.strip()]
-                    
-                    # очистка от годов выпуска и лишних символов
-                    try:
-                        import re as _re
-                        cleaned_parts = []
-                        for p in parts:
-                            p = _re.sub(r"\b(19|20)\d{2}\b\s*[-–—]?\s*\b(19|20)\d{2}\b", "", p)
-                            p = _re.sub(r"\b(19|20)\d{2}\b", "", p)
-                            p = _re.sub(r"[\s\-–—/:]+$", "", p)
-                            p = _re.sub(r"\s{2,}", " ", p).strip()
-                            if p:
-                                cleaned_parts.append(p)
-                        parts = cleaned_parts
-                    except Exception:
-                        pass
-                    max_lines = int(mfield.get("max_lines", 6))
-                    overflow_text = mfield.get("overflow_text", "и т.д.")
-                    show_overflow_text = bool(mfield.get("show_overflow_text", True))
-                    x = resolve_coord(mfield.get("x", 0), W)
-                    y = resolve_coord(mfield.get("y", 0), H)
-                    box_w = resolve_coord(mfield.get("width", 0), W)
-                    box_h = resolve_coord(mfield.get("height", 0), H)
-                    m_font_ref = (mfield.get("font_ref") or "w").lower()
-                    m_font_units = (mfield.get("font_units") or "rel").lower()
-                    font_size = resolve_font_size(mfield.get("font_size", 32), m_font_ref, m_font_units)
-                    color = mfield.get("color", "#000000")
-                    anchor = mfield.get("anchor", "la")
-                    line_spacing = float(mfield.get("line_spacing", 1.2))
-                    mfont = load_font(font_size)
-                    try:
-                        ascent, descent = mfont.getmetrics()
-                        step = int((ascent + descent) * line_spacing)
-                    except Exception:
-                        step = int(font_size * line_spacing)
-                    # Заголовок "Применимость:" всегда первой строкой
-                    title = mfield.get("title", "Применимость:")
-                    cursor_y = y
-                    def fits(txt: str) -> bool:
-                        if box_w <= 0:
-                            return True
-                        try:
-                            width_px = draw.textlength(txt, font=mfont)
-                        except Exception:
-                            # fallback
-                            bx = mfont.getbbox(txt)
-                            width_px = bx[2] - bx[0]
-                        return width_px <= box_w
-
-                    def emit_line(txt: str) -> bool:
-                        nonlocal cursor_y
-                        if box_h > 0 and cursor_y + step > y + box_h:
-                            return False
-                        draw.text((x, cursor_y), txt, font=mfont, fill=color, anchor=anchor)
-                        cursor_y += step
-                        return True
-
-                    # заголовок
-                    if not emit_line(title):
-                        continue
-
-                    # построение строк из токенов
-                    lines: list[str] = []
-                    max_chars = int(mfield.get("max_chars", 20))
-                    def clamp_chars(s: str) -> str:
-                        if max_chars > 0 and len(s) > max_chars:
-                            return s[:max(1, max_chars-3)] + "..."
-                        return s
-                    
-                    lines = []
-                    for token in parts:
-                        result = clamp_chars(token)
-                        lines.append(result)
-
-                    allowed = max_lines
-                    to_draw = lines[:allowed] if allowed > 0 else []
-                    overflow = len(lines) > allowed
-
-                    for ln in to_draw:
-                        ln = clamp_chars(ln)
-                        if not emit_line(ln):
-                            break
-
-                    if overflow and show_overflow_text:
-                        emit_line(str(overflow_text))
-
-                article_value = row.get("Артикул") or row.get("артикул") or row.get("Article") or row.get("article")
-                article_clean = ""
-                if article_value is not None:
-                    article_clean = re.sub(r"[^0-9A-Za-z]+", "", str(article_value)).lower()
-                out_name = None
-                if "{article_clean}" in filename_pattern and article_clean:
-                    out_name = filename_pattern.replace("{article_clean}", article_clean)
-                if not out_name:
-                    out_name = filename_pattern.format(row_index=idx)
-                out_path = os.path.join(self.output_dir, out_name)
-                base_img.save(out_path, quality=95)
-
-            progress = (idx + 1) * 100.0 / total
-            self.progress_var.set(progress)
-            self._log(f"Сохранено: {out_name}")
-
-        self.progress_var.set(100.0)
-        self._log("Готово.")
+class ZoomPyramid:
+    """Шаблон в масштабах 1, 1/2, 1/4... для редактора зон.
 
+    region() отдаёт только видимую часть холста при заданном zoom, беря её из
+    ближайшего уровня не меньше нужного масштаба: даже на 4K-шаблоне
+    масштабируется кусок размером с окно, а не вся картинка.
+    """
 
-class ZoneEditor(tk.Toplevel):
+    MIN_SIDE = 256
+
+    def __init__(self, img) -> None:
+        self.levels = [img]
+
+    def level(self, zoom: float) -> int:
+        k = 0
+        while zoom <= 0.5 ** (k + 1):
+            if k + 1 == len(self.levels):
+                prev = self.levels[-1]
+                if min(prev.size) < 2 * self.MIN_SIDE:
+                    break
+                # уровни строятся по мере надобности и дальше берутся из памяти
+                self.levels.append(prev.reduce(2))
+            k += 1
+        return k
+
+    def update(self, boxes: List[Tuple[int, int, int, int]]) -> None:
+        """Пересчитывает уменьшенные уровни в изменившихся прямоугольниках уровня 0."""
+        for k in range(1, len(self.levels)):
+            prev, level = self.levels[k - 1], self.levels[k]
+            next_boxes = []
+            for x0, y0, x1, y1 in boxes:
+                # reduce(2) усредняет блоки 2x2, поэтому границы выравниваются по чётным пикселям
+                x0, y0 = x0 // 2 * 2, y0 // 2 * 2
+                x1, y1 = min(x1 + x1 % 2, prev.width), min(y1 + y1 % 2, prev.height)
+                if x1 <= x0 or y1 <= y0:
+                    continue
+                level.paste(prev.crop((x0, y0, x1, y1)).reduce(2), (x0 // 2, y0 // 2))
+                next_boxes.append((x0 // 2, y0 // 2, (x1 + 1) // 2, (y1 + 1) // 2))
+            boxes = next_boxes
+
+    def region(self, zoom: float, box: Tuple[int, int, int, int], hq: bool = False):
+        """Часть холста box (x0, y0, x1, y1 в координатах при zoom)."""
+        from PIL import Image
+
+        src = self.levels[self.level(zoom)]
+        f = src.width / self.levels[0].width / zoom
+        x0, y0, x1, y1 = box
+        resample = Image.LANCZOS if hq else Image.BILINEAR
+        return src.resize((x1 - x0, y1 - y0), resample=resample, box=(x0 * f, y0 * f, x1 * f, y1 * f))
+
+
+class ZoneEditor(tk.Toplevel if tk is not None else object):
     """Редактор зон для настройки полей и изображений на шаблоне."""
 
-    def __init__(self, master: tk.Misc, config: Dict[str, Any], columns: Optional[List[str]] = None):
+    def __init__(self, master: tk.Misc, config: Dict[str, Any], columns: Optional[List[str]] = None,
+                 input_path: Optional[str] = None):
         super().__init__(master)
         self.title("Редактор зон")
         self.geometry("1000x700")
         self.config_ref = config
+        self.input_path = input_path
 
         self.mode = tk.StringVar(value="image")  # image|field|multiline
         self.field_name = tk.StringVar(value="Артикул")
@@ -574,11 +370,16 @@ class ZoneEditor(tk.Toplevel):
         if not os.path.isabs(tpath):
             tpath = os.path.join(base_dir, tpath)
 
-        from PIL import Image, ImageTk
+        from PIL import Image
         self.img = Image.open(tpath).convert("RGB")
         self.W, self.H = self.img.size
         self.zoom = 1.0
-        self.tk_img = ImageTk.PhotoImage(self.img)
+        self.pyramid = ZoomPyramid(self.img)
+        self.tk_img = None
+        # что сейчас нарисовано: (zoom, x0, y0, x1, y1, hq)
+        self._view_key: Optional[Tuple[Any, ...]] = None
+        self._fast_job: Optional[str] = None
+        self._hq_job: Optional[str] = None
 
         toolbar = tk.Frame(self)
         toolbar.pack(side=tk.TOP, fill=tk.X)
@@ -603,19 +404,38 @@ class ZoneEditor(tk.Toplevel):
         ttk.Button(toolbar, text="Сохранить", command=self._save_into_config).pack(side=tk.RIGHT, padx=6)
         ttk.Button(toolbar, text="Сохранить в файл...", command=self._export_config).pack(side=tk.RIGHT, padx=6)
 
+        # Превью строки данных: зоны применяются к конфигу сразу, перерисовываются только изменённые
+        self.preview = None
+        self._preview_row: Optional[Tuple[int, Dict[str, Any]]] = None
+        self._preview_job: Optional[str] = None
+        self.preview_var = tk.BooleanVar(value=False)
+        self.preview_index = tk.IntVar(value=0)
+        self.preview_status = tk.StringVar(value="")
+        preview_bar = tk.Frame(self)
+        preview_bar.pack(side=tk.TOP, fill=tk.X)
+        ttk.Checkbutton(preview_bar, text="Превью строки", variable=self.preview_var,
+                        command=self._toggle_preview).pack(side=tk.LEFT, padx=6)
+        ttk.Spinbox(preview_bar, from_=0, to=10 ** 6, width=7, textvariable=self.preview_index,
+                    command=self._schedule_preview).pack(side=tk.LEFT)
+        ttk.Label(preview_bar, textvariable=self.preview_status).pack(side=tk.LEFT, padx=6)
+        self.preview_index.trace_add("write", lambda *_: self._schedule_preview())
+        for var in (self.font_rel, self.line_spacing, self.font_units):
+            var.trace_add("write", lambda *_: self._schedule_preview(apply_zone=True))
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
+
         # Scrollable canvas
         body = tk.Frame(self)
         body.pack(fill=tk.BOTH, expand=True)
         self.hbar = tk.Scrollbar(body, orient=tk.HORIZONTAL)
         self.vbar = tk.Scrollbar(body, orient=tk.VERTICAL)
         self.canvas = tk.Canvas(body, width=min(self.W, 900), height=min(self.H, 550),
-                                 bg="#333", xscrollcommand=self.hbar.set, yscrollcommand=self.vbar.set)
+                                 bg="#333", xscrollcommand=self._on_xscroll, yscrollcommand=self._on_yscroll)
         self.hbar.config(command=self.canvas.xview)
         self.vbar.config(command=self.canvas.yview)
         self.hbar.pack(side=tk.BOTTOM, fill=tk.X)
         self.vbar.pack(side=tk.RIGHT, fill=tk.Y)
         self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        self.canvas_img = self.canvas.create_image(0, 0, anchor="nw", image=self.tk_img)
+        self.canvas_img = self.canvas.create_image(0, 0, anchor="nw")
 
         self.start_x = self.start_y = None
         self.rect_id = None
@@ -627,17 +447,53 @@ class ZoneEditor(tk.Toplevel):
         self.canvas.bind("<B1-Motion>", self.on_drag)
         self.canvas.bind("<ButtonRelease-1>", self.on_up)
         self.canvas.bind("<MouseWheel>", self.on_wheel)
+        self.canvas.bind("<Configure>", lambda e: self._request_render())
         self._update_scrollregion()
 
     def _update_scrollregion(self):
         zw = int(self.W * self.zoom)
         zh = int(self.H * self.zoom)
         self.canvas.config(scrollregion=(0, 0, zw, zh))
+        self._redraw_overlays()
+        self._request_render()
+
+    def _on_xscroll(self, first, last):
+        self.hbar.set(first, last)
+        self._request_render()
+
+    def _on_yscroll(self, first, last):
+        self.vbar.set(first, last)
+        self._request_render()
+
+    def _request_render(self):
+        # быстрый кадр — после паузы в прокрутке колеса, качественный — когда масштаб перестал меняться
+        for job in (self._fast_job, self._hq_job):
+            if job is not None:
+                self.after_cancel(job)
+        self._fast_job = self.after(WHEEL_DEBOUNCE_MS, self._render_view, False)
+        self._hq_job = self.after(ZOOM_SETTLE_MS, self._render_view, True)
+
+    def _render_view(self, hq: bool):
+        if hq:
+            self._hq_job = None
+        else:
+            self._fast_job = None
+        zw = int(self.W * self.zoom)
+        zh = int(self.H * self.zoom)
+        x0 = max(0, int(self.canvas.canvasx(0)))
+        y0 = max(0, int(self.canvas.canvasy(0)))
+        x1 = min(zw, x0 + self.canvas.winfo_width())
+        y1 = min(zh, y0 + self.canvas.winfo_height())
+        if x1 <= x0 or y1 <= y0:
+            return
+        key = (self.zoom, x0, y0, x1, y1)
+        if self._view_key is not None and self._view_key[:5] == key and (self._view_key[5] or not hq):
+            return
         from PIL import ImageTk
-        scaled = self.img.resize((zw, zh))
-        self.tk_img = ImageTk.PhotoImage(scaled)
+        self.tk_img = ImageTk.PhotoImage(self.pyramid.region(self.zoom, (x0, y0, x1, y1), hq))
         self.canvas.itemconfigure(self.canvas_img, image=self.tk_img)
-        self._redraw_overlays()
+        self.canvas.coords(self.canvas_img, x0, y0)
+        self._view_key = key + (hq,)
 
     def canvas_to_img(self, x, y):
         return x / self.zoom, y / self.zoom
@@ -663,19 +519,92 @@ class ZoneEditor(tk.Toplevel):
 
     def on_down(self, e):
         self.start_x, self.start_y = e.x, e.y
-        ix, iy = self.canvas_to_img(e.x, e.y)
+        ix, iy = self.canvas_to_img(self.canvas.canvasx(e.x), self.canvas.canvasy(e.y))
         self.current_rect = (ix, iy, ix, iy)
         self._redraw_overlays()
 
     def on_drag(self, e):
         if self.current_rect and self.start_x is not None:
             x1, y1, _, _ = self.current_rect
-            ix, iy = self.canvas_to_img(e.x, e.y)
+            ix, iy = self.canvas_to_img(self.canvas.canvasx(e.x), self.canvas.canvasy(e.y))
             self.current_rect = (x1, y1, ix, iy)
             self._redraw_overlays()
 
     def on_up(self, e):
-        pass
+        # щелчок без протягивания не меняет зону
+        if self.preview is not None and self.current_rect is not None:
+            x1, y1, x2, y2 = self.current_rect
+            if abs(x2 - x1) * self.zoom > 2 and abs(y2 - y1) * self.zoom > 2:
+                self._schedule_preview(apply_zone=True)
+
+    def _toggle_preview(self):
+        from imagegen.preview import PreviewRenderer
+        if not self.preview_var.get():
+            if self.preview is not None:
+                self.preview.close()
+                self.preview = None
+            self.pyramid = ZoomPyramid(self.img)
+            self.preview_status.set("")
+            self._view_key = None
+            self._request_render()
+            return
+        if not self.input_path or not os.path.isfile(self.input_path):
+            self.preview_var.set(False)
+            messagebox.showwarning("Внимание", "Для превью выберите файл данных в главном окне")
+            return
+        try:
+            self.preview = PreviewRenderer(self.config_ref, [get_base_dir()])
+        except Exception as e:
+            self.preview_var.set(False)
+            messagebox.showerror("Ошибка", f"Не удалось открыть превью: {e}")
+            return
+        self.pyramid = ZoomPyramid(self.preview.frame)
+        self._view_key = None
+        self._refresh_preview()
+
+    def _schedule_preview(self, apply_zone: bool = False):
+        # параметры зоны и номер строки меняются по символу: перерисовка после короткой паузы
+        if self.preview is None:
+            return
+        if self._preview_job is not None:
+            self.after_cancel(self._preview_job)
+        self._preview_job = self.after(PREVIEW_DEBOUNCE_MS, self._refresh_preview, apply_zone)
+
+    def _refresh_preview(self, apply_zone: bool = False):
+        from imagegen.sources import read_row
+        self._preview_job = None
+        if self.preview is None:
+            return
+        started = time.perf_counter()
+        try:
+            if apply_zone and self.current_rect is not None and self.current_rect[:2] != self.current_rect[2:]:
+                self._apply_zone()
+            index = int(self.preview_index.get())
+            if self._preview_row is None or self._preview_row[0] != index:
+                row = read_row(self.input_path, index, self.config_ref)
+                if row is None:
+                    self.preview_status.set(f"Строки {index} нет в файле данных")
+                    return
+                self._preview_row = (index, row)
+            dirty = self.preview.update(self._preview_row[1])
+        except (tk.TclError, ValueError, OSError) as e:
+            # недописанное число в поле ввода, ошибка в конфиге (PlanError) или в файле данных
+            self.preview_status.set("" if isinstance(e, tk.TclError) else str(e))
+            return
+        if dirty:
+            self.pyramid.update(dirty)
+            self._view_key = None
+            self._render_view(hq=True)
+        status = f"Строка {index}: {(time.perf_counter() - started) * 1000:.0f} мс"
+        if self.preview.photo_pending():
+            status += ", загрузка фото..."
+            self._preview_job = self.after(100, self._refresh_preview)
+        self.preview_status.set(status)
+
+    def _on_close(self):
+        if self.preview is not None:
+            self.preview.close()
+        self.destroy()
 
     def on_wheel(self, e):
         delta = 1 if e.delta > 0 else -1
@@ -683,82 +612,88 @@ class ZoneEditor(tk.Toplevel):
         new_zoom = max(0.2, min(5.0, self.zoom * factor))
         if abs(new_zoom - self.zoom) < 1e-6:
             return
-        cx = self.canvas.canvasx(e.x)
-        cy = self.canvas.canvasy(e.y)
-        rx = cx / max(1, int(self.W * self.zoom))
-        ry = cy / max(1, int(self.H * self.zoom))
+        # точка под курсором остаётся на месте; картинка перерисуется после паузы колеса
+        ix, iy = self.canvas_to_img(self.canvas.canvasx(e.x), self.canvas.canvasy(e.y))
         self.zoom = new_zoom
         self._update_scrollregion()
-        self.canvas.xview_moveto(max(0.0, min(1.0, rx)))
-        self.canvas.yview_moveto(max(0.0, min(1.0, ry)))
+        cx, cy = self.img_to_canvas(ix, iy)
+        self.canvas.xview_moveto(max(0.0, (cx - e.x) / max(1, int(self.W * self.zoom))))
+        self.canvas.yview_moveto(max(0.0, (cy - e.y) / max(1, int(self.H * self.zoom))))
 
     def _save_into_config(self):
         try:
-            mode = self.mode.get()
             if self.rect_id is None and self.current_rect is None:
                 messagebox.showwarning("Внимание", "Выделите прямоугольник мышью на шаблоне")
                 return
-            if self.rect_id:
-                x1, y1, x2, y2 = self.canvas.coords(self.rect_id)
-                x1, y1 = self.canvas_to_img(x1, y1)
-                x2, y2 = self.canvas_to_img(x2, y2)
-            else:
-                x1, y1, x2, y2 = self.current_rect
-            if x1 > x2:
-                x1, x2 = x2, x1
-            if y1 > y2:
-                y1, y2 = y2, y1
-            rel = {
-                "x": x1 / self.W,
-                "y": y1 / self.H,
-                "width": (x2 - x1) / self.W,
-                "height": (y2 - y1) / self.H,
-            }
-            if mode == "image":
-                box = self.config_ref.setdefault("image_box", {})
-                box.update(rel)
-                if not box.get("source_column"):
-                    box["source_column"] = "Ссылка на фото"
-                if not box.get("fit"):
-                    box["fit"] = "contain"
-                messagebox.showinfo("OK", "Image Box сохранён в конфиг")
-            elif mode == "multiline":
-                found = None
-                for mf in self.config_ref.setdefault("multiline_fields", []):
-                    if mf.get("name") == self.field_name.get():
-                        found = mf
-                        break
-                if not found:
-                    found = {"name": self.field_name.get(), "delimiter": "/", "max_lines": 6, "overflow_text": "и т.д.", "anchor": "la", "color": "#000000"}
-                    self.config_ref["multiline_fields"].append(found)
-                found.update({
-                    "x": rel["x"], "y": rel["y"],
-                    "font_size": float(self.font_rel.get()),
-                    "font_units": self.font_units.get(),
-                    "line_spacing": float(self.line_spacing.get())
-                })
-                messagebox.showinfo("OK", "Многострочное поле сохранено в конфиг")
-            else:
-                updated = False
-                for fld in self.config_ref.setdefault("fields", []):
-                    if fld.get("name") == self.field_name.get():
-                        fld.update({
-                            "x": rel["x"], "y": rel["y"], "width": rel["width"], "height": rel["height"],
-                            "font_size": float(self.font_rel.get()), "font_units": self.font_units.get(), "anchor": "la", "color": "#000000"
-                        })
-                        updated = True
-                        break
-                if not updated:
-                    self.config_ref["fields"].append({
-                        "name": self.field_name.get(),
-                        "x": rel["x"], "y": rel["y"], "width": rel["width"], "height": rel["height"],
-                        "font_size": float(self.font_rel.get()), "font_units": self.font_units.get(), "anchor": "la", "color": "#000000"
-                    })
-                messagebox.showinfo("OK", "Поле сохранено в конфиг (зона)")
+            msg = self._apply_zone()
+            if self.preview is not None:
+                self._refresh_preview()
+            messagebox.showinfo("OK", msg)
         except Exception as e:
             import traceback
             messagebox.showerror("Ошибка", traceback.format_exc())
 
+    def _apply_zone(self) -> str:
+        """Записывает выделенную зону в конфиг; возвращает текст для сообщения."""
+        mode = self.mode.get()
+        if self.rect_id:
+            x1, y1, x2, y2 = self.canvas.coords(self.rect_id)
+            x1, y1 = self.canvas_to_img(x1, y1)
+            x2, y2 = self.canvas_to_img(x2, y2)
+        else:
+            x1, y1, x2, y2 = self.current_rect
+        if x1 > x2:
+            x1, x2 = x2, x1
+        if y1 > y2:
+            y1, y2 = y2, y1
+        rel = {
+            "x": x1 / self.W,
+            "y": y1 / self.H,
+            "width": (x2 - x1) / self.W,
+            "height": (y2 - y1) / self.H,
+        }
+        if mode == "image":
+            box = self.config_ref.setdefault("image_box", {})
+            box.update(rel)
+            if not box.get("source_column"):
+                box["source_column"] = "Ссылка на фото"
+            if not box.get("fit"):
+                box["fit"] = "contain"
+            return "Image Box сохранён в конфиг"
+        elif mode == "multiline":
+            found = None
+            for mf in self.config_ref.setdefault("multiline_fields", []):
+                if mf.get("name") == self.field_name.get():
+                    found = mf
+                    break
+            if not found:
+                found = {"name": self.field_name.get(), "delimiter": "/", "max_lines": 6, "overflow_text": "и т.д.", "anchor": "la", "color": "#000000"}
+                self.config_ref["multiline_fields"].append(found)
+            found.update({
+                "x": rel["x"], "y": rel["y"],
+                "font_size": float(self.font_rel.get()),
+                "font_units": self.font_units.get(),
+                "line_spacing": float(self.line_spacing.get())
+            })
+            return "Многострочное поле сохранено в конфиг"
+        else:
+            updated = False
+            for fld in self.config_ref.setdefault("fields", []):
+                if fld.get("name") == self.field_name.get():
+                    fld.update({
+                        "x": rel["x"], "y": rel["y"], "width": rel["width"], "height": rel["height"],
+                        "font_size": float(self.font_rel.get()), "font_units": self.font_units.get(), "anchor": "la", "color": "#000000"
+                    })
+                    updated = True
+                    break
+            if not updated:
+                self.config_ref["fields"].append({
+                    "name": self.field_name.get(),
+                    "x": rel["x"], "y": rel["y"], "width": rel["width"], "height": rel["height"],
+                    "font_size": float(self.font_rel.get()), "font_units": self.font_units.get(), "anchor": "la", "color": "#000000"
+                })
+            return "Поле сохранено в конфиг (зона)"
+
     def _export_config(self):
         import json
         from tkinter import filedialog
@@ -778,6 +713,17 @@ class ZoneEditor(tk.Toplevel):
 
 
 def main() -> None:
+    # нужно для пула процессов рендера в собранном exe
+    import multiprocessing
+    multiprocessing.freeze_support()
+    # Подкоманда в аргументах (python -m image_generator render ...) — headless-режим без окна
+    if len(sys.argv) > 1:
+        from imagegen.cli import main as cli_main
+        sys.exit(cli_main(sys.argv[1:]))
+    if tk is None:
+        print("tkinter не установлен: доступен только CLI (python -m image_generator render ...)",
+              file=sys.stderr)
+        sys.exit(2)
     root = tk.Tk()
     app = ImageGeneratorApp(root)
     root.mainloop()
@@ -785,6 +731,3 @@ def main() -> None:
 
 if __name__ == "__main__":
     main()
-
-
-
@@ -0,0 +1,19 @@
+"""Headless-ядро Image Generator: конфиг, движок рендера и CLI без tkinter."""
+from .config import DEFAULT_CONFIG, deep_merge, get_base_dir, get_run_dir, load_config
+from .engine import RenderEngine, RenderEvent, RenderResult, render
+from .plan import PlanError, RenderPlan, compile_plan
+
+__all__ = [
+    "DEFAULT_CONFIG",
+    "deep_merge",
+    "get_base_dir",
+    "get_run_dir",
+    "load_config",
+    "RenderEngine",
+    "RenderEvent",
+    "RenderResult",
+    "render",
+    "PlanError",
+    "RenderPlan",
+    "compile_plan",
+]
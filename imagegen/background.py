@@ -0,0 +1,117 @@
+"""Удаление однотонного фона с фото товара.
+
+Прежний код считал np.abs(r - rt) на каналах uint8: разность заворачивалась
+по модулю 256, поэтому допуск фактически не работал (у белого фона
+прозрачным становился только чистый #FFFFFF, зато почти чёрные пиксели
+товара пропадали). Здесь расстояние до цвета фона считается в int16, а
+временные буферы выделяются один раз на кадр и переиспользуются по каналам.
+
+Режимы:
+  "color" — прозрачным становится каждый пиксель, близкий к цвету фона;
+  "edge"  — только области такого цвета, связанные с краем кадра, поэтому
+            белые детали внутри товара остаются непрозрачными.
+feather > 0 смягчает край маски (радиус размытия в пикселях).
+"""
+from typing import Optional, Tuple
+
+
+MODES = ("color", "edge")
+# меняется вместе с алгоритмом; входит в ключ кэша обработанных фото
+VERSION = 2
+
+
+def background_mask(arr, color: Tuple[int, int, int], tolerance: int):
+    """Булева маска HxW: пиксели не дальше tolerance от color по каждому каналу."""
+    import numpy as np
+
+    h, w = arr.shape[:2]
+    mask = np.ones((h, w), dtype=bool)
+    diff = np.empty((h, w), dtype=np.int16)
+    close = np.empty((h, w), dtype=bool)
+    for c in range(3):
+        np.subtract(arr[..., c], np.int16(color[c]), out=diff, dtype=np.int16)
+        np.abs(diff, out=diff)
+        np.less_equal(diff, tolerance, out=close)
+        mask &= close
+    return mask
+
+
+def _run_ids(mask):
+    """Номер горизонтального отрезка маски для каждого пикселя (0 — вне маски)."""
+    import numpy as np
+
+    starts = mask.copy()
+    starts[:, 1:] &= ~mask[:, :-1]
+    ids = np.cumsum(starts.ravel(), dtype=np.int32)
+    ids *= mask.ravel()
+    return ids
+
+
+def edge_connected(mask):
+    """Часть маски, связанная (4-связность) с краем кадра.
+
+    Заливка идёт отрезками: достигнутый пиксель распространяется на весь свой
+    горизонтальный отрезок маски, затем на вертикальный, и так до
+    стабилизации. Число проходов равно числу поворотов пути, а не его длине.
+    Работа идёт только по пикселям маски, а не по всему кадру.
+    """
+    import numpy as np
+
+    h, w = mask.shape
+    where = np.flatnonzero(mask)
+    ids_h = _run_ids(mask)[where]
+    ids_v = _run_ids(np.ascontiguousarray(mask.T)).reshape(w, h).T.ravel()[where]
+    border = np.zeros((h, w), dtype=bool)
+    border[[0, -1], :] = True
+    border[:, [0, -1]] = True
+    reach = border.ravel()[where]
+    del border
+    passes = ((ids_h, int(ids_h.max(initial=0)) + 1), (ids_v, int(ids_v.max(initial=0)) + 1))
+    count = int(np.count_nonzero(reach))
+    for step in range(2 * where.size + 2):
+        ids, n = passes[step % 2]
+        hit = np.zeros(n, dtype=bool)
+        hit[ids[reach]] = True
+        reach = hit[ids]
+        new_count = int(np.count_nonzero(reach))
+        # проход без изменений после прохода в другом направлении — заливка замкнута по обоим
+        if new_count == count and step > 0:
+            break
+        count = new_count
+    out = np.zeros(h * w, dtype=bool)
+    out[where[reach]] = True
+    return out.reshape(h, w)
+
+
+def remove_background(img, color: Tuple[int, int, int], tolerance: int, mode: str = "color",
+                      feather: float = 0):
+    """RGBA-копия img с прозрачным фоном.
+
+    Маска считается по одному буферу пикселей исходного кадра; альфа-канал
+    собирается из неё средствами Pillow и ставится в копию кадра на месте.
+    """
+    import numpy as np
+    from PIL import Image, ImageChops, ImageFilter
+
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA")
+    mask = background_mask(np.asarray(img), color, tolerance)
+    if mode == "edge":
+        mask = edge_connected(mask)
+    np.logical_not(mask, out=mask)
+    alpha = Image.fromarray(mask).convert("L")
+    del mask
+    if img.mode == "RGBA":
+        alpha = ImageChops.darker(img.getchannel("A"), alpha)
+    if feather and feather > 0:
+        # min(alpha, размытая alpha): край товара становится полупрозрачным,
+        # а фон не получает ореола
+        alpha = ImageChops.darker(alpha, alpha.filter(ImageFilter.GaussianBlur(feather)))
+    rgba = img.convert("RGBA")
+    rgba.putalpha(alpha)
+    return rgba
+
+
+def alpha_bbox(rgba) -> Optional[Tuple[int, int, int, int]]:
+    """bbox непрозрачной части RGBA или None, если кадр прозрачен целиком."""
+    return rgba.getchannel("A").getbbox()
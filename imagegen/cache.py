@@ -0,0 +1,164 @@
+"""Постоянный кэш исходных фото на диске.
+
+Два слоя, оба адресуются хешем ключа:
+  raw/       — скачанные байты, ключ — URL;
+  processed/ — RGBA после удаления фона и автообрезки (PNG), ключ — URL
+               плюс параметры обработки (remove_bg_color, remove_bg_tolerance,
+               auto_crop).
+
+Размер кэша ограничен max_bytes: при переполнении удаляются давно не
+использованные файлы (LRU по mtime, который обновляется при каждом попадании,
+поэтому порядок сохраняется между запусками). Несколько процессов могут
+работать с одной папкой: запись атомарна (временный файл + rename), а файл,
+удалённый соседом, считается промахом.
+"""
+import hashlib
+import os
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Iterable, Optional
+
+
+RAW = "raw"
+PROCESSED = "processed"
+_EXT = {RAW: ".bin", PROCESSED: ".png"}
+
+
+def cache_key(*parts: Any) -> str:
+    h = hashlib.sha256()
+    for p in parts:
+        h.update(repr(p).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class DiskCache:
+    """Кэш файлов по ключу с вытеснением по суммарному размеру."""
+
+    def __init__(self, root: str, max_bytes: int = 1024 * 1024 * 1024) -> None:
+        self.root = root
+        self.max_bytes = int(max_bytes)
+        self.stats: Counter = Counter()
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._size = 0
+        for layer in (RAW, PROCESSED):
+            os.makedirs(os.path.join(root, layer), exist_ok=True)
+        self._scan()
+
+    def _scan(self) -> None:
+        found = []
+        for layer in (RAW, PROCESSED):
+            for dirpath, _, files in os.walk(os.path.join(self.root, layer)):
+                for name in files:
+                    if name.endswith(".tmp"):
+                        continue
+                    path = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    found.append((st.st_mtime, path, st.st_size))
+        found.sort()
+        for _, path, size in found:
+            self._entries[path] = size
+            self._size += size
+
+    def path(self, layer: str, key: str) -> str:
+        return os.path.join(self.root, layer, key[:2], key + _EXT[layer])
+
+    def contains(self, layer: str, key: str) -> bool:
+        return os.path.isfile(self.path(layer, key))
+
+    def get(self, layer: str, key: str) -> Optional[bytes]:
+        path = self.path(layer, key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            with self._lock:
+                self.stats[f"{layer}_miss"] += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.stats[f"{layer}_hit"] += 1
+            if path in self._entries:
+                self._entries.move_to_end(path)
+            else:
+                self._entries[path] = len(data)
+                self._size += len(data)
+        return data
+
+    def put(self, layer: str, key: str, data: bytes) -> None:
+        path = self.path(layer, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self._size -= old
+            self._entries[path] = len(data)
+            self._size += len(data)
+            self.stats[f"{layer}_bytes_written"] += len(data)
+            self._evict()
+
+    def _evict(self) -> None:
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            path, size = self._entries.popitem(last=False)
+            self._size -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.stats["evicted"] += 1
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def take_stats(self) -> Counter:
+        """Возвращает накопленные счётчики и обнуляет их."""
+        with self._lock:
+            stats, self.stats = self.stats, Counter()
+        return stats
+
+
+def open_cache(config: Dict[str, Any], base_dirs: Iterable[Optional[str]] = ()) -> Optional[DiskCache]:
+    """Создаёт DiskCache по секции "cache" конфига или None, если кэш выключен.
+
+    Кэш включается ключом cache.enabled либо прежним флагом
+    image_box.save_processed_png (тогда папка берётся из save_processed_png_dir).
+    """
+    cache_cfg = config.get("cache", {}) or {}
+    img_box = config.get("image_box", {}) or {}
+    enabled = cache_cfg.get("enabled")
+    if enabled is None:
+        enabled = bool(img_box.get("save_processed_png", False))
+    if not enabled:
+        return None
+    root = cache_cfg.get("dir") or img_box.get("save_processed_png_dir") or "cache"
+    if not os.path.isabs(root):
+        base = next((d for d in base_dirs if d), os.getcwd())
+        root = os.path.join(base, root)
+    max_mb = float(cache_cfg.get("max_mb", 1024) or 0)
+    return DiskCache(root, max_bytes=int(max_mb * 1024 * 1024))
+
+
+def format_cache_stats(stats: Counter, cache: Optional[DiskCache] = None) -> str:
+    parts = []
+    for layer in (RAW, PROCESSED):
+        hit, miss = stats.get(f"{layer}_hit", 0), stats.get(f"{layer}_miss", 0)
+        if hit or miss:
+            parts.append(f"{layer}: {hit}/{hit + miss} попаданий")
+    written = stats.get(f"{RAW}_bytes_written", 0) + stats.get(f"{PROCESSED}_bytes_written", 0)
+    parts.append(f"записано {written / 1024 / 1024:.1f} МБ")
+    parts.append(f"вытеснено {stats.get('evicted', 0)}")
+    if cache is not None:
+        parts.append(f"размер {cache.size / 1024 / 1024:.1f} МБ")
+    return "Кэш: " + ", ".join(parts)
@@ -0,0 +1,244 @@
+"""Консольный запуск рендера без GUI.
+
+    python -m image_generator render --config conf.json --input data.xlsx --out output
+
+Распределённый рендер через общую папку (см. imagegen.shard):
+
+    python -m imagegen shard init --config conf.json --input data.xlsx --queue /mnt/share/job
+    python -m imagegen shard work --queue /mnt/share/job      # на каждом узле, сколько угодно раз
+    python -m imagegen shard status --queue /mnt/share/job
+
+Сервис с прогретым engine, задания по HTTP и из папки (см. imagegen.service):
+
+    python -m imagegen serve --config conf.json --port 8777 --drop /srv/render/inbox
+
+Проверка данных без рендера (см. imagegen.validate):
+
+    python -m imagegen check --config conf.json --input data.xlsx --report report.csv
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import List, Optional
+
+from .config import get_run_dir, load_config
+from .engine import RenderEvent, render
+from .plan import PlanError
+from .prepare import ImageTooLarge
+
+
+COMMANDS = ("render", "shard", "serve", "check")
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="image_generator", description="Генерация изображений по шаблону")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("render", help="Сгенерировать изображения по файлу данных")
+    p.add_argument("--config", help="JSON конфиг (по умолчанию DEFAULT_CONFIG)")
+    p.add_argument("--input", required=True, help="Файл данных XLSX/XLS/CSV")
+    p.add_argument("--out", help="Папка для изображений (по умолчанию output_dir из конфига)")
+    p.add_argument("-j", "--workers", type=int, help="Число процессов рендера (0 — по числу ядер)")
+    p.add_argument("-f", "--force", action="store_true", help="Нарисовать все строки заново, не глядя в манифест")
+    p.add_argument("--profile", action="store_true", help="Замерить время по стадиям и напечатать таблицу")
+    p.add_argument("--profile-json", metavar="PATH", help="Записать замеры по стадиям в JSON (включает --profile)")
+    p.add_argument("--trace", metavar="PATH", help="Записать трассу Chrome trace event по процессам и потокам")
+    p.add_argument("-q", "--quiet", action="store_true", help="Не печатать строку на каждый файл")
+    sh = sub.add_parser("shard", help="Распределённый рендер через общую папку")
+    shard_sub = sh.add_subparsers(dest="shard_command", required=True)
+    p = shard_sub.add_parser("init", help="Разложить строки по шардам (координатор)")
+    p.add_argument("--config", help="JSON конфиг (по умолчанию DEFAULT_CONFIG)")
+    p.add_argument("--input", required=True, help="Файл данных XLSX/XLS/CSV")
+    p.add_argument("--queue", required=True, help="Папка очереди на общем диске")
+    p.add_argument("--shard-rows", type=int, help="Строк в шарде (по умолчанию shard.rows)")
+    p.add_argument("--out", help="Общая папка для изображений (относительно --queue; по умолчанию output)")
+    p = shard_sub.add_parser("work", help="Брать и рендерить шарды, пока они не кончатся")
+    p.add_argument("--queue", required=True, help="Папка очереди на общем диске")
+    p.add_argument("--out", help="Папка для изображений на этом узле (по умолчанию из задания)")
+    p.add_argument("-j", "--workers", type=int, help="Число процессов рендера на шард")
+    p.add_argument("-f", "--force", action="store_true", help="Нарисовать строки заново, не глядя в манифест")
+    p.add_argument("--stale-after", type=float, help="Через сколько секунд без heartbeat захват считается брошенным")
+    p.add_argument("--heartbeat", type=float, help="Как часто обновлять свой захват, секунды")
+    p.add_argument("--poll", type=float, help="Пауза, когда свободных шардов нет, секунды")
+    p.add_argument("-q", "--quiet", action="store_true", help="Не печатать строку на каждый файл")
+    p = shard_sub.add_parser("status", help="Состояние очереди")
+    p.add_argument("--queue", required=True, help="Папка очереди на общем диске")
+    p.add_argument("--json", action="store_true", help="Вывести сводку в JSON")
+    p = sub.add_parser("serve", help="Сервис рендера: задания по HTTP и из папки")
+    p.add_argument("--config", help="JSON конфиг для заданий без своего (по умолчанию DEFAULT_CONFIG)")
+    p.add_argument("--out", help="Папка для изображений по умолчанию (иначе output_dir из конфига)")
+    p.add_argument("--host", help="Адрес HTTP (по умолчанию service.host)")
+    p.add_argument("--port", type=int, help="Порт HTTP; 0 — без HTTP (по умолчанию service.port)")
+    p.add_argument("--drop", metavar="DIR", help="Папка заданий *.jsonl (по умолчанию service.drop_dir)")
+    p = sub.add_parser("check", help="Проверить данные без рендера: переполнения, пустые поля, имена, фото")
+    p.add_argument("--config", help="JSON конфиг (по умолчанию DEFAULT_CONFIG)")
+    p.add_argument("--input", required=True, help="Файл данных XLSX/XLS/CSV")
+    p.add_argument("--report", metavar="PATH", help="Отчёт по строкам: .csv или .json")
+    p.add_argument("--images", choices=("head", "cache", "off"), default="head",
+                   help="Проверка фото: head — кэш, затем HEAD-запрос; cache — только кэш; off — не проверять")
+    p.add_argument("--all", action="store_true", help="Включить в отчёт и строки без проблем")
+    p.add_argument("-q", "--quiet", action="store_true", help="Не печатать строку на каждую проблему")
+    return parser
+
+
+def _print_event(ev: RenderEvent, quiet: bool) -> None:
+    if ev.kind == "start":
+        print(f"Строк: {ev.total}")
+    elif ev.kind == "row" and not quiet:
+        print(f"[{ev.done}/{ev.total}] Сохранено: {', '.join(ev.out_names)}")
+    elif ev.kind == "error":
+        print(f"[{ev.done}/{ev.total}] Ошибка в строке {ev.index}: {ev.message}", file=sys.stderr)
+    elif ev.kind == "done" and ev.message:
+        print(ev.message)
+
+
+def cmd_render(args: argparse.Namespace) -> int:
+    config = load_config(args.config)
+    if args.profile or args.profile_json or args.trace:
+        profile = config.setdefault("profile", {})
+        profile["enabled"] = True
+        if args.profile_json:
+            profile["report"] = args.profile_json
+        if args.trace:
+            profile["trace"] = args.trace
+    out_dir = args.out or os.path.join(get_run_dir(), config.get("output_dir", "output"))
+    search_dirs = _search_dirs(args.config)
+    try:
+        result = render(config, args.input, out_dir,
+                        on_event=lambda ev: _print_event(ev, args.quiet),
+                        search_dirs=search_dirs,
+                        workers=args.workers,
+                        force=args.force)
+    except (FileNotFoundError, PlanError, ImageTooLarge) as e:
+        print(e, file=sys.stderr)
+        return 2
+    print(f"Готово: {result.rendered} сохранено, {result.skipped} без изменений, {result.failed} с ошибками.")
+    return 1 if result.failed else 0
+
+
+def _search_dirs(config_path: Optional[str]) -> List[str]:
+    search_dirs = [os.path.dirname(os.path.abspath(config_path))] if config_path else []
+    search_dirs.append(os.getcwd())
+    return search_dirs
+
+
+def cmd_shard(args: argparse.Namespace) -> int:
+    from . import shard
+
+    try:
+        if args.shard_command == "init":
+            config = load_config(args.config)
+            job = shard.init_queue(config, args.input, args.queue, shard_rows=args.shard_rows,
+                                   output_dir=args.out, search_dirs=_search_dirs(args.config))
+            print(f"Очередь {args.queue}: {job['rows']} строк, {job['shards']} шардов по {job['shard_rows']}.")
+            return 0
+        if args.shard_command == "status":
+            status = shard.queue_status(args.queue)
+            if args.json:
+                print(json.dumps(status, ensure_ascii=False, indent=2))
+            else:
+                print(f"Шарды: {status['done']}/{status['shards']} готово, {len(status['claimed'])} в работе, "
+                      f"{status['pending']} в очереди.")
+                print(f"Строки: {status['rendered']} сохранено, {status['skipped']} без изменений, "
+                      f"{status['failed']} с ошибками (всего {status['rows']}).")
+                for idx, message in sorted(status["errors"].items(), key=lambda kv: int(kv[0])):
+                    print(f"Ошибка в строке {idx}: {message}")
+            return 1 if status["failed"] else 0
+
+        def on_event(shard_id: int, ev: RenderEvent) -> None:
+            if ev.kind == "start":
+                print(f"Шард {shard.shard_name(shard_id)}: строк {ev.total}")
+            elif ev.kind != "done":
+                _print_event(ev, args.quiet)
+
+        totals = shard.run_worker(args.queue, output_dir=args.out, workers=args.workers, force=args.force,
+                                  on_event=on_event, stale_after=args.stale_after,
+                                  heartbeat=args.heartbeat, poll=args.poll)
+    except (FileNotFoundError, FileExistsError, PlanError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 2
+    print(f"Готово: шардов {totals['shards']}, {totals['rendered']} сохранено, {totals['skipped']} без изменений, "
+          f"{totals['failed']} с ошибками.")
+    return 1 if totals["failed"] else 0
+
+
+def cmd_serve(args: argparse.Namespace) -> int:
+    from . import service as svc
+
+    config = load_config(args.config)
+    svc_cfg = config.get("service", {}) or {}
+    host = args.host or svc_cfg.get("host") or "127.0.0.1"
+    port = args.port if args.port is not None else int(svc_cfg.get("port", 8777) or 0)
+    drop_dir = args.drop or svc_cfg.get("drop_dir")
+    if not port and not drop_dir:
+        print("Нужен HTTP-порт или папка заданий (--drop)", file=sys.stderr)
+        return 2
+    service = svc.RenderService(config, search_dirs=_search_dirs(args.config), output_dir=args.out,
+                                on_log=lambda text: print(text, flush=True))
+    try:
+        service.start()
+    except (FileNotFoundError, PlanError, ImageTooLarge) as e:
+        print(e, file=sys.stderr)
+        return 2
+    drop = None
+    if drop_dir:
+        drop = svc.DropFolder(service, drop_dir, poll=float(svc_cfg.get("poll", 1.0) or 1.0))
+        drop.start()
+        print(f"Папка заданий: {drop_dir}", flush=True)
+    server = None
+    try:
+        if port:
+            server = svc.serve_http(service, host, port)
+            print(f"HTTP: http://{host}:{server.server_address[1]}/jobs", flush=True)
+            server.serve_forever()
+        else:
+            while True:
+                time.sleep(3600)
+    except KeyboardInterrupt:
+        print("Остановка...", flush=True)
+    finally:
+        if server is not None:
+            server.server_close()
+        if drop is not None:
+            drop.stop()
+        service.stop()
+    return 0
+
+
+def cmd_check(args: argparse.Namespace) -> int:
+    from .engine import RenderEngine
+    from .sources import open_rows
+    from .validate import format_summary, validate, write_report
+
+    config = load_config(args.config)
+    engine = RenderEngine(config, "", search_dirs=_search_dirs(args.config))
+    try:
+        result = validate(engine, open_rows(args.input, config), images=args.images)
+    except (FileNotFoundError, PlanError, ImageTooLarge) as e:
+        print(e, file=sys.stderr)
+        return 2
+    if not args.quiet:
+        for r in result.problem_rows:
+            for i in r.issues:
+                where = f" {i.field}" if i.field else ""
+                print(f"Строка {r.index}{where}: {i.code}" + (f" — {i.detail}" if i.detail else ""))
+    for line in format_summary(result):
+        print(line)
+    if args.report:
+        print(f"Отчёт: {write_report(args.report, result, all_rows=args.all)}")
+    return 1 if result.stats["problem_rows"] else 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = _build_parser().parse_args(argv)
+    if args.command == "render":
+        return cmd_render(args)
+    if args.command == "shard":
+        return cmd_shard(args)
+    if args.command == "serve":
+        return cmd_serve(args)
+    if args.command == "check":
+        return cmd_check(args)
+    return 2
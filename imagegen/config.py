@@ -0,0 +1,170 @@
+import copy
+import json
+import os
+import sys
+from typing import Any, Dict, Iterable, Optional
+
+
+def get_base_dir() -> str:
+    """Возвращает базовую директорию для ресурсов в обычном и frozen-режиме.
+
+    - В обычном запуске: директория проекта (рядом с image_generator.py)
+    - В PyInstaller (frozen): sys._MEIPASS (временная распаковка) либо директория exe
+    """
+    meipass = getattr(sys, "_MEIPASS", None)
+    if meipass and os.path.isdir(meipass):
+        return meipass
+    if getattr(sys, "frozen", False):
+        return os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def get_run_dir() -> str:
+    """Директория запуска для файлов вывода (папка с exe или со скриптом)."""
+    if getattr(sys, "frozen", False):
+        return os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+DEFAULT_CONFIG = {
+    "template": "template.jpg",
+    "output_dir": "output",
+    "fields": [
+        {"name": "Артикул", "x": 0.58, "y": 0.12, "font_size": 0.070, "font_ref": "w", "font_units": "rel", "color": "#000000", "anchor": "la"},
+    ],
+    "multiline_fields": [
+        {
+            "name": "Применимость по КК",
+            "x": 0.62,
+            "y": 0.42,
+            "font_size": 0.050,
+            "font_ref": "w",
+            "font_units": "rel",
+            "color": "#000000",
+            "anchor": "la",
+            "delimiter": "/",
+            "max_lines": 6,
+            "overflow_text": "и т.д.",
+            "line_spacing": 1.25
+        }
+    ],
+    "image_box": {
+        "source_column": "Ссылка на фото",
+        "x": 0.05,
+        "y": 0.28,
+        "width": 0.58,
+        "height": 0.52,
+        "fit": "contain",
+        "remove_bg": True,
+        "remove_bg_color": "#FFFFFF",
+        "remove_bg_tolerance": 20,
+        "auto_crop": True
+    },
+    "font": {
+        "ttf_path": None,
+    },
+    "filename_pattern": "{article_clean}.jpg",
+    "output": {
+        "format": None,
+        "quality": 95,
+        "optimize": False,
+        "progressive": False,
+        "subsampling": None,
+        "writers": 2,
+        "queue": 8,
+        "sink": "dir",
+        "archive": None,
+    },
+    "input": {
+        "sheet": None,
+        "csv_delimiter": ",",
+        "encoding": "utf-8-sig",
+    },
+    "incremental": {
+        "enabled": True,
+    },
+    "download": {
+        "concurrency": 8,
+        "prefetch": 16,
+        "timeout": 10,
+    },
+    "cache": {
+        "enabled": None,
+        "dir": None,
+        "max_mb": 1024,
+        "memory_mb": 256,
+    },
+    "memory": {
+        "budget_mb": 2048,
+        "max_pixels": 50_000_000,
+        "oversize": "downscale",
+    },
+    "parallel": {
+        "workers": 1,
+        "chunk_size": 8,
+    },
+    "shard": {
+        "rows": 500,
+        "stale_after": 120,
+        "heartbeat": 10,
+        "poll": 2,
+    },
+    "service": {
+        "host": "127.0.0.1",
+        "port": 8777,
+        "drop_dir": None,
+        "poll": 1.0,
+        "engines": 4,
+        "keep_jobs": 1000,
+        "memory_ttl": 300,
+    },
+    "log": {
+        "max_lines": 2000,
+        "file": None,
+    },
+    "profile": {
+        "enabled": False,
+        "report": None,
+        "trace": None,
+    },
+}
+
+
+def deep_merge(base: Dict[str, Any], override: Dict[str, Any]) -> Dict[str, Any]:
+    """Рекурсивное слияние словарей: сохраняет вложенные ключи из base,
+    если в override нет значений. Значения в override имеют приоритет."""
+    result = base.copy()
+    for k, v in (override or {}).items():
+        if isinstance(v, dict) and isinstance(result.get(k), dict):
+            result[k] = deep_merge(result[k], v)
+        else:
+            result[k] = v
+    return result
+
+
+def load_config(path: Optional[str] = None) -> Dict[str, Any]:
+    """Загружает JSON конфиг и сливает его с DEFAULT_CONFIG.
+
+    Без пути возвращает независимую копию конфигурации по умолчанию.
+    """
+    if not path:
+        return copy.deepcopy(DEFAULT_CONFIG)
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return deep_merge(copy.deepcopy(DEFAULT_CONFIG), data)
+
+
+def resolve_resource(path: str, search_dirs: Iterable[Optional[str]] = ()) -> str:
+    """Разрешает относительный путь к ресурсу (шаблон, шрифт).
+
+    Перебирает search_dirs по порядку и возвращает первый существующий файл;
+    если ничего не найдено — путь относительно get_base_dir().
+    """
+    if os.path.isabs(path):
+        return path
+    for d in search_dirs:
+        if d:
+            candidate = os.path.join(d, path)
+            if os.path.isfile(candidate):
+                return candidate
+    return os.path.join(get_base_dir(), path)
@@ -0,0 +1,219 @@
+"""Загрузка фото по URL: keep-alive соединения и упреждающая выборка.
+
+HttpClient держит по одному постоянному соединению на хост в каждом потоке
+(если для хоста задан прокси в HTTP_PROXY/HTTPS_PROXY/NO_PROXY — запрос идёт
+через urlopen),
+Prefetcher скачивает фото для следующих строк в пуле потоков, пока текущая
+строка рендерится, и ограничивает число одновременно ожидаемых загрузок.
+"""
+import base64
+import http.client
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple, TypeVar
+from urllib.error import HTTPError
+from urllib.parse import unquote, urljoin, urlsplit, urlunsplit
+from urllib.request import Request, getproxies, proxy_bypass, urlopen
+
+
+USER_AGENT = "Mozilla/5.0"
+MAX_REDIRECTS = 5
+
+T = TypeVar("T")
+
+
+class FetchError(IOError):
+    """Ошибка загрузки фото; сериализуется между процессами без потерь."""
+
+
+class HttpClient:
+    """HTTP(S) GET с переиспользованием соединения на хост (отдельно на поток)."""
+
+    def __init__(self, timeout: float = 10, headers: Optional[Dict[str, str]] = None) -> None:
+        self.timeout = timeout
+        self.headers = {"User-Agent": USER_AGENT}
+        self.headers.update(headers or {})
+        self._local = threading.local()
+        self._proxies = getproxies()
+        self._bypass: Dict[str, bool] = {}
+
+    def _pool(self) -> Dict[Tuple[str, str], http.client.HTTPConnection]:
+        pool = getattr(self._local, "conns", None)
+        if pool is None:
+            pool = self._local.conns = {}
+        return pool
+
+    def _connection(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        pool = self._pool()
+        conn = pool.get((scheme, netloc))
+        if conn is None:
+            cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+            conn = pool[(scheme, netloc)] = cls(netloc, timeout=self.timeout)
+        return conn
+
+    def _drop(self, scheme: str, netloc: str) -> None:
+        conn = self._pool().pop((scheme, netloc), None)
+        if conn is not None:
+            conn.close()
+
+    def _request(self, scheme: str, netloc: str, path: str, method: str = "GET",
+                 headers: Optional[Dict[str, str]] = None) -> http.client.HTTPResponse:
+        # повторная попытка нужна, если сервер уже закрыл keep-alive соединение
+        for attempt in (0, 1):
+            conn = self._connection(scheme, netloc)
+            try:
+                conn.request(method, path, headers=dict(self.headers, **(headers or {})))
+                return conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError,
+                    http.client.CannotSendRequest, http.client.ResponseNotReady):
+                self._drop(scheme, netloc)
+                if attempt:
+                    raise
+            except Exception:
+                self._drop(scheme, netloc)
+                raise
+        raise FetchError(f"{scheme}://{netloc}{path}: соединение недоступно")
+
+    def _split(self, url: str) -> Tuple[str, str, str, Dict[str, str], bool]:
+        """(схема, хост[:порт], путь, заголовки, direct) для запроса по url.
+
+        user:pass@ из URL не попадает в хост, а уходит заголовком Basic.
+        direct=False — запрос идёт через urlopen: схема не http(s) или для
+        хоста задан прокси.
+        """
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        userinfo, _, netloc = parts.netloc.rpartition("@")
+        headers: Dict[str, str] = {}
+        if userinfo:
+            user, _, password = userinfo.partition(":")
+            token = base64.b64encode(f"{unquote(user)}:{unquote(password)}".encode("utf-8")).decode("ascii")
+            headers["Authorization"] = f"Basic {token}"
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        direct = scheme in ("http", "https")
+        if direct and self._proxies.get(scheme):
+            host = parts.hostname or ""
+            bypass = self._bypass.get(host)
+            if bypass is None:
+                bypass = self._bypass[host] = bool(proxy_bypass(host))
+            direct = bypass
+        return scheme, netloc, path, headers, direct
+
+    def _urlopen(self, url: str, headers: Dict[str, str], method: Optional[str] = None):
+        # urlopen сам берёт прокси из окружения; userinfo в URL ему передавать нельзя
+        parts = urlsplit(url)
+        url = urlunsplit(parts._replace(netloc=parts.netloc.rpartition("@")[2]))
+        req = Request(url, headers=dict(self.headers, **headers), method=method)
+        return urlopen(req, timeout=self.timeout)
+
+    def get(self, url: str) -> bytes:
+        for _ in range(MAX_REDIRECTS + 1):
+            scheme, netloc, path, headers, direct = self._split(url)
+            if not direct:
+                try:
+                    with self._urlopen(url, headers) as resp:
+                        return resp.read()
+                except HTTPError as e:
+                    raise FetchError(f"{url}: HTTP {e.code} {e.reason}") from None
+            resp = self._request(scheme, netloc, path, headers=headers)
+            try:
+                data = resp.read()
+            finally:
+                if resp.will_close:
+                    self._drop(scheme, netloc)
+            if resp.status in (301, 302, 303, 307, 308):
+                location = resp.getheader("Location")
+                if not location:
+                    raise FetchError(f"{url}: редирект без Location")
+                url = urljoin(url, location)
+                continue
+            if resp.status >= 400:
+                raise FetchError(f"{url}: HTTP {resp.status} {resp.reason}")
+            return data
+        raise FetchError(f"{url}: слишком много редиректов")
+
+    def head(self, url: str) -> int:
+        """HTTP-статус URL после редиректов, без загрузки тела.
+
+        Серверу, который не принимает HEAD (405, 501), отправляется GET
+        первого байта (Range). Для других схем (file: и т.п.) — 200, если
+        ресурс открывается; иначе исключение.
+        """
+        method, extra = "HEAD", {}
+        for _ in range(MAX_REDIRECTS + 1):
+            scheme, netloc, path, headers, direct = self._split(url)
+            headers.update(extra)
+            if not direct:
+                http_url = scheme in ("http", "https")
+                try:
+                    with self._urlopen(url, headers, method if http_url else None):
+                        return 200
+                except HTTPError as e:
+                    if e.code in (405, 501) and method == "HEAD":
+                        method, extra = "GET", {"Range": "bytes=0-0"}
+                        continue
+                    return e.code
+            resp = self._request(scheme, netloc, path, method, headers)
+            try:
+                resp.read()
+            finally:
+                if resp.will_close:
+                    self._drop(scheme, netloc)
+            if resp.status in (301, 302, 303, 307, 308):
+                location = resp.getheader("Location")
+                if not location:
+                    raise FetchError(f"{url}: редирект без Location")
+                url = urljoin(url, location)
+                continue
+            if resp.status in (405, 501) and method == "HEAD":
+                method, extra = "GET", {"Range": "bytes=0-0"}
+                continue
+            return resp.status
+        raise FetchError(f"{url}: слишком много редиректов")
+
+
+class Prefetcher:
+    """Упреждающая загрузка: пока рендерится строка N, качаются N+1..N+window.
+
+    iterate() отдаёт элементы в исходном порядке вместе с результатом загрузки:
+    bytes, FetchError (загрузка не удалась) или None (для строки нет URL).
+    """
+
+    def __init__(self, fetch: Callable[[str], bytes], concurrency: int = 8, window: int = 16) -> None:
+        self.fetch = fetch
+        self.concurrency = max(1, int(concurrency))
+        self.window = max(1, int(window))
+
+    def _fetch(self, url: str) -> Any:
+        try:
+            return self.fetch(url)
+        except Exception as e:
+            return FetchError(f"{type(e).__name__}: {e}")
+
+    def iterate(self, items: Iterable[T], url_of: Callable[[T], str]) -> Iterator[Tuple[T, Any]]:
+        pending: "deque[Tuple[T, Optional[Future]]]" = deque()
+        it = iter(items)
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="prefetch")
+        try:
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < self.window:
+                    try:
+                        item = next(it)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    url = url_of(item)
+                    pending.append((item, executor.submit(self._fetch, url) if url else None))
+                if not pending:
+                    break
+                item, fut = pending.popleft()
+                yield item, (fut.result() if fut is not None else None)
+        finally:
+            for _, fut in pending:
+                if fut is not None:
+                    fut.cancel()
+            executor.shutdown(wait=False)
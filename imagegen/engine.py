@@ -0,0 +1,1043 @@
+"""Headless-движок рендера карточек по шаблону.
+
+Не зависит от tkinter: GUI и CLI используют один и тот же код построчной
+обработки (загрузка шаблона, вставка image_box, fields, multiline_fields,
+формирование имени файла).
+"""
+import io
+import json
+import os
+import re
+import shutil
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from . import background
+from .cache import PROCESSED, RAW, cache_key, format_cache_stats, open_cache
+from .config import deep_merge, get_run_dir, resolve_resource
+from .download import FetchError, HttpClient, Prefetcher
+from .fonts import FontCache, format_font_stats
+from .layout import TextLayout, format_layout_stats
+from .memo import MemoryCache, format_dedup_stats, image_nbytes
+from .memory import MB, MemoryBudget, canvas_bytes, format_memory_stats, photo_bytes, probe
+from .manifest import MANIFEST_NAME, Manifest, format_manifest_stats, row_key, run_fingerprint
+from .plan import (FieldPlan, ImageBoxPlan, MultilinePlan, PlanError, RenderPlan, compile_plan,
+                   resolve_coord)
+from .prepare import ImageTooLarge, prepare_source, resample_filter
+from .sources import open_rows
+from .timing import Timings, format_stage_table, stage_report
+from .writer import ArchiveSink, WriterPool, encode_image, open_sink, write_image
+
+
+ARTICLE_COLUMNS = ("Артикул", "артикул", "Article", "article")
+# ключи варианта, которые не относятся к конфигу рендера
+VARIANT_KEYS = ("name", "scale")
+# ключи, которые меняют только имя файла и кодирование, а не саму картинку
+_ENCODE_ONLY_KEYS = ("filename_pattern", "output")
+_OWN_BOX = object()
+
+
+@dataclass
+class RenderEvent:
+    """Событие прогресса рендера.
+
+    kind: "start" | "row" | "skip" | "error" | "done"; "skip" — файл не
+    изменился с прошлого прогона (см. imagegen.manifest). total — оценка числа строк
+    (файл данных читается потоково); в событии "done" — фактическое число.
+    out_name — файл строки (первый из out_names, если заданы "variants").
+    stats — счётчики строки в "row" и "error" (например photo_error), всего
+    прогона — в "done".
+    """
+    kind: str
+    index: int = -1
+    done: int = 0
+    total: int = 0
+    out_name: Optional[str] = None
+    message: str = ""
+    stats: Dict[str, int] = field(default_factory=dict)
+    out_names: List[str] = field(default_factory=list)
+
+    @property
+    def progress(self) -> float:
+        if self.total <= 0:
+            return 100.0 if self.kind == "done" else 0.0
+        return min(100.0, self.done * 100.0 / self.total)
+
+
+@dataclass
+class RenderResult:
+    """Итог прогона: число строк, сохранённые файлы и ошибки по строкам."""
+    total: int = 0
+    rendered: int = 0
+    skipped: int = 0
+    failed: int = 0
+    outputs: List[str] = field(default_factory=list)
+    errors: Dict[int, str] = field(default_factory=dict)
+    stats: Dict[str, int] = field(default_factory=dict)
+
+
+@lru_cache(maxsize=4096)
+def clean_multiline_parts(text_value: str, delimiter: str) -> Tuple[str, ...]:
+    """Разбивает значение по разделителю и чистит токены от годов выпуска.
+
+    Результат запоминается: варианты вывода и строки с одинаковой
+    применимостью не чистят текст заново.
+    """
+    parts = [p.strip() for p in str(text_value).split(delimiter) if p.strip()]
+    cleaned_parts = []
+    for p in parts:
+        p = re.sub(r"\b(19|20)\d{2}\b\s*[-–—]?\s*\b(19|20)\d{2}\b", "", p)
+        p = re.sub(r"\b(19|20)\d{2}\b", "", p)
+        p = re.sub(r"[\s\-–—/:]+$", "", p)
+        p = re.sub(r"\s{2,}", " ", p).strip()
+        if p:
+            cleaned_parts.append(p)
+    return tuple(cleaned_parts)
+
+
+@dataclass
+class Variant:
+    """Вариант вывода из "variants": свой engine (шаблон, план, формат, имя файла).
+
+    renderer — engine, чья картинка берётся для варианта: варианты, которые
+    отличаются только filename_pattern, output и scale, используют одну
+    картинку на строку.
+    """
+    name: str
+    engine: "RenderEngine"
+    scale: float
+    renderer: "RenderEngine"
+
+
+class RenderEngine:
+    """Построчный рендер карточек по конфигу.
+
+    Engine создаётся один раз на прогон; конфиг компилируется в RenderPlan
+    (см. imagegen.plan) при первом обращении, render_row() рисует одну строку
+    по плану, run() проходит по всему файлу данных и отдаёт события прогресса.
+    """
+
+    def __init__(self, config: Dict[str, Any], output_dir: str,
+                 search_dirs: Optional[List[str]] = None,
+                 plan: Optional[RenderPlan] = None) -> None:
+        self.config = config
+        self.output_dir = output_dir
+        self.search_dirs = list(search_dirs or [])
+        self.template_path = resolve_resource(config.get("template", "template.jpg"), self.search_dirs)
+        font_cfg = config.get("font", {}) or {}
+        variants = {k: self._font_file(v) for k, v in (font_cfg.get("variants") or {}).items()}
+        # шаблон и шрифты загружаются один раз на engine (т.е. на процесс-воркер)
+        self.fonts = FontCache(self._font_file(font_cfg.get("ttf_path")), variants,
+                               maxsize=int(font_cfg.get("cache_size", 64) or 64))
+        self._plan: Optional[RenderPlan] = plan
+        self.layout = TextLayout()
+        self._base = None
+        self._baked: Set[Tuple[str, int]] = set()
+        dl_cfg = config.get("download", {}) or {}
+        self.http = HttpClient(timeout=float(dl_cfg.get("timeout", 10) or 10))
+        self.cache = open_cache(config, [get_run_dir()])
+        # повторяющиеся в прогоне фото: вписанные в зону картинки и скачанные байты
+        memory = int(float((config.get("cache", {}) or {}).get("memory_mb", 256) or 0) * 1024 * 1024)
+        self.photos: Optional[MemoryCache] = None
+        self.downloads: Optional[MemoryCache] = None
+        if memory > 0:
+            # сбой загрузки не запоминается: следующая строка с тем же URL качает заново
+            self.photos = MemoryCache(memory * 3 // 4, lambda v: image_nbytes(v[0]), prefix="photo",
+                                      transient=(FetchError,))
+            self.downloads = MemoryCache(memory // 4, prefix="fetch", transient=(FetchError,))
+        ib_cfg = config.get("image_box", {}) or {}
+        self.debug_dir = None
+        if ib_cfg.get("debug_remove_bg"):
+            debug_dir = ib_cfg.get("debug_dir") or "cache"
+            self.debug_dir = debug_dir if os.path.isabs(debug_dir) else os.path.join(get_run_dir(), debug_dir)
+        prof_cfg = config.get("profile", {}) or {}
+        trace = prof_cfg.get("trace")
+        # выключенные замеры почти ничего не стоят: span() отдаёт пустой контекст
+        self.timings = Timings(bool(prof_cfg.get("enabled")), os.path.abspath(trace) if trace else None)
+        mem_cfg = config.get("memory", {}) or {}
+        # предел кадра на задание (см. imagegen.prepare) и бюджет строк в работе
+        self.max_pixels = int(mem_cfg.get("max_pixels", 0) or 0)
+        self.downscale = str(mem_cfg.get("oversize", "downscale")).lower() != "reject"
+        self.memory = MemoryBudget(int(float(mem_cfg.get("budget_mb", 0) or 0) * MB))
+        self.stats: Counter = Counter()
+        # архив из output.sink на время run_rows(); None — отдельные файлы
+        self.sink: Optional[ArchiveSink] = None
+        self._variants: Optional[List[Variant]] = None
+        # обработанные фото до вписывания в зону, общие для вариантов
+        self.sources: Optional[MemoryCache] = None
+        # размер подготовки фото: своя зона или общий для всех вариантов
+        self._shared_box: Any = _OWN_BOX
+
+    def _font_file(self, path: Optional[str]) -> Optional[str]:
+        # относительный путь ищется от текущей папки, затем в search_dirs (папка шардов и т.п.)
+        if path and not os.path.isabs(path) and not os.path.isfile(path):
+            return resolve_resource(path, self.search_dirs)
+        return path
+
+    def check(self) -> None:
+        """Проверяет ресурсы и конфиг прогона до чтения данных.
+
+        Бросает FileNotFoundError без шаблона, PlanError при ошибках в конфиге
+        и ImageTooLarge, если шаблон больше memory.max_pixels.
+        """
+        if not os.path.isfile(self.template_path):
+            raise FileNotFoundError(f"Не найден шаблон: {self.template_path}")
+        W, H = self.plan.size
+        if self.max_pixels and W * H > self.max_pixels:
+            raise ImageTooLarge(f"Шаблон {W}x{H} больше memory.max_pixels ({self.max_pixels})")
+        for v in self.variants:
+            v.engine.check()
+
+    @property
+    def variants(self) -> List[Variant]:
+        """Варианты вывода из "variants"; пустой список — одна картинка на строку по самому конфигу.
+
+        Вариант — конфиг верхнего уровня с заменёнными ключами варианта
+        (template, fields, image_box, output, filename_pattern и т.д.) и
+        масштабом scale готовой картинки. Engine вариантов делят с этим
+        engine загрузки, кэши и обработанные фото.
+        """
+        if self._variants is None:
+            self._variants = self._build_variants()
+        return self._variants
+
+    def _build_variants(self) -> List[Variant]:
+        specs = self.config.get("variants") or []
+        if not specs:
+            return []
+        base = {k: v for k, v in self.config.items() if k != "variants"}
+        errors: List[str] = []
+        variants: List[Variant] = []
+        renderers: Dict[str, RenderEngine] = {}
+        names: Dict[Tuple[str, Optional[str]], int] = {}
+        if self.photos is not None:
+            self.sources = MemoryCache(self.photos.max_bytes // 3, image_nbytes, prefix="source",
+                                       transient=(FetchError,))
+        for i, spec in enumerate(specs):
+            where = f"variants[{i}]"
+            if not isinstance(spec, dict):
+                errors.append(f"{where}: ожидается объект")
+                continue
+            try:
+                scale = float(spec.get("scale", 1) or 1)
+            except (TypeError, ValueError):
+                scale = 0
+            if scale <= 0:
+                errors.append(f"{where}.scale: ожидается число больше 0")
+                scale = 1.0
+            config = deep_merge(base, {k: v for k, v in spec.items() if k not in VARIANT_KEYS})
+            engine = RenderEngine(config, self.output_dir, search_dirs=self.search_dirs)
+            engine._share(self)
+            try:
+                plan = engine.plan
+            except PlanError as e:
+                errors.extend(f"{where}: {err}" for err in e.errors)
+                continue
+            key = (plan.filename_pattern, plan.output.ext)
+            if key in names:
+                errors.append(f"{where}: filename_pattern совпадает с variants[{names[key]}]")
+            names.setdefault(key, i)
+            render_key = json.dumps({k: v for k, v in config.items() if k not in _ENCODE_ONLY_KEYS},
+                                    sort_keys=True, ensure_ascii=False, default=str)
+            renderer = renderers.setdefault(render_key, engine)
+            variants.append(Variant(str(spec.get("name") or f"v{i}"), engine, scale, renderer))
+        if errors:
+            raise PlanError(errors)
+        # фото готовится один раз под самую крупную зону и вписывается в зону каждого варианта
+        boxes = [v.engine.plan.image_box for v in variants if v.engine.plan.image_box is not None]
+        if boxes:
+            box = None
+            if all(ib.prepare_box is not None for ib in boxes):
+                box = (max(ib.prepare_box[0] for ib in boxes), max(ib.prepare_box[1] for ib in boxes))
+            for engine in [self] + [v.engine for v in variants]:
+                engine._shared_box = box
+        return variants
+
+    def _share(self, parent: "RenderEngine") -> None:
+        # вариант качает, кэширует и замеряет через engine верхнего уровня
+        self.http = parent.http
+        self.cache = parent.cache
+        self.photos = parent.photos
+        self.downloads = parent.downloads
+        self.timings = parent.timings
+        self.max_pixels, self.downscale = parent.max_pixels, parent.downscale
+        self.sources = parent.sources
+
+    @property
+    def plan(self) -> RenderPlan:
+        if self._plan is None:
+            from PIL import Image
+
+            # размер берётся из заголовка файла, без декодирования
+            with Image.open(self.template_path) as tpl:
+                size = tpl.size
+            self._plan = compile_plan(self.config, size, self.fonts)
+        return self._plan
+
+    def load_font(self, size: int, variant: Optional[str] = None):
+        return self.fonts.get(size, variant)
+
+    def output_name(self, idx: int, row) -> str:
+        article_value = None
+        for col in ARTICLE_COLUMNS:
+            article_value = row.get(col)
+            if article_value:
+                break
+        article_clean = ""
+        if article_value is not None:
+            article_clean = re.sub(r"[^0-9A-Za-z]+", "", str(article_value)).lower()
+        out_name = None
+        pattern = self.plan.filename_pattern
+        if "{article_clean}" in pattern and article_clean:
+            out_name = pattern.replace("{article_clean}", article_clean)
+        if not out_name:
+            # без артикула имя строится по номеру строки
+            out_name = pattern.replace("{article_clean}", f"row{idx:04d}").format(row_index=idx)
+        ext = self.plan.output.ext
+        if ext and not out_name.lower().endswith(ext):
+            out_name = os.path.splitext(out_name)[0] + ext
+        return out_name
+
+    def output_names(self, idx: int, row) -> List[str]:
+        """Имена файлов строки: по одному на вариант или одно имя по filename_pattern."""
+        if self.variants:
+            return [v.engine.output_name(idx, row) for v in self.variants]
+        return [self.output_name(idx, row)]
+
+    def source_url(self, row) -> str:
+        """URL фото для image_box или пустая строка."""
+        ib = self.plan.image_box
+        src_col = ib.source_column if ib is not None else None
+        return str(row.get(src_col, "") or "").strip() if src_col else ""
+
+    def prefetcher(self) -> Optional[Prefetcher]:
+        """Prefetcher по секции "download" или None, если упреждение выключено."""
+        dl_cfg = self.config.get("download", {}) or {}
+        concurrency = int(dl_cfg.get("concurrency", 0) or 0)
+        if concurrency <= 0 or not self.config.get("image_box"):
+            return None
+        return Prefetcher(self.fetch_source, concurrency=concurrency,
+                          window=int(dl_cfg.get("prefetch", concurrency * 2) or 1))
+
+    def render_row(self, idx: int, row, source=None):
+        """Рисует одну строку данных и возвращает готовое RGB-изображение.
+
+        source — заранее скачанное фото (bytes) или ошибка его загрузки;
+        при None фото скачивается здесь же.
+        """
+        with self.timings.span("render", {"row": idx}):
+            return self._render_row(row, source)
+
+    def _render_row(self, row, source=None):
+        from PIL import ImageDraw
+
+        plan = self.plan
+        base_img = self.base_layer().copy()
+        draw = ImageDraw.Draw(base_img)
+        if plan.image_box is not None:
+            self._paste_image(base_img, plan.image_box, row, source)
+        with self.timings.span("text"):
+            for fp in plan.fields:
+                if ("field", fp.index) not in self._baked:
+                    self._draw_field(draw, fp, self._field_text(fp, row))
+            # многострочные поля
+            for mp in plan.multiline_fields:
+                raw = row.get(mp.name, "")
+                self._draw_multiline(draw, mp, "" if raw is None else str(raw),
+                                     title_baked=("title", mp.index) in self._baked)
+        return base_img
+
+    def base_layer(self):
+        """Декодированный шаблон с запечёнными статичными элементами.
+
+        Строится один раз на engine; render_row() получает его копию.
+        Статичными считаются заголовки multiline_fields ("Применимость:")
+        и поля с постоянным "text". Элемент запекается, только если он не
+        пересекается с зоной фото: иначе фото легло бы поверх него, а не под.
+        """
+        if self._base is not None:
+            return self._base
+        from PIL import Image, ImageDraw
+
+        plan = self.plan
+        with Image.open(self.template_path) as tpl:
+            base = tpl.convert("RGB")
+        size = base.size
+        photo = None
+        if plan.image_box is not None and plan.image_box.source_column:
+            photo = plan.image_box.region(*size)
+        draw = ImageDraw.Draw(base)
+        baked: Set[Tuple[str, int]] = set()
+
+        def bake(key: Tuple[str, int], paint: Callable[[Any], Any]) -> None:
+            scratch = Image.new("RGBA", size, (0, 0, 0, 0))
+            paint(ImageDraw.Draw(scratch))
+            bbox = scratch.getbbox()
+            if bbox and photo and not (bbox[2] <= photo[0] or bbox[0] >= photo[2]
+                                       or bbox[3] <= photo[1] or bbox[1] >= photo[3]):
+                return
+            paint(draw)
+            baked.add(key)
+
+        for fp in plan.fields:
+            if fp.text is not None:
+                bake(("field", fp.index), lambda d, fp=fp: self._draw_field(d, fp, fp.text))
+        for mp in plan.multiline_fields:
+            if mp.title_fits:
+                bake(("title", mp.index), lambda d, mp=mp: self._draw_title(d, mp))
+        self._base, self._baked = base, baked
+        return base
+
+    def _prepare_box(self) -> Optional[Tuple[int, int]]:
+        """Размер, под который готовится фото: зона image_box или общий для вариантов."""
+        if self._shared_box is _OWN_BOX:
+            return self.plan.image_box.prepare_box
+        return self._shared_box
+
+    def _processed_key(self, url: str) -> str:
+        ib = self.plan.image_box
+        key = (url, ib.bg_color, ib.tolerance, ib.auto_crop, background.VERSION, ib.bg_mode, ib.feather)
+        prepare_box = self._prepare_box()
+        if prepare_box is not None:
+            # фото уменьшено под зону, поэтому результат зависит и от её размера
+            key += (prepare_box, ib.oversample)
+        return cache_key(*key)
+
+    def _uses_processed_cache(self) -> bool:
+        ib = self.plan.image_box
+        return self.cache is not None and ib is not None and ib.remove_bg
+
+    def fetch_source(self, url: str) -> Optional[bytes]:
+        """Скачивает фото (через кэш сырых байт).
+
+        Возвращает None, если обработанное фото уже лежит в кэше на диске или
+        в памяти прогона и качать ничего не нужно. Одновременные загрузки
+        одного URL объединяются (см. imagegen.memo).
+        """
+        if self.photos is not None and self._photo_key(url) in self.photos:
+            return None
+        if self._uses_processed_cache() and self.cache.contains(PROCESSED, self._processed_key(url)):
+            return None
+        if self.downloads is not None:
+            return self.downloads.get_or_compute(url, lambda: self._download(url))
+        return self._download(url)
+
+    def is_cached(self, url: str) -> bool:
+        """Лежит ли фото в кэше на диске: обработанное или сырые байты."""
+        if self.cache is None:
+            return False
+        if self._uses_processed_cache() and self.cache.contains(PROCESSED, self._processed_key(url)):
+            return True
+        return self.cache.contains(RAW, cache_key(url))
+
+    def _download(self, url: str) -> bytes:
+        if self.cache is not None:
+            data = self.cache.get(RAW, cache_key(url))
+            if data is not None:
+                return data
+        data = self._http_get(url)
+        if self.cache is not None:
+            self.cache.put(RAW, cache_key(url), data)
+        return data
+
+    def _http_get(self, url: str) -> bytes:
+        with self.timings.span("download", {"url": url}):
+            try:
+                data = self.http.get(url)
+            except FetchError:
+                raise
+            except Exception as e:
+                # таймаут, обрыв, DNS — тоже сбой загрузки (см. MemoryCache.transient)
+                raise FetchError(f"{url}: {type(e).__name__}: {e}") from None
+        self.timings.count("bytes_download", len(data))
+        return data
+
+    def load_source(self, url: str, source=None):
+        """Фото для image_box после удаления фона и автообрезки.
+
+        source — результат fetch_source() из упреждающей загрузки, ошибка
+        загрузки или None (тогда фото берётся из кэша или скачивается здесь).
+        """
+        from PIL import Image
+
+        use_processed = self._uses_processed_cache()
+        if use_processed:
+            cached = self.cache.get(PROCESSED, self._processed_key(url))
+            if cached is not None:
+                with self.timings.span("decode"), Image.open(io.BytesIO(cached)) as img:
+                    img.load()
+                    return img
+        if isinstance(source, BaseException):
+            raise source
+        data = source if source is not None else self.fetch_source(url)
+        if data is None:
+            # обработанное фото вытеснили из кэша между упреждающей загрузкой и рендером
+            data = self._http_get(url)
+        ib = self.plan.image_box
+        with Image.open(io.BytesIO(data)) as src_img:
+            pixels = src_img.width * src_img.height
+            with self.timings.span("decode"):
+                src_img = prepare_source(src_img, self._prepare_box(), ib.oversample,
+                                         self.max_pixels, self.downscale)
+                src_img.load()
+            # кадр больше предела, который prepare_source не отклонил, а уменьшил
+            if self.max_pixels and pixels > self.max_pixels:
+                self.stats["photo_downscaled"] += 1
+            src_img = self._process_source(src_img, ib, url)
+        if use_processed and src_img.mode == "RGBA":
+            buf = io.BytesIO()
+            src_img.save(buf, format="PNG")
+            self.cache.put(PROCESSED, self._processed_key(url), buf.getvalue())
+        return src_img
+
+    def _process_source(self, src_img, ib: ImageBoxPlan, url: str = ""):
+        if ib.remove_bg:
+            try:
+                with self.timings.span("remove_bg"):
+                    src_img = background.remove_background(src_img, ib.bg_color, ib.tolerance,
+                                                           ib.bg_mode, ib.feather)
+                    if self.debug_dir:
+                        self._save_debug_mask(src_img, url)
+                    if ib.auto_crop:
+                        bbox = background.alpha_bbox(src_img)
+                        if bbox:
+                            src_img = src_img.crop(bbox)
+            except Exception:
+                src_img = src_img.convert("RGB")
+        else:
+            src_img = src_img.convert("RGB")
+        return src_img
+
+    def _save_debug_mask(self, rgba, url: str) -> None:
+        # debug_remove_bg: маска фона (белое — товар) для подбора допуска и режима
+        os.makedirs(self.debug_dir, exist_ok=True)
+        name = cache_key(url)[:16] + "_mask.png"
+        rgba.getchannel("A").save(os.path.join(self.debug_dir, name))
+
+    def _photo_key(self, url: str) -> Tuple[Any, ...]:
+        ib = self.plan.image_box
+        return (url, self.plan.size, ib.width, ib.height, ib.fit, ib.resample, self._prepare_box(),
+                ib.oversample, ib.remove_bg, ib.bg_color, ib.tolerance, ib.auto_crop, ib.bg_mode, ib.feather)
+
+    def _fit_source(self, ib: ImageBoxPlan, url: str, source, size: Tuple[int, int]):
+        """Фото, вписанное в зону: (картинка, ширина зоны, высота зоны)."""
+        if self.sources is not None:
+            # варианты с теми же параметрами фона берут одно обработанное фото
+            src_img = self.sources.get_or_compute(self._processed_key(url), lambda: self.load_source(url, source))
+        else:
+            src_img = self.load_source(url, source)
+        with self.timings.span("resize"):
+            return self.fit_image(src_img, ib, size)
+
+    @staticmethod
+    def fit_image(src_img, ib: ImageBoxPlan, size: Tuple[int, int]):
+        """Масштабирует фото под зону (fit) на холсте size: (картинка, ширина зоны, высота зоны)."""
+        W, H = size
+        bw = ib.width if ib.width is not None else max(1, resolve_coord(src_img.width, W))
+        bh = ib.height if ib.height is not None else max(1, resolve_coord(src_img.height, H))
+        scale_w = bw / src_img.width
+        scale_h = bh / src_img.height
+        scale = max(scale_w, scale_h) if ib.fit == "cover" else min(scale_w, scale_h)
+        new_w = max(1, int(src_img.width * scale))
+        new_h = max(1, int(src_img.height * scale))
+        return src_img.resize((new_w, new_h), resample=resample_filter(ib.resample)), bw, bh
+
+    def _paste_image(self, base_img, ib: ImageBoxPlan, row, source=None) -> None:
+        # вставка изображения по URL
+        url = self.source_url(row)
+        if not url:
+            return
+        try:
+            if self.photos is not None:
+                # вписанное фото не меняется, вставка его только читает
+                resized, bw, bh = self.photos.get_or_compute(
+                    self._photo_key(url), lambda: self._fit_source(ib, url, source, base_img.size))
+            else:
+                resized, bw, bh = self._fit_source(ib, url, source, base_img.size)
+            off_x = ib.x + (bw - resized.width) // 2
+            off_y = ib.y + (bh - resized.height) // 2
+            with self.timings.span("paste"):
+                if resized.mode == "RGBA":
+                    base_img.paste(resized, (off_x, off_y), mask=resized.split()[3])
+                else:
+                    base_img.paste(resized, (off_x, off_y))
+        except ImageTooLarge:
+            # отклонённый кадр — ошибка строки, а не карточка без фото
+            self.stats["photo_too_large"] += 1
+            raise
+        except Exception:
+            # карточка рисуется без фото; манифест не сочтёт её актуальной
+            self.stats["photo_error"] += 1
+
+    @staticmethod
+    def _field_text(fp: FieldPlan, row) -> str:
+        # "text" в конфиге поля — постоянная надпись, не зависящая от строки данных
+        if fp.text is not None:
+            return fp.text
+        value = row.get(fp.name, "")
+        return "" if value is None else str(value)
+
+    def _draw_field(self, draw, fp: FieldPlan, text: str) -> None:
+        if fp.boxed:
+            ops = self.layout.wrap_box(text, fp.font, fp.width, fp.height, fp.step, fp.is_article)
+            for dx, dy, line in ops:
+                draw.text((fp.x + dx, fp.y + dy), line, font=fp.font, fill=fp.color, anchor="la")
+        else:
+            draw.text((fp.x, fp.y), text, font=fp.font, fill=fp.color, anchor=fp.anchor)
+
+    @staticmethod
+    def _draw_title(draw, mp: MultilinePlan) -> None:
+        draw.text((mp.x, mp.y), mp.title, font=mp.font, fill=mp.color, anchor=mp.anchor)
+
+    def _draw_multiline(self, draw, mp: MultilinePlan, text_value: str, title_baked: bool = False) -> None:
+        # Заголовок "Применимость:" всегда первой строкой; не влез — поле пропускается
+        if not mp.title_fits:
+            return
+        if not title_baked:
+            self._draw_title(draw, mp)
+
+        # очистка от годов выпуска и лишних символов
+        parts = clean_multiline_parts(text_value, mp.delimiter)
+        x, y, box_h, step = mp.x, mp.y, mp.height, mp.step
+        cursor_y = y + step
+
+        def emit_line(txt: str) -> bool:
+            nonlocal cursor_y
+            if box_h > 0 and cursor_y + step > y + box_h:
+                return False
+            draw.text((x, cursor_y), txt, font=mp.font, fill=mp.color, anchor=mp.anchor)
+            cursor_y += step
+            return True
+
+        max_chars = mp.max_chars
+
+        def clamp_chars(s: str) -> str:
+            if max_chars > 0 and len(s) > max_chars:
+                return s[:max(1, max_chars-3)] + "..."
+            return s
+
+        lines = [clamp_chars(token) for token in parts]
+        if mp.fit_width and mp.width > 0:
+            lines = [self.layout.truncate(mp.font, ln, mp.width) for ln in lines]
+
+        allowed = mp.max_lines
+        to_draw = lines[:allowed] if allowed > 0 else []
+        overflow = len(lines) > allowed
+
+        for ln in to_draw:
+            if not emit_line(ln):
+                break
+
+        if overflow and mp.show_overflow_text:
+            emit_line(mp.overflow_text)
+
+    def set_output_dir(self, output_dir: str) -> None:
+        """Папка вывода этого engine и его вариантов (сервис переиспользует engine между заданиями)."""
+        self.output_dir = output_dir
+        for v in self.variants:
+            v.engine.output_dir = output_dir
+
+    def set_sink(self, sink) -> None:
+        """Архив (или его подмена в воркере), куда пишут этот engine и его варианты."""
+        self.sink = sink
+        for v in self.variants:
+            v.engine.sink = sink
+
+    def row_cost(self, row, source=None) -> int:
+        """Оценка памяти на строку для бюджета memory.budget_mb: холст и обработка фото.
+
+        Размер фото берётся из заголовка скачанных байт; уже готовое фото из
+        памяти прогона ничего не стоит.
+        """
+        plan = self.plan
+        cost = canvas_bytes(plan.size)
+        if self.variants:
+            # картинка на каждый уникальный шаблон и на каждый масштабированный вариант
+            renderers = {id(v.renderer): v.renderer for v in self.variants}
+            cost = sum(canvas_bytes(r.plan.size) for r in renderers.values())
+            cost += sum(canvas_bytes((round(v.renderer.plan.size[0] * v.scale),
+                                      round(v.renderer.plan.size[1] * v.scale)))
+                        for v in self.variants if v.scale != 1)
+        url = self.source_url(row)
+        if not url or (self.photos is not None and self._photo_key(url) in self.photos):
+            return cost
+        header = probe(source) if isinstance(source, bytes) else None
+        return cost + photo_bytes(plan.image_box, plan.size, header, self.max_pixels)
+
+    def save(self, img, out_name: str) -> str:
+        """Кодирует картинку (формат — секция "output") и атомарно записывает
+        её в папку вывода или добавляет в открытый архив под именем out_name."""
+        if self.sink is None:
+            return write_image(img, os.path.join(self.output_dir, out_name), self.plan.output, self.timings)
+        data = encode_image(img, out_name, self.plan.output, self.timings)
+        with self.timings.span("write"):
+            self.sink.write(out_name, data)
+        return out_name
+
+    def open_manifest(self, force: bool = False, name: str = MANIFEST_NAME) -> Optional[Manifest]:
+        """Манифест выходной папки или None, если инкрементальный режим выключен.
+
+        force — нарисовать все строки заново (записи манифеста при этом обновляются).
+        """
+        inc_cfg = self.config.get("incremental", {}) or {}
+        if not inc_cfg.get("enabled", True):
+            return None
+        manifest = Manifest(self.output_dir, name)
+        if force:
+            manifest.entries.clear()
+        return manifest
+
+    def fingerprint(self) -> str:
+        """Отпечаток прогона: конфиг, шаблон и файлы шрифтов."""
+        variants = [None] + list(self.fonts.variants)
+        fingerprint = run_fingerprint(self.config, self.template_path, {self.fonts.path(v) for v in variants})
+        if self.variants:
+            # шаблоны и шрифты вариантов
+            fingerprint = cache_key(fingerprint, *[v.engine.fingerprint() for v in self.variants])
+        return fingerprint
+
+    def _own_stats(self) -> Counter:
+        stats, self.stats = self.stats, Counter()
+        stats.update(self.fonts.take_stats())
+        stats.update(self.layout.take_stats())
+        return stats
+
+    def take_stats(self) -> Counter:
+        """Счётчики (кэш и др.), накопленные с прошлого вызова; обнуляет их."""
+        stats = self._own_stats()
+        for v in self.variants:
+            # загрузки, кэши и замеры у вариантов общие с этим engine
+            stats.update(v.engine._own_stats())
+        stats.update(self.timings.take_stats())
+        stats.update(self.memory.take_stats())
+        if self.cache is not None:
+            stats.update(self.cache.take_stats())
+        for memo in (self.photos, self.downloads, self.sources):
+            if memo is not None:
+                stats.update(memo.take_stats())
+        return stats
+
+    def render_variants(self, idx: int, row, source=None) -> Iterator[Tuple[Variant, str, Any]]:
+        """Картинки строки по вариантам: (вариант, имя файла, картинка).
+
+        Фото, строка и очищенный текст общие; каждая уникальная комбинация
+        шаблона и разметки рисуется один раз, варианты отличаются
+        масштабом и кодированием.
+        """
+        from PIL import Image
+
+        url = self.source_url(row)
+        composites: Dict[int, Any] = {}
+        for v in self.variants:
+            out_name = v.engine.output_name(idx, row)
+            img = composites.get(id(v.renderer))
+            if img is None:
+                # заранее скачанные байты подходят, только если фото из той же колонки
+                src = source if v.renderer.source_url(row) == url else None
+                img = composites[id(v.renderer)] = v.renderer.render_row(idx, row, src)
+            if v.scale != 1:
+                size = (max(1, round(img.width * v.scale)), max(1, round(img.height * v.scale)))
+                with self.timings.span("resize"):
+                    img = img.resize(size, Image.Resampling.LANCZOS)
+            yield v, out_name, img
+
+    def process_row(self, idx: int, row, source=None) -> Tuple[List[str], Optional[str]]:
+        """Рендерит и сохраняет строку. Возвращает (имена файлов, error)."""
+        if self.variants:
+            return self._process_variants(idx, row, source)
+        out_name = None
+        try:
+            out_name = self.output_name(idx, row)
+            img = self.render_row(idx, row, source)
+            self.save(img, out_name)
+        except Exception as e:
+            return [out_name] if out_name else [], f"{type(e).__name__}: {e}"
+        return [out_name], None
+
+    def _process_variants(self, idx: int, row, source=None) -> Tuple[List[str], Optional[str]]:
+        names: List[str] = []
+        try:
+            names = self.output_names(idx, row)
+            for v, out_name, img in self.render_variants(idx, row, source):
+                v.engine.save(img, out_name)
+        except Exception as e:
+            return names, f"{type(e).__name__}: {e}"
+        return names, None
+
+    def run(self, input_path: str, workers: Optional[int] = None,
+            force: bool = False) -> Iterator[RenderEvent]:
+        """Рендерит все строки файла данных, отдавая события прогресса.
+
+        Ошибка в отдельной строке не прерывает прогон: она приходит событием
+        "error", а обработка продолжается со следующей строки.
+        workers > 1 включает рендер в пуле процессов (см. imagegen.parallel);
+        по умолчанию берётся из секции "parallel" конфига.
+        Строки, чьи файлы не изменились с прошлого прогона, пропускаются
+        (событие "skip"); force=True рисует всё заново.
+        """
+        self.check()
+        source_rows = open_rows(input_path, self.config)
+        yield from self.run_rows(source_rows, source_rows.total, workers=workers, force=force)
+
+    def run_rows(self, source_rows: Iterable[Tuple[int, Dict[str, Any]]], total: int,
+                 workers: Optional[int] = None, force: bool = False,
+                 manifest_name: str = MANIFEST_NAME,
+                 archive_part: Optional[str] = None,
+                 memory_ttl: float = 0) -> Iterator[RenderEvent]:
+        """То же, что run(), для уже прочитанных строк (row_index, row).
+
+        total — число строк для прогресса; manifest_name — файл манифеста в
+        папке вывода (у шардов imagegen.shard он свой на каждый шард),
+        archive_part — суффикс имени архива при output.sink, отличном от "dir".
+        Архив каждый прогон пишется целиком, манифест для него не ведётся.
+        memory_ttl — сколько секунд фото из памяти прошлых прогонов этого
+        engine считаются свежими (прогретый engine сервиса); 0 — память
+        прогона начинается пустой. Ошибки прошлых прогонов не повторяются.
+        """
+        self.check()
+        started = time.perf_counter()
+        # фото по тому же URL могло смениться: старше memory_ttl качается и готовится заново
+        for memo in (self.photos, self.downloads, self.sources):
+            if memo is not None:
+                memo.prune(memory_ttl)
+        if self.timings.trace_path:
+            # части трассы от прерванного прогона
+            shutil.rmtree(self.timings.trace_path + ".parts", ignore_errors=True)
+        yield RenderEvent("start", total=total)
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        par_cfg = self.config.get("parallel", {}) or {}
+        if workers is None:
+            workers = int(par_cfg.get("workers", 1) or 1)
+        if workers <= 0:
+            workers = os.cpu_count() or 1
+        rows = iter(source_rows)
+        manifest = self.open_manifest(force, manifest_name) if self.plan.output.sink == "dir" else None
+        # ключи строк, отданных в рендер, и пропущенные строки до их события "skip"
+        pending: Dict[int, Tuple[List[str], str]] = {}
+        skipped: deque = deque()
+        if manifest is not None:
+            rows = self._filter_current(rows, manifest, pending, skipped)
+        # фото для следующих строк качаются в фоне, пока рендерится текущая
+        prefetcher = self.prefetcher()
+        if prefetcher is not None:
+            rows = ((idx, row, source) for (idx, row), source
+                    in prefetcher.iterate(rows, lambda item: self.source_url(item[1])))
+        else:
+            rows = ((idx, row, None) for idx, row in rows)
+        if workers > 1 and total > 1:
+            from .parallel import process_rows_parallel
+            results = process_rows_parallel(
+                self, rows, workers=min(workers, total),
+                chunk_size=int(par_cfg.get("chunk_size", 8) or 1),
+            )
+        else:
+            results = self._process_rows_serial(rows)
+
+        done = 0
+        run_stats: Counter = Counter()
+        self.memory.peak = self.memory.in_flight
+        self.set_sink(open_sink(self.plan.output, self.output_dir, archive_part))
+        sink, completed = self.sink, False
+
+        def event(kind: str, idx: int, names: List[str], message: str = "",
+                  stats: Optional[Counter] = None) -> RenderEvent:
+            return RenderEvent(kind, index=idx, done=done, total=total, out_name=names[0] if names else None,
+                               out_names=list(names), message=message, stats=dict(stats or {}))
+
+        def drain_skipped(before: Optional[int] = None) -> Iterator[RenderEvent]:
+            nonlocal done
+            while skipped and (before is None or skipped[0][0] < before):
+                idx, names = skipped.popleft()
+                done += 1
+                run_stats["skipped"] += 1
+                yield event("skip", idx, names)
+
+        try:
+            for idx, names, error, row_stats in results:
+                yield from drain_skipped(before=idx)
+                if row_stats:
+                    run_stats.update(row_stats)
+                done += 1
+                entry = pending.pop(idx, None)
+                if manifest is not None and entry is not None:
+                    complete = not error and not (row_stats and row_stats.get("photo_error"))
+                    for name in entry[0]:
+                        manifest.record(name, entry[1] if complete else None)
+                if error:
+                    yield event("error", idx, names, error, row_stats)
+                else:
+                    yield event("row", idx, names, stats=row_stats)
+            yield from drain_skipped()
+            completed = True
+        finally:
+            # потоки и процессы записи должны закончить, прежде чем закрывать архив
+            results.close()
+            if manifest is not None:
+                manifest.close()
+            if sink is not None:
+                self.set_sink(None)
+                # прерванный прогон не оставляет недописанный архив
+                sink.close(commit=completed)
+        run_stats.update(self.take_stats())
+        summary = [format_font_stats(run_stats), format_layout_stats(run_stats)]
+        if self.cache is not None:
+            summary.append(format_cache_stats(run_stats, self.cache))
+        if self.photos is not None and self.plan.image_box is not None:
+            summary.append(format_dedup_stats(run_stats))
+        if manifest is not None:
+            summary.append(format_manifest_stats(run_stats))
+        summary.append(format_memory_stats(run_stats, self.memory))
+        if sink is not None:
+            summary.append(f"Архив: {sink.path} — файлов {sink.count}, {sink.bytes / (1024 * 1024):.1f} МБ")
+        if self.timings.enabled:
+            wall = time.perf_counter() - started
+            summary.append(format_stage_table(run_stats, wall))
+            summary.extend(self._write_profile(run_stats, wall, done))
+        yield RenderEvent("done", done=done, total=done, message="\n".join(summary), stats=dict(run_stats))
+
+    def _write_profile(self, run_stats: Counter, wall: float, rows: int) -> List[str]:
+        """Пишет JSON-отчёт и трассу из секции "profile"; строки для сводки."""
+        lines = []
+        report_path = (self.config.get("profile", {}) or {}).get("report")
+        if report_path:
+            report = stage_report(run_stats, wall)
+            report["rows"] = rows
+            report["stats"] = {k: v for k, v in sorted(run_stats.items())
+                               if not k.startswith(("time_", "calls_"))}
+            folder = os.path.dirname(os.path.abspath(report_path))
+            os.makedirs(folder, exist_ok=True)
+            with open(report_path, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            lines.append(f"Отчёт по стадиям: {report_path}")
+        trace_path = self.timings.write_trace()
+        if trace_path:
+            lines.append(f"Трасса: {trace_path} (chrome://tracing или ui.perfetto.dev)")
+        return lines
+
+    def _row_images(self, idx: int, row, source=None) -> List[Tuple["RenderEngine", str, Any]]:
+        """(engine для записи, имя файла, картинка) по всем вариантам строки."""
+        if self.variants:
+            return [(v.engine, out_name, img) for v, out_name, img in self.render_variants(idx, row, source)]
+        return [(self, self.output_name(idx, row), self.render_row(idx, row, source))]
+
+    def _process_rows_serial(self, rows) -> Iterator[Tuple[int, List[str], Optional[str], Counter]]:
+        """Рендер в этом процессе; запись файлов — в фоновых потоках (output.writers).
+
+        Перед каждой строкой занимается её оценка из бюджета памяти (row_cost).
+        """
+        output, memory = self.plan.output, self.memory
+        if output.writers <= 0:
+            for idx, row, source in rows:
+                cost = memory.acquire(self.row_cost(row, source))
+                try:
+                    result = self.process_row(idx, row, source)
+                finally:
+                    memory.release(cost)
+                yield (idx,) + result + (self.take_stats(),)
+            return
+        pool = WriterPool(self.save, workers=output.writers, max_pending=output.queue)
+        # (idx, имена файлов, будущие записи или текст ошибки, счётчики строки) в порядке строк
+        pending: deque = deque()
+
+        def finished(futs) -> bool:
+            return isinstance(futs, str) or all(f.done() for f in futs)
+
+        def finish(item) -> Tuple[int, List[str], Optional[str], Counter]:
+            idx, names, futs, stats = item
+            if isinstance(futs, str):
+                return idx, names, futs, stats
+            error = None
+            for fut in futs:
+                e = fut.exception()
+                if e is not None:
+                    error = f"{type(e).__name__}: {e}"
+                    break
+            return idx, names, error, stats
+
+        try:
+            for idx, row, source in rows:
+                names: List[str] = []
+                futs: Any = []
+                cost = memory.acquire(self.row_cost(row, source))
+                try:
+                    names = self.output_names(idx, row)
+                    images = self._row_images(idx, row, source)
+                    # картинки ждут записи, память на обработку фото уже свободна
+                    shares: List[int] = []
+                    for _, _, img in images:
+                        shares.append(min(cost - sum(shares), canvas_bytes(img.size)))
+                    memory.release(cost - sum(shares))
+                    cost = sum(shares)
+                    for (engine, out_name, img), share in zip(images, shares):
+                        fut = pool.submit(img, out_name, engine.save)
+                        cost -= share
+                        fut.add_done_callback(lambda _, n=share: memory.release(n))
+                        futs.append(fut)
+                except Exception as e:
+                    memory.release(cost)
+                    futs = f"{type(e).__name__}: {e}"
+                pending.append((idx, names, futs, self.take_stats()))
+                while pending and finished(pending[0][2]):
+                    yield finish(pending.popleft())
+            while pending:
+                yield finish(pending.popleft())
+        finally:
+            pool.close()
+
+    def _filter_current(self, rows, manifest: Manifest, pending: Dict[int, Tuple[List[str], str]],
+                        skipped: deque) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """Пропускает строки с актуальными файлами, остальным запоминает ключ.
+
+        Манифест помнит для имени файла ключ одной строки, поэтому строка,
+        имя которой уже занято в этом прогоне, рисуется всегда: файл, как и
+        при полном прогоне, остаётся за последней строкой.
+        """
+        fingerprint = self.fingerprint()
+        claimed: Set[str] = set()
+        for idx, row in rows:
+            try:
+                names = self.output_names(idx, row)
+            except Exception:
+                # ошибку имени файла покажет process_row
+                yield idx, row
+                continue
+            key = row_key(fingerprint, row)
+            collision = not claimed.isdisjoint(names)
+            claimed.update(names)
+            if collision:
+                self.stats["name_collision"] += 1
+            elif all(manifest.is_current(name, key) for name in names):
+                skipped.append((idx, names))
+                continue
+            pending[idx] = (names, key)
+            yield idx, row
+
+
+def render(config: Dict[str, Any], input_path: str, output_dir: str,
+           on_event: Optional[Callable[[RenderEvent], None]] = None,
+           search_dirs: Optional[List[str]] = None,
+           workers: Optional[int] = None, force: bool = False) -> RenderResult:
+    """Рендерит весь файл данных и возвращает сводку прогона."""
+    engine = RenderEngine(config, output_dir, search_dirs=search_dirs)
+    result = RenderResult()
+    for ev in engine.run(input_path, workers=workers, force=force):
+        if ev.kind == "start":
+            result.total = ev.total
+        elif ev.kind == "row":
+            result.rendered += 1
+            result.outputs.extend(ev.out_names)
+        elif ev.kind == "skip":
+            result.skipped += 1
+        elif ev.kind == "error":
+            result.failed += 1
+            result.errors[ev.index] = ev.message
+        elif ev.kind == "done":
+            result.total = ev.total
+            result.stats = ev.stats
+        if on_event is not None:
+            on_event(ev)
+    return result
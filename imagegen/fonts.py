@@ -0,0 +1,105 @@
+"""Кэш шрифтов.
+
+Путь к TTF определяется один раз (font.ttf_path → системные шрифты Windows →
+DejaVuSans → встроенный шрифт Pillow), дальше FreeTypeFont берутся из
+LRU-кэша по ключу (path, size, variant) без повторного чтения файла.
+"""
+import os
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+_UNRESOLVED = object()
+
+
+def font_candidates(ttf_path: Optional[str]):
+    if ttf_path and os.path.isfile(ttf_path):
+        yield ttf_path
+    windir = os.environ.get("WINDIR", "C:/Windows")
+    for name in ("arial.ttf", "segoeui.ttf"):
+        p = os.path.join(windir, "Fonts", name)
+        if os.path.isfile(p):
+            yield p
+    # Pillow сам ищет файл по имени в системных папках шрифтов
+    yield "DejaVuSans.ttf"
+
+
+def resolve_font_path(ttf_path: Optional[str]) -> Optional[str]:
+    """Первый загружаемый шрифт из цепочки кандидатов; None — встроенный шрифт Pillow."""
+    from PIL import ImageFont
+
+    for p in font_candidates(ttf_path):
+        try:
+            font = ImageFont.truetype(p, 12)
+        except Exception:
+            continue
+        return getattr(font, "path", None) or p
+    return None
+
+
+class FontCache:
+    """LRU-кэш FreeTypeFont с однократным определением пути к шрифту.
+
+    variants — дополнительные начертания {"bold": "path/to/bold.ttf"};
+    поле выбирает начертание ключом font_variant.
+    """
+
+    def __init__(self, ttf_path: Optional[str] = None, variants: Optional[Dict[str, str]] = None,
+                 maxsize: int = 64) -> None:
+        self.ttf_path = ttf_path
+        self.variants = dict(variants or {})
+        self.maxsize = max(1, int(maxsize))
+        self.stats: Counter = Counter()
+        self.hits = 0
+        self.misses = 0
+        self._paths: Dict[Optional[str], Any] = {}
+        self._fonts: "OrderedDict[Tuple[Optional[str], int, Optional[str]], Any]" = OrderedDict()
+
+    def path(self, variant: Optional[str] = None) -> Optional[str]:
+        path = self._paths.get(variant, _UNRESOLVED)
+        if path is _UNRESOLVED:
+            base = self.variants.get(variant) if variant else None
+            path = self._paths[variant] = resolve_font_path(base or self.ttf_path)
+        return path
+
+    def get(self, size: int, variant: Optional[str] = None):
+        path = self.path(variant)
+        key = (path, int(size), variant)
+        font = self._fonts.get(key)
+        if font is not None:
+            self._fonts.move_to_end(key)
+            self.hits += 1
+            self.stats["font_hit"] += 1
+            return font
+        self.misses += 1
+        self.stats["font_miss"] += 1
+        font = self._open(path, int(size))
+        self._fonts[key] = font
+        if len(self._fonts) > self.maxsize:
+            self._fonts.popitem(last=False)
+        return font
+
+    @staticmethod
+    def _open(path: Optional[str], size: int):
+        from PIL import ImageFont
+
+        if path is not None:
+            try:
+                return ImageFont.truetype(path, size)
+            except Exception:
+                pass
+        return ImageFont.load_default()
+
+    def info(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses,
+                "size": len(self._fonts), "maxsize": self.maxsize}
+
+    def take_stats(self) -> Counter:
+        """Счётчики попаданий с прошлого вызова; обнуляет их (info() — за всё время)."""
+        stats, self.stats = self.stats, Counter()
+        return stats
+
+
+def format_font_stats(stats: Counter) -> str:
+    hit, miss = stats.get("font_hit", 0), stats.get("font_miss", 0)
+    return f"Шрифты: {hit}/{hit + miss} из кэша, загружено {miss}"
@@ -0,0 +1,146 @@
+"""Раскладка текста с кэшем ширин слов.
+
+Перенос по словам в зоне поля раньше мерил font.getbbox() всей растущей
+строки на каждое слово (квадратично по длине строки) и повторял всё заново
+на каждой строке данных. TextLayout хранит ширины слов для каждого шрифта,
+наращивает ширину строки по мере добавления слов и запоминает готовую
+раскладку для одинаковых (текст, шрифт, зона).
+
+Ширина строки из суммы ширин слов может расходиться с getbbox() на доли
+пикселя (кернинг на стыке слов), поэтому вблизи границы зоны решение о
+переносе проверяется точным измерением — результат совпадает с прежним.
+"""
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Tuple
+
+
+# запас в пикселях, внутри которого оценка ширины перепроверяется точно
+EXACT_BAND = 3
+
+LineOps = Tuple[Tuple[int, int, str], ...]
+
+
+class TextLayout:
+    """Кэш ширин слов и раскладок текста для набора шрифтов."""
+
+    def __init__(self, max_words: int = 100_000, max_layouts: int = 20_000) -> None:
+        self.max_words = max(1, int(max_words))
+        self.max_layouts = max(1, int(max_layouts))
+        self.stats: Counter = Counter()
+        # шрифты хранятся здесь, чтобы id(font) в ключах оставался уникальным
+        self._fonts: Dict[int, Any] = {}
+        self._words: "OrderedDict[Tuple[int, str], Tuple[float, int]]" = OrderedDict()
+        self._layouts: "OrderedDict[Tuple[Any, ...], LineOps]" = OrderedDict()
+
+    def _font_id(self, font) -> int:
+        fid = id(font)
+        self._fonts.setdefault(fid, font)
+        return fid
+
+    def word_metrics(self, font, word: str) -> Tuple[float, int]:
+        """(advance, правый край bbox) слова; advance — смещение пера после слова."""
+        key = (self._font_id(font), word)
+        m = self._words.get(key)
+        if m is not None:
+            self._words.move_to_end(key)
+            return m
+        m = (font.getlength(word), font.getbbox(word)[2])
+        self._words[key] = m
+        if len(self._words) > self.max_words:
+            self._words.popitem(last=False)
+        return m
+
+    def band(self, font) -> float:
+        """Запас вокруг границы зоны, внутри которого оценка перепроверяется точно."""
+        return EXACT_BAND
+
+    def text_width(self, font, text: str) -> float:
+        """Ширина строки по кэшу слов (advance); для fits() и обрезки по ширине."""
+        words = text.split(" ")
+        space = self.word_metrics(font, " ")[0]
+        return sum(self.word_metrics(font, w)[0] for w in words) + space * (len(words) - 1)
+
+    def fits(self, font, text: str, width: int) -> bool:
+        if width <= 0:
+            return True
+        est = self.text_width(font, text)
+        if abs(est - width) > self.band(font):
+            return est <= width
+        return font.getlength(text) <= width
+
+    def truncate(self, font, text: str, width: int, ellipsis: str = "...") -> str:
+        """Обрезает text с многоточием, чтобы строка влезла в width."""
+        if self.fits(font, text, width):
+            return text
+        lo, hi = 0, len(text)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if self.fits(font, text[:mid].rstrip() + ellipsis, width):
+                lo = mid
+            else:
+                hi = mid - 1
+        return text[:max(1, lo)].rstrip() + ellipsis
+
+    def wrap_box(self, text: str, font, width: int, height: int, step: int, center: bool) -> LineOps:
+        """Перенос по словам в зону width x height.
+
+        Возвращает строки как (dx, dy, line) относительно левого верхнего угла
+        зоны. center — центрирование по горизонтали (и по вертикали, если
+        поместилась одна строка), как у поля артикула.
+        """
+        key = (self._font_id(font), text, width, height, step, center)
+        ops = self._layouts.get(key)
+        if ops is not None:
+            self._layouts.move_to_end(key)
+            self.stats["layout_hit"] += 1
+            return ops
+        self.stats["layout_miss"] += 1
+        ops = self._wrap(text, font, width, height, step, center)
+        self._layouts[key] = ops
+        if len(self._layouts) > self.max_layouts:
+            self._layouts.popitem(last=False)
+        return ops
+
+    def _wrap(self, text: str, font, fw: int, fh: int, step: int, center: bool) -> LineOps:
+        space = self.word_metrics(font, " ")[0]
+        band = self.band(font)
+        out = []
+        line = ""
+        line_adv = 0.0
+        cursor_y = 0
+        for w in text.split():
+            adv, right = self.word_metrics(font, w)
+            if line:
+                test = line + " " + w
+                tw = line_adv + space + right
+                if abs(tw - fw) <= band:
+                    tw = font.getbbox(test)[2]
+            else:
+                test, tw = w, right
+            if tw > fw and line:
+                dx = (fw - font.getbbox(line)[2]) // 2 if center else 0
+                out.append((dx, cursor_y, line))
+                cursor_y += step
+                line, line_adv = w, adv
+                if cursor_y > fh - step:
+                    break
+            else:
+                line_adv = line_adv + space + adv if line else adv
+                line = test
+        if cursor_y <= fh - step and line:
+            dx = 0
+            if center:
+                dx = (fw - font.getbbox(line)[2]) // 2
+                if cursor_y == 0:
+                    cursor_y = (fh - step) // 2
+            out.append((dx, cursor_y, line))
+        return tuple(out)
+
+    def take_stats(self) -> Counter:
+        stats, self.stats = self.stats, Counter()
+        return stats
+
+
+def format_layout_stats(stats: Counter) -> str:
+    hit, miss = stats.get("layout_hit", 0), stats.get("layout_miss", 0)
+    return f"Раскладка текста: {hit}/{hit + miss} из кэша"
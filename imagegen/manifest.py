@@ -0,0 +1,120 @@
+"""Манифест выходной папки для инкрементальных прогонов.
+
+Рядом с картинками хранится .manifest.jsonl: для каждого выходного файла —
+ключ строки, из которой он нарисован. Ключ — хеш значений строки и «отпечатка
+прогона» (секции конфига, влияющие на картинку, байты шаблона и шрифтов).
+Строка, чей ключ совпадает с записанным и файл которой на месте, повторно
+не рисуется.
+
+Записи дописываются в конец файла сразу после сохранения картинки, поэтому
+прерванный прогон продолжается с места остановки. В конце прогона манифест
+переписывается (временный файл + rename), остаётся одна запись на файл.
+"""
+import hashlib
+import json
+import os
+from typing import Any, Dict, Iterable, Optional
+
+from .cache import cache_key
+
+
+MANIFEST_NAME = ".manifest.jsonl"
+# меняется, когда рендер при том же конфиге начинает рисовать иначе
+RENDER_VERSION = 3
+# секции конфига, не влияющие на содержимое картинок
+RUN_ONLY_SECTIONS = ("output_dir", "input", "download", "cache", "parallel", "incremental", "shard", "service", "log",
+                     "profile")
+# ключи секций, которые не влияют на содержимое картинок
+RUN_ONLY_KEYS = {"output": ("writers", "queue", "sink", "archive"), "memory": ("budget_mb",)}
+
+
+def file_digest(path: Optional[str]) -> str:
+    """sha256 содержимого файла; пустая строка, если файла нет."""
+    if not path or not os.path.isfile(path):
+        return ""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def run_fingerprint(config: Dict[str, Any], template_path: str, font_paths: Iterable[Optional[str]]) -> str:
+    visual = {k: v for k, v in config.items() if k not in RUN_ONLY_SECTIONS}
+    for section, keys in RUN_ONLY_KEYS.items():
+        if isinstance(visual.get(section), dict):
+            visual[section] = {k: v for k, v in visual[section].items() if k not in keys}
+    return cache_key(
+        RENDER_VERSION,
+        json.dumps(visual, sort_keys=True, ensure_ascii=False, default=str),
+        file_digest(template_path),
+        *sorted(file_digest(p) for p in font_paths),
+    )
+
+
+def row_key(fingerprint: str, row: Dict[str, Any]) -> str:
+    return cache_key(fingerprint, json.dumps(row, sort_keys=True, ensure_ascii=False, default=str))
+
+
+class Manifest:
+    """Записи {имя файла: ключ строки} для одной выходной папки."""
+
+    def __init__(self, output_dir: str, name: str = MANIFEST_NAME) -> None:
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, name)
+        self.entries: Dict[str, str] = {}
+        self._file = None
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            f = open(self.path, "r", encoding="utf-8")
+        except OSError:
+            return
+        with f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                    name, key = rec["name"], rec.get("key")
+                except (ValueError, KeyError, TypeError):
+                    # обрывок последней строки после аварийного завершения
+                    continue
+                if key:
+                    self.entries[name] = key
+                else:
+                    self.entries.pop(name, None)
+
+    def is_current(self, name: str, key: str) -> bool:
+        return self.entries.get(name) == key and os.path.isfile(os.path.join(self.output_dir, name))
+
+    def record(self, name: str, key: Optional[str]) -> None:
+        """Запоминает ключ готового файла; key=None — файл устарел (ошибка рендера)."""
+        if key:
+            self.entries[name] = key
+        else:
+            self.entries.pop(name, None)
+        if self._file is None:
+            os.makedirs(self.output_dir, exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps({"name": name, "key": key}, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        """Закрывает журнал и переписывает манифест без устаревших записей."""
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for name, key in self.entries.items():
+                f.write(json.dumps({"name": name, "key": key}, ensure_ascii=False) + "\n")
+        os.replace(tmp, self.path)
+
+
+def format_manifest_stats(stats) -> str:
+    line = f"Без изменений (пропущено): {stats.get('skipped', 0)}"
+    if stats.get("name_collision"):
+        line += (f"; строк с уже занятым именем файла: {stats['name_collision']}"
+                 " (перерисованы, файл остаётся за последней строкой)")
+    return line
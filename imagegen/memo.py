@@ -0,0 +1,131 @@
+"""Кэш в памяти на время прогона с объединением одновременных запросов.
+
+В каталогах одно и то же фото часто стоит у десятков артикулов. MemoryCache
+хранит готовые значения (скачанные байты, вписанное в зону фото) по ключу,
+ограничивая суммарный размер max_bytes (LRU). Если значение для ключа уже
+вычисляется в другом потоке, запрос ждёт его результат, а не повторяет
+работу (single-flight). Ошибки тоже запоминаются: битое фото, повторённое
+в пятидесяти строках, не разбирается пятьдесят раз. Ошибки из transient
+(сбой загрузки) получают только запросы, ждавшие того же вычисления, — в кэш
+они не попадают, и следующая строка с тем же URL пробует снова.
+"""
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, Hashable, Tuple, Type
+
+
+# учётный размер записи с ошибкой
+_ERROR_SIZE = 256
+
+
+def image_nbytes(img) -> int:
+    """Примерный размер PIL.Image в памяти."""
+    return img.width * img.height * len(img.getbands())
+
+
+class _Flight:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Any = None
+
+
+class MemoryCache:
+    """LRU по размеру значений с single-flight для get_or_compute()."""
+
+    def __init__(self, max_bytes: int, sizeof: Callable[[Any], int] = len, prefix: str = "memo",
+                 transient: Tuple[Type[BaseException], ...] = ()) -> None:
+        self.max_bytes = int(max_bytes)
+        self.sizeof = sizeof
+        self.prefix = prefix
+        self.transient = transient
+        self.stats: Counter = Counter()
+        self._lock = threading.Lock()
+        # значение, ошибка, учётный размер, время вычисления (monotonic)
+        self._entries: "OrderedDict[Hashable, Tuple[Any, Any, int, float]]" = OrderedDict()
+        self._inflight: Dict[Hashable, _Flight] = {}
+        self._size = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Значение по ключу; при промахе вычисляет его один раз на всех ожидающих."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats[self.prefix + "_hit"] += 1
+                return self._unwrap(entry)
+            flight = self._inflight.get(key)
+            owner = flight is None
+            if owner:
+                flight = self._inflight[key] = _Flight()
+                self.stats[self.prefix + "_miss"] += 1
+            else:
+                self.stats[self.prefix + "_shared"] += 1
+        if not owner:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        try:
+            flight.value = compute()
+        except Exception as e:
+            flight.error = e
+        with self._lock:
+            del self._inflight[key]
+            self._store(key, flight.value, flight.error)
+        flight.done.set()
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    @staticmethod
+    def _unwrap(entry: Tuple[Any, Any, int, float]) -> Any:
+        value, error, _, _ = entry
+        if error is not None:
+            raise error
+        return value
+
+    def _store(self, key: Hashable, value: Any, error: Any) -> None:
+        if error is not None and isinstance(error, self.transient):
+            return
+        size = _ERROR_SIZE if error is not None else self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (value, error, size, time.monotonic())
+        self._size += size
+        while self._size > self.max_bytes:
+            _, (_, _, old, _) = self._entries.popitem(last=False)
+            self._size -= old
+
+    def prune(self, max_age: float = 0) -> None:
+        """Забывает ошибки и значения старше max_age секунд (0 — все значения).
+
+        Идущие вычисления доводятся до конца как обычно.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for key, (_, error, size, stamp) in list(self._entries.items()):
+                if error is not None or now - stamp >= max_age:
+                    del self._entries[key]
+                    self._size -= size
+
+    def take_stats(self) -> Counter:
+        with self._lock:
+            stats, self.stats = self.stats, Counter()
+        return stats
+
+
+def format_dedup_stats(stats: Counter) -> str:
+    """Доля строк, фото для которых взято из памяти прогона."""
+    hit = stats.get("photo_hit", 0) + stats.get("photo_shared", 0)
+    total = hit + stats.get("photo_miss", 0)
+    share = hit * 100.0 / total if total else 0.0
+    downloads = stats.get("fetch_hit", 0) + stats.get("fetch_shared", 0)
+    return f"Повторы фото: {hit}/{total} из памяти ({share:.0f}%), повторных загрузок избежано {downloads}"
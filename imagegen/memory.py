@@ -0,0 +1,114 @@
+"""Бюджет памяти на строки в работе.
+
+Пиковая память прогона складывается из декодированных фото (RGBA и рабочие
+копии numpy при удалении фона) и холстов шаблона: копия на строку плюс
+готовые картинки в очереди записи, а в параллельном режиме — по строке на
+каждый процесс-воркер. MemoryBudget ограничивает сумму таких оценок для
+строк в работе: следующая строка ждёт, пока не освободится место. Строка,
+которая одна больше бюджета, проходит, когда в работе больше ничего нет.
+
+Оценки строятся по заголовку файла (Image.open читает только его), до
+декодирования, с учётом уменьшения в декодере (imagegen.prepare) и предела
+memory.max_pixels.
+"""
+import io
+import threading
+import time
+from collections import Counter
+from typing import Optional, Tuple
+
+from .plan import ImageBoxPlan
+from .prepare import draft_scale, limit_scale, target_size
+
+
+MB = 1024 * 1024
+# RGBA (4 байта на пиксель) и рабочая копия того же размера при удалении фона
+_PHOTO_FACTOR = 4 * 2
+
+
+def probe(data: bytes) -> Optional[Tuple[int, int, str]]:
+    """(ширина, высота, формат) из заголовка картинки или None, если файл не читается."""
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            return img.width, img.height, img.format or ""
+    except Exception:
+        return None
+
+
+def canvas_bytes(size: Tuple[int, int]) -> int:
+    """Холст строки: копия шаблона в RGB."""
+    return size[0] * size[1] * 3
+
+
+def photo_bytes(ib: Optional[ImageBoxPlan], size: Tuple[int, int],
+                header: Optional[Tuple[int, int, str]] = None, max_pixels: int = 0) -> int:
+    """Оценка памяти на обработку фото строки.
+
+    header — размер и формат из probe(); без него (фото ещё не скачано)
+    берётся верхняя граница по зоне: JPEG draft декодирует не больше чем
+    в 2 раза крупнее цели по каждой стороне.
+    """
+    if ib is None or not ib.source_column:
+        return 0
+    target = target_size(ib.prepare_box, ib.oversample) if ib.prepare_box is not None else None
+    if header is None:
+        pixels = 4 * target[0] * target[1] if target is not None else size[0] * size[1]
+        if max_pixels:
+            pixels = min(pixels, max_pixels)
+        return pixels * _PHOTO_FACTOR
+    w, h, fmt = header
+    d = 1
+    if fmt == "JPEG":
+        d = draft_scale((w, h), target)
+        if max_pixels:
+            d = max(d, limit_scale((w, h), max_pixels) or 8)
+    return -(-w // d) * -(-h // d) * _PHOTO_FACTOR
+
+
+class MemoryBudget:
+    """Счётчик байт в работе с ожиданием: acquire(n) ждёт, пока n не уместится в max_bytes.
+
+    max_bytes <= 0 — без ограничения (только учёт пика).
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = int(max_bytes)
+        self.in_flight = 0
+        self.peak = 0
+        self.stats: Counter = Counter()
+        self._cond = threading.Condition()
+
+    def acquire(self, n: int, wait: bool = True) -> int:
+        """Занимает n байт; wait=False — без ожидания, даже сверх бюджета."""
+        with self._cond:
+            if wait and self.max_bytes > 0 and self.in_flight and self.in_flight + n > self.max_bytes:
+                started = time.perf_counter()
+                self.stats["memory_wait"] += 1
+                self._cond.wait_for(lambda: not self.in_flight or self.in_flight + n <= self.max_bytes)
+                self.stats["memory_wait_s"] += time.perf_counter() - started
+            self.in_flight += n
+            self.peak = max(self.peak, self.in_flight)
+        return n
+
+    def release(self, n: int) -> None:
+        with self._cond:
+            self.in_flight -= n
+            self._cond.notify_all()
+
+    def take_stats(self) -> Counter:
+        with self._cond:
+            stats, self.stats = self.stats, Counter()
+        return stats
+
+
+def format_memory_stats(stats: Counter, budget: MemoryBudget) -> str:
+    """Пик оценённой памяти строк в работе, ожидания бюджета и уменьшенные/отклонённые кадры."""
+    limit = f" из {budget.max_bytes / MB:.0f}" if budget.max_bytes > 0 else ""
+    line = (f"Память: пик {budget.peak / MB:.0f}{limit} МБ, ожиданий {stats.get('memory_wait', 0)}"
+            f" ({stats.get('memory_wait_s', 0.0):.1f} с)")
+    if stats.get("photo_downscaled") or stats.get("photo_too_large"):
+        line += (f", кадров уменьшено {stats.get('photo_downscaled', 0)},"
+                 f" отклонено {stats.get('photo_too_large', 0)}")
+    return line
@@ -0,0 +1,91 @@
+"""Рендер строк в пуле процессов.
+
+Каждый процесс-воркер получает проверенный родителем конфиг и создаёт
+свой RenderEngine один раз (план компилируется, шаблон и шрифты загружаются
+при первом обращении и дальше переиспользуются), строки
+раздаются пачками по chunk_size, результаты возвращаются родителю в
+исходном порядке строк — имена файлов совпадают с последовательным режимом.
+Если включена упреждающая загрузка, фото качает родитель и передаёт байты
+вместе со строкой. При записи в архив (output.sink) воркеры только кодируют
+картинку и возвращают байты: в архив пишет родитель.
+"""
+import multiprocessing
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .engine import RenderEngine
+
+
+_worker_engine: Optional[RenderEngine] = None
+
+
+class _ReturnSink:
+    """Подмена архива в воркере: закодированные байты уходят родителю."""
+
+    def __init__(self) -> None:
+        self.items: List[Tuple[str, bytes]] = []
+
+    def write(self, name: str, data: bytes) -> None:
+        self.items.append((name, data))
+
+
+def _init_worker(config: Dict[str, Any], output_dir: str, search_dirs: List[str],
+                 to_parent: bool) -> None:
+    global _worker_engine
+    # план собирается со шрифтами этого engine: относительные пути к шрифтам
+    # разрешаются по search_dirs так же, как в родителе
+    _worker_engine = RenderEngine(config, output_dir, search_dirs=search_dirs)
+    if to_parent:
+        _worker_engine.set_sink(_ReturnSink())
+
+
+def _process_row(item: Tuple[int, Dict[str, Any], Any]
+                 ) -> Tuple[int, List[str], Optional[str], Counter, List[Tuple[str, bytes]]]:
+    idx, row, source = item
+    names, error = _worker_engine.process_row(idx, row, source)
+    items: List[Tuple[str, bytes]] = []
+    if isinstance(_worker_engine.sink, _ReturnSink):
+        items, _worker_engine.sink.items = _worker_engine.sink.items, []
+    return idx, names, error, _worker_engine.take_stats(), items
+
+
+def process_rows_parallel(engine: RenderEngine, rows: Iterable[Tuple[int, Dict[str, Any], Any]],
+                          workers: int, chunk_size: int = 8
+                          ) -> Iterator[Tuple[int, List[str], Optional[str], Counter]]:
+    """Рендерит строки в workers процессах.
+
+    Отдаёт (idx, имена файлов, error, stats) по порядку строк; stats — счётчики
+    воркера за эту строку (попадания в кэш и т.п.).
+    """
+    chunk_size = max(1, chunk_size)
+    # Pool.imap вычитывает входной итератор без ограничений; семафор держит
+    # в очереди не больше двух пачек на воркер, чтобы не копить строки и байты фото
+    slots = threading.BoundedSemaphore(workers * chunk_size * 2)
+    # оценки памяти строк, отданных воркерам (бюджет memory.budget_mb на все процессы)
+    costs: Dict[int, int] = {}
+
+    def bounded() -> Iterator[Tuple[int, Dict[str, Any], Any]]:
+        for n, item in enumerate(rows):
+            slots.acquire()
+            # imap отправляет пачку целиком, поэтому ждать бюджета можно только
+            # перед первой строкой пачки: предыдущие уже у воркеров
+            costs[item[0]] = engine.memory.acquire(engine.row_cost(item[1], item[2]),
+                                                   wait=n % chunk_size == 0)
+            yield item
+
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(
+        processes=workers,
+        initializer=_init_worker,
+        initargs=(engine.config, engine.output_dir, engine.search_dirs, engine.sink is not None),
+    ) as pool:
+        for idx, names, error, stats, items in pool.imap(_process_row, bounded(), chunksize=chunk_size):
+            slots.release()
+            engine.memory.release(costs.pop(idx, 0))
+            for name, data in items:
+                try:
+                    engine.sink.write(name, data)
+                except Exception as e:
+                    error = error or f"{type(e).__name__}: {e}"
+            yield idx, names, error, stats
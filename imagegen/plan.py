@@ -0,0 +1,358 @@
+"""Компиляция конфига в план рендера.
+
+Конфиг разбирается один раз на размер шаблона: координаты переводятся в
+пиксели, цвета и якоря разбираются и проверяются, шрифты берутся из
+FontCache. Построчная работа после этого сводится к подстановке значений
+строки в готовый план.
+
+Объекты плана неизменяемы (__slots__, без присваивания после создания) и
+сериализуются pickle: при распаковке план компилируется заново из конфига,
+поэтому его можно передавать в процессы-воркеры.
+"""
+import copy
+from typing import Any, Dict, List, Optional, Tuple
+
+from .background import MODES as BG_MODES
+from .fonts import FontCache
+from .prepare import RESAMPLE_NAMES
+
+
+ARTICLE_FIELD_NAMES = ("артикул", "article", "арт", "артикуль")
+FITS = ("contain", "cover")
+OUTPUT_FORMATS = {"jpeg": ("JPEG", ".jpg"), "jpg": ("JPEG", ".jpg"), "png": ("PNG", ".png"),
+                  "webp": ("WEBP", ".webp")}
+SUBSAMPLING = {"4:4:4": 0, "4:2:2": 1, "4:2:0": 2}
+OUTPUT_SINKS = ("dir", "zip", "tar", "pack")
+_ANCHOR_H = "lmrs"
+_ANCHOR_V = "atmsbd"
+
+
+class PlanError(ValueError):
+    """Конфиг не проходит проверку; в сообщении перечислены все ошибки."""
+
+    def __init__(self, errors: List[str]) -> None:
+        self.errors = list(errors)
+        super().__init__("Ошибки в конфиге:\n" + "\n".join(f"- {e}" for e in self.errors))
+
+
+def resolve_coord(val, total):
+    try:
+        f = float(val)
+        if 0.0 < f <= 1.0:
+            return int(f * total)
+        return int(f)
+    except Exception:
+        return int(val)
+
+
+def resolve_font_size(val, W: int, H: int, ref_dim: str = "w", units: str = "rel"):
+    try:
+        f = float(val)
+        if (units or "rel").lower() == "rel" and 0.0 < f <= 1.0:
+            base = W if (ref_dim or "w").lower() == "w" else H
+            return max(8, int(f * base))
+        return int(f)
+    except Exception:
+        return int(val)
+
+
+class _Frozen:
+    __slots__ = ()
+
+    def __init__(self, **values: Any) -> None:
+        for name in self.__slots__:
+            object.__setattr__(self, name, values.get(name))
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"{type(self).__name__} неизменяем")
+
+    def __repr__(self) -> str:
+        inner = ", ".join(f"{n}={getattr(self, n)!r}" for n in self.__slots__ if n != "font")
+        return f"{type(self).__name__}({inner})"
+
+
+class FieldPlan(_Frozen):
+    """Поле из "fields": text задан для постоянной надписи, иначе берётся колонка name."""
+    __slots__ = ("index", "name", "text", "x", "y", "width", "height", "font_size", "font",
+                 "color", "anchor", "is_article", "step")
+
+    @property
+    def boxed(self) -> bool:
+        return self.width > 0 and self.height > 0
+
+
+class MultilinePlan(_Frozen):
+    """Поле из "multiline_fields"; title_fits — влезает ли заголовок в зону."""
+    __slots__ = ("index", "name", "x", "y", "width", "height", "font_size", "font", "color",
+                 "anchor", "step", "delimiter", "max_lines", "max_chars", "overflow_text",
+                 "show_overflow_text", "title", "title_fits", "fit_width")
+
+
+class ImageBoxPlan(_Frozen):
+    """Зона фото. width/height равны None, если зона берёт размер самого фото.
+
+    prepare_box — размер, под который фото уменьшается до удаления фона
+    (None — без уменьшения), resample — фильтр финального resize или None.
+    bg_mode и feather — режим и смягчение края (см. imagegen.background).
+    """
+    __slots__ = ("source_column", "x", "y", "width", "height", "fit", "remove_bg",
+                 "bg_color", "tolerance", "auto_crop", "prepare_box", "oversample", "resample",
+                 "bg_mode", "feather")
+
+    def region(self, W: int, H: int) -> Tuple[int, int, int, int]:
+        """Прямоугольник, который может закрыть фото."""
+        if self.fit == "cover" or self.width is None or self.height is None:
+            # cover выходит за границы зоны, а без размеров зона зависит от самого фото
+            return (0, 0, W, H)
+        return (self.x, self.y, self.x + self.width, self.y + self.height)
+
+
+class OutputPlan(_Frozen):
+    """Формат выходных файлов.
+
+    format — формат Pillow ("JPEG", "PNG", "WEBP") или None, тогда он
+    берётся из расширения имени файла; ext — расширение, которое ставится
+    вместо расширения из filename_pattern (None — не менять); options —
+    параметры Image.save() по форматам. sink — куда пишутся картинки:
+    "dir" (отдельные файлы) или архив "zip" / "tar" / "pack" по пути
+    archive (None — images.<sink> в папке вывода).
+    """
+    __slots__ = ("format", "ext", "options", "writers", "queue", "sink", "archive")
+
+    def save_kwargs(self, fmt: str) -> Dict[str, Any]:
+        return dict(self.options.get(fmt, ()))
+
+
+class RenderPlan(_Frozen):
+    """Скомпилированный конфиг для шаблона размером size."""
+    __slots__ = ("config", "size", "fields", "multiline_fields", "image_box", "filename_pattern", "output")
+
+    def __reduce__(self):
+        return (_rebuild_plan, (self.config, self.size))
+
+
+def _rebuild_plan(config: Dict[str, Any], size: Tuple[int, int]) -> "RenderPlan":
+    return compile_plan(config, size)
+
+
+def _parse_color(value: Any, where: str, errors: List[str]) -> Tuple[int, ...]:
+    from PIL import ImageColor
+
+    try:
+        return ImageColor.getcolor(str(value), "RGB")
+    except Exception:
+        errors.append(f"{where}: некорректный цвет {value!r}")
+        return (0, 0, 0)
+
+
+def _parse_anchor(value: Any, where: str, errors: List[str]) -> str:
+    anchor = str(value or "la")
+    if len(anchor) != 2 or anchor[0] not in _ANCHOR_H or anchor[1] not in _ANCHOR_V:
+        errors.append(f"{where}: некорректный anchor {value!r}")
+        return "la"
+    return anchor
+
+
+def _number(conv, value: Any, where: str, errors: List[str], default=0):
+    try:
+        return conv(value)
+    except Exception:
+        errors.append(f"{where}: ожидается число, получено {value!r}")
+        return default
+
+
+def _line_step(font, font_size: int, spacing: float) -> int:
+    try:
+        ascent, descent = font.getmetrics()
+        return int((ascent + descent) * spacing)
+    except Exception:
+        return int(font_size * spacing)
+
+
+def _font_size(spec: Dict[str, Any], size: Tuple[int, int], where: str, errors: List[str]) -> int:
+    W, H = size
+    font_ref = (spec.get("font_ref") or "w").lower()
+    font_units = (spec.get("font_units") or "rel").lower()
+    if font_ref not in ("w", "h"):
+        errors.append(f"{where}: font_ref должен быть 'w' или 'h'")
+    if font_units not in ("rel", "px"):
+        errors.append(f"{where}: font_units должен быть 'rel' или 'px'")
+    value = _number(lambda v: resolve_font_size(v, W, H, font_ref, font_units),
+                    spec.get("font_size", 32), f"{where}.font_size", errors, 32)
+    if value <= 0:
+        errors.append(f"{where}.font_size: размер шрифта должен быть больше 0")
+        value = 8
+    return value
+
+
+def _coord(spec: Dict[str, Any], key: str, total: int, where: str, errors: List[str]) -> int:
+    return _number(lambda v: resolve_coord(v, total), spec.get(key, 0), f"{where}.{key}", errors)
+
+
+def compile_plan(config: Dict[str, Any], size: Tuple[int, int],
+                 fonts: Optional[FontCache] = None) -> RenderPlan:
+    """Компилирует конфиг под шаблон size=(W, H). Бросает PlanError со списком ошибок."""
+    if fonts is None:
+        font_cfg = config.get("font", {}) or {}
+        fonts = FontCache(font_cfg.get("ttf_path"), font_cfg.get("variants"),
+                          maxsize=int(font_cfg.get("cache_size", 64) or 64))
+    W, H = size
+    errors: List[str] = []
+
+    fields = []
+    for i, spec in enumerate(config.get("fields", []) or []):
+        where = f"fields[{i}]"
+        name = spec.get("name")
+        if not name and "text" not in spec:
+            errors.append(f"{where}: не задано name")
+        font_size = _font_size(spec, size, where, errors)
+        font = fonts.get(font_size, spec.get("font_variant"))
+        text = spec.get("text")
+        fields.append(FieldPlan(
+            index=i,
+            name=name,
+            text=None if "text" not in spec else ("" if text is None else str(text)),
+            x=_coord(spec, "x", W, where, errors),
+            y=_coord(spec, "y", H, where, errors),
+            width=_coord(spec, "width", W, where, errors),
+            height=_coord(spec, "height", H, where, errors),
+            font_size=font_size,
+            font=font,
+            color=_parse_color(spec.get("color", "#000000"), where, errors),
+            anchor=_parse_anchor(spec.get("anchor", "la"), where, errors),
+            is_article=(name or "").strip().lower() in ARTICLE_FIELD_NAMES,
+            step=_line_step(font, font_size, 1.1),
+        ))
+
+    multiline = []
+    for i, spec in enumerate(config.get("multiline_fields", []) or []):
+        where = f"multiline_fields[{i}]"
+        if not spec.get("name"):
+            errors.append(f"{where}: не задано name")
+        font_size = _font_size(spec, size, where, errors)
+        font = fonts.get(font_size, spec.get("font_variant"))
+        spacing = _number(float, spec.get("line_spacing", 1.2), f"{where}.line_spacing", errors, 1.2)
+        step = _line_step(font, font_size, spacing)
+        height = _coord(spec, "height", H, where, errors)
+        delimiter = spec.get("delimiter", "/")
+        if not delimiter:
+            errors.append(f"{where}: пустой delimiter")
+            delimiter = "/"
+        multiline.append(MultilinePlan(
+            index=i,
+            name=spec.get("name"),
+            x=_coord(spec, "x", W, where, errors),
+            y=_coord(spec, "y", H, where, errors),
+            width=_coord(spec, "width", W, where, errors),
+            height=height,
+            font_size=font_size,
+            font=font,
+            color=_parse_color(spec.get("color", "#000000"), where, errors),
+            anchor=_parse_anchor(spec.get("anchor", "la"), where, errors),
+            step=step,
+            delimiter=str(delimiter),
+            max_lines=_number(int, spec.get("max_lines", 6), f"{where}.max_lines", errors, 6),
+            max_chars=_number(int, spec.get("max_chars", 20), f"{where}.max_chars", errors, 20),
+            overflow_text=str(spec.get("overflow_text", "и т.д.")),
+            show_overflow_text=bool(spec.get("show_overflow_text", True)),
+            title=spec.get("title", "Применимость:"),
+            title_fits=not (height > 0 and step > height),
+            fit_width=bool(spec.get("fit_width", False)),
+        ))
+
+    image_box = None
+    spec = config.get("image_box") or {}
+    if spec:
+        where = "image_box"
+        fit = (spec.get("fit", "contain") or "contain").lower()
+        if fit not in FITS:
+            errors.append(f"{where}: fit должен быть одним из {', '.join(FITS)}")
+        width = max(1, _coord(spec, "width", W, where, errors)) if "width" in spec else None
+        height = max(1, _coord(spec, "height", H, where, errors)) if "height" in spec else None
+        oversample = _number(float, spec.get("prepare_oversample", 2.0), f"{where}.prepare_oversample", errors, 2.0)
+        if oversample < 1:
+            errors.append(f"{where}.prepare_oversample: должен быть не меньше 1")
+        resample = spec.get("resample") or None
+        if resample is not None and str(resample).lower() not in RESAMPLE_NAMES:
+            errors.append(f"{where}.resample: ожидается одно из {', '.join(RESAMPLE_NAMES)}")
+            resample = None
+        prepare = bool(spec.get("prepare", True)) and width is not None and height is not None
+        bg_mode = (spec.get("remove_bg_mode", "color") or "color").lower()
+        if bg_mode not in BG_MODES:
+            errors.append(f"{where}.remove_bg_mode: ожидается одно из {', '.join(BG_MODES)}")
+        feather = _number(float, spec.get("remove_bg_feather", 0) or 0, f"{where}.remove_bg_feather", errors, 0)
+        image_box = ImageBoxPlan(
+            source_column=spec.get("source_column"),
+            x=_coord(spec, "x", W, where, errors),
+            y=_coord(spec, "y", H, where, errors),
+            width=width,
+            height=height,
+            fit=fit,
+            remove_bg=bool(spec.get("remove_bg", True)),
+            bg_color=_parse_color(spec.get("remove_bg_color", "#FFFFFF") or "#FFFFFF", where, errors),
+            tolerance=_number(int, spec.get("remove_bg_tolerance", 18), f"{where}.remove_bg_tolerance", errors, 18),
+            auto_crop=bool(spec.get("auto_crop", True)),
+            prepare_box=(width, height) if prepare else None,
+            oversample=oversample,
+            resample=str(resample).lower() if resample else None,
+            bg_mode=bg_mode,
+            feather=max(0.0, feather),
+        )
+
+    pattern = config.get("filename_pattern", "image_{row_index:04d}.jpg")
+    if not pattern:
+        errors.append("filename_pattern: пустой шаблон имени файла")
+
+    output = _compile_output(config.get("output", {}) or {}, errors)
+
+    if errors:
+        raise PlanError(errors)
+    return RenderPlan(
+        config=copy.deepcopy(config),
+        size=tuple(size),
+        fields=tuple(fields),
+        multiline_fields=tuple(multiline),
+        image_box=image_box,
+        filename_pattern=pattern,
+        output=output,
+    )
+
+
+def _compile_output(spec: Dict[str, Any], errors: List[str]) -> OutputPlan:
+    where = "output"
+    fmt, ext = None, None
+    name = spec.get("format")
+    if name:
+        if str(name).lower() not in OUTPUT_FORMATS:
+            errors.append(f"{where}.format: ожидается одно из {', '.join(sorted(OUTPUT_FORMATS))}")
+        else:
+            fmt, ext = OUTPUT_FORMATS[str(name).lower()]
+    quality = _number(int, spec.get("quality", 95), f"{where}.quality", errors, 95)
+    jpeg = [("quality", quality),
+            ("optimize", bool(spec.get("optimize", False))),
+            ("progressive", bool(spec.get("progressive", False)))]
+    subsampling = spec.get("subsampling")
+    if subsampling is not None:
+        if str(subsampling) not in SUBSAMPLING:
+            errors.append(f"{where}.subsampling: ожидается одно из {', '.join(SUBSAMPLING)}")
+        else:
+            jpeg.append(("subsampling", SUBSAMPLING[str(subsampling)]))
+    webp = [("quality", quality),
+            ("method", _number(int, spec.get("webp_method", 4), f"{where}.webp_method", errors, 4)),
+            ("lossless", bool(spec.get("lossless", False)))]
+    png = [("optimize", bool(spec.get("optimize", False))),
+           ("compress_level", _number(int, spec.get("png_compress_level", 6),
+                                      f"{where}.png_compress_level", errors, 6))]
+    sink = str(spec.get("sink") or "dir").lower()
+    if sink not in OUTPUT_SINKS:
+        errors.append(f"{where}.sink: ожидается одно из {', '.join(OUTPUT_SINKS)}")
+        sink = "dir"
+    return OutputPlan(
+        format=fmt,
+        ext=ext,
+        options={"JPEG": tuple(jpeg), "WEBP": tuple(webp), "PNG": tuple(png)},
+        writers=_number(int, spec.get("writers", 2), f"{where}.writers", errors, 2),
+        queue=max(1, _number(int, spec.get("queue", 8), f"{where}.queue", errors, 8)),
+        sink=sink,
+        archive=spec.get("archive") or None,
+    )
@@ -0,0 +1,112 @@
+"""Подготовка исходного фото перед удалением фона.
+
+Фото поставщиков бывают по 4000+ px, а зона image_box — несколько сотен
+пикселей. Раньше полноразмерный кадр переводился в RGBA, маска фона строилась
+по полному массиву numpy, и только потом картинка уменьшалась до зоны.
+Здесь кадр сразу уменьшается примерно до размера зоны (с запасом oversample):
+JPEG декодируется в режиме draft (масштаб 1/2, 1/4, 1/8 прямо в декодере),
+остаток добирается Image.reduce() — целочисленным усреднением блоков.
+Оба шага не опускают размер ниже цели, финальный resize делает остальное.
+
+Здесь же до декодирования проверяется предел memory.max_pixels (аналог
+Image.MAX_IMAGE_PIXELS, но на задание, а не на процесс): больший JPEG
+декодируется в масштабе, который укладывается в предел, остальные кадры
+отклоняются ImageTooLarge.
+"""
+from typing import Optional, Tuple
+
+
+RESAMPLE_NAMES = ("nearest", "box", "bilinear", "hamming", "bicubic", "lanczos")
+
+
+def resample_filter(name: Optional[str]):
+    """Фильтр Pillow по имени; None — фильтр resize() по умолчанию."""
+    if not name:
+        return None
+    from PIL import Image
+
+    return getattr(Image.Resampling, str(name).upper())
+
+
+class ImageTooLarge(ValueError):
+    """Кадр больше memory.max_pixels и не может быть уменьшен до декодирования."""
+
+
+_DRAFT_SCALES = (1, 2, 4, 8)
+
+
+def target_size(box: Tuple[int, int], oversample: float) -> Tuple[int, int]:
+    return (max(1, int(box[0] * oversample)), max(1, int(box[1] * oversample)))
+
+
+def draft_scale(size: Tuple[int, int], request: Optional[Tuple[int, int]]) -> int:
+    """Знаменатель масштаба, который выберет Image.draft() для JPEG размера size."""
+    if request is None:
+        return 1
+    scale = min(size[0] // max(1, request[0]), size[1] // max(1, request[1]))
+    return max(d for d in _DRAFT_SCALES if d <= max(1, scale))
+
+
+def limit_scale(size: Tuple[int, int], max_pixels: int) -> Optional[int]:
+    """Наименьший масштаб draft, при котором кадр не больше max_pixels; None — такого нет."""
+    w, h = size
+    for d in _DRAFT_SCALES:
+        if -(-w // d) * -(-h // d) <= max_pixels:
+            return d
+    return None
+
+
+def _too_large(size: Tuple[int, int], max_pixels: int) -> ImageTooLarge:
+    w, h = size
+    return ImageTooLarge(f"Кадр {w}x{h} ({w * h / 1e6:.1f} Мп) больше memory.max_pixels "
+                         f"({max_pixels / 1e6:.1f} Мп)")
+
+
+def check_pixels(img, max_pixels: int, downscale: bool = True) -> int:
+    """Проверяет ещё не декодированный кадр на предел max_pixels.
+
+    Возвращает масштаб draft, не меньше которого кадр надо декодировать
+    (1 — без ограничений). Бросает ImageTooLarge, если кадр не уменьшить в
+    декодере: не JPEG, downscale выключен или не хватает даже 1/8.
+    """
+    w, h = img.size
+    if not max_pixels or w * h <= max_pixels:
+        return 1
+    if downscale and img.format == "JPEG" and img.mode in ("RGB", "L", "CMYK"):
+        d = limit_scale((w, h), max_pixels)
+        if d is not None:
+            return d
+    raise _too_large((w, h), max_pixels)
+
+
+def prepare_source(img, box: Optional[Tuple[int, int]], oversample: float = 2.0,
+                   max_pixels: int = 0, downscale: bool = True):
+    """Уменьшает только что открытое (ещё не декодированное) фото под зону box.
+
+    Обе стороны результата не меньше box * oversample: запас нужен, потому что
+    после автообрезки фона товар растягивается на всю зону. max_pixels —
+    предел кадра (см. check_pixels); JPEG больше предела декодируется сразу
+    в уменьшенном масштабе, даже без box.
+    """
+    min_scale = check_pixels(img, max_pixels, downscale)
+    if box is None and min_scale == 1:
+        return img
+    target = target_size(box, oversample) if box is not None else None
+    if img.mode in ("1", "P"):
+        img = img.convert("RGBA")
+    if img.format == "JPEG" and img.mode in ("RGB", "L", "CMYK"):
+        request = target
+        if min_scale > draft_scale(img.size, request):
+            request = (img.width // min_scale, img.height // min_scale)
+        # draft выбирает наименьший масштаб, при котором кадр не меньше request
+        img.draft(img.mode, request)
+    if max_pixels and img.width * img.height > max_pixels:
+        # декодер не поддержал уменьшение (draft не применился)
+        raise _too_large(img.size, max_pixels)
+    if target is None:
+        return img
+    tw, th = target
+    factor = min(img.width // tw, img.height // th)
+    if factor >= 2:
+        img = img.reduce(factor)
+    return img
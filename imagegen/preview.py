@@ -0,0 +1,240 @@
+"""Превью строки данных в редакторе зон.
+
+PreviewRenderer рисует строку тем же кодом, что и RenderEngine, но каждую
+зону (фото, поле, многострочное поле) — в отдельный слой размером со свои
+границы. После правки конфига заново рисуются только зоны, у которых
+изменился план или текст, а кадр обновляется лишь в прямоугольниках их
+старых и новых границ: туда возвращается шаблон и накладываются все
+пересекающие слои в порядке рендера. Фото скачивается в фоне один раз на URL,
+а подготовленное под зону (load_source) пересчитывается из этих байт; и то и
+другое хранится в памяти для нескольких последних URL и зон.
+"""
+import copy
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from .engine import RenderEngine
+from .plan import ImageBoxPlan, RenderPlan, compile_plan
+
+
+Box = Tuple[int, int, int, int]
+# сколько скачанных фото и подготовленных под зону хранить между обновлениями
+RAW_CACHE_SIZE = 16
+SOURCE_CACHE_SIZE = 8
+
+
+def _intersect(a: Box, b: Box) -> Optional[Box]:
+    x0, y0 = max(a[0], b[0]), max(a[1], b[1])
+    x1, y1 = min(a[2], b[2]), min(a[3], b[3])
+    return (x0, y0, x1, y1) if x0 < x1 and y0 < y1 else None
+
+
+def _signature(item) -> Tuple[Any, ...]:
+    # шрифты берутся из FontCache, так что одинаковый шрифт — тот же объект
+    return (type(item).__name__,) + tuple(getattr(item, n) for n in item.__slots__)
+
+
+class _MeasureDraw:
+    """Заменяет ImageDraw: собирает границы текста, ничего не рисуя."""
+
+    def __init__(self) -> None:
+        from PIL import Image, ImageDraw
+
+        self.draw = ImageDraw.Draw(Image.new("L", (1, 1)))
+        self.bbox: Optional[Box] = None
+
+    def text(self, xy, text, fill=None, **kwargs) -> None:
+        if not text:
+            return
+        b = self.draw.textbbox(xy, text, **kwargs)
+        if self.bbox is None:
+            self.bbox = b
+        else:
+            self.bbox = (min(self.bbox[0], b[0]), min(self.bbox[1], b[1]),
+                         max(self.bbox[2], b[2]), max(self.bbox[3], b[3]))
+
+
+class _MaskDraw:
+    """Заменяет ImageDraw: рисует покрытие текста в маску слоя со сдвигом на её угол."""
+
+    def __init__(self, draw, dx: int, dy: int) -> None:
+        self.draw = draw
+        self.dx, self.dy = dx, dy
+        self.color: Any = None
+
+    def text(self, xy, text, fill=None, **kwargs) -> None:
+        self.color = fill
+        self.draw.text((xy[0] - self.dx, xy[1] - self.dy), text, fill=255, **kwargs)
+
+
+class _Layer:
+    __slots__ = ("sig", "box", "image", "mask", "color")
+
+    def __init__(self, sig, box: Optional[Box] = None, image=None, mask=None, color=None) -> None:
+        self.sig = sig
+        self.box = box
+        self.image = image
+        self.mask = mask
+        self.color = color
+
+
+class PreviewRenderer:
+    """Кадр превью одной строки с перерисовкой изменившихся зон.
+
+    config — словарь, который редактор меняет на месте; update(row) сверяет
+    его с нарисованным и возвращает прямоугольники кадра (frame), которые
+    изменились.
+    """
+
+    def __init__(self, config: Dict[str, Any], search_dirs: Optional[List[str]] = None) -> None:
+        from PIL import Image
+
+        self.config = config
+        self.search_dirs = list(search_dirs or [])
+        self.engine = RenderEngine(config, "", search_dirs=self.search_dirs)
+        with Image.open(self.engine.template_path) as tpl:
+            self.base = tpl.convert("RGB")
+        self.size = self.base.size
+        self.frame = self.base.copy()
+        self._layers: Dict[Tuple[str, int], _Layer] = {}
+        self._order: List[Tuple[str, int]] = []
+        self._raw: "OrderedDict[str, Future]" = OrderedDict()
+        self._sources: "OrderedDict[Tuple[Any, ...], Future]" = OrderedDict()
+        # загрузчик фото со снимком конфига: редактор тем временем может менять сам конфиг
+        self._photo_engine = RenderEngine(copy.deepcopy(config), "", search_dirs=self.search_dirs)
+        self._fetcher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="preview-fetch")
+        # один поток подготовки: план загрузчика меняется под каждую задачу
+        self._loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="preview")
+
+    def close(self) -> None:
+        self._fetcher.shutdown(wait=False)
+        self._loader.shutdown(wait=False)
+
+    def photo_pending(self) -> bool:
+        """Грузится ли ещё какое-нибудь фото (тогда update() стоит повторить)."""
+        return any(not f.done() for f in self._sources.values())
+
+    def update(self, row: Dict[str, Any]) -> List[Box]:
+        """Приводит кадр к текущему конфигу и строке; бросает PlanError."""
+        plan = compile_plan(self.config, self.size, self.engine.fonts)
+        order: List[Tuple[str, int]] = []
+        layers: Dict[Tuple[str, int], _Layer] = {}
+        if plan.image_box is not None:
+            order.append(("image", 0))
+            layers[("image", 0)] = self._photo_layer(plan, row)
+        for fp in plan.fields:
+            text = self.engine._field_text(fp, row)
+            layers[("field", fp.index)] = self._text_layer(
+                ("field", fp.index), (_signature(fp), text), lambda d, fp=fp, text=text: self.engine._draw_field(d, fp, text))
+            order.append(("field", fp.index))
+        for mp in plan.multiline_fields:
+            raw = row.get(mp.name, "")
+            text = "" if raw is None else str(raw)
+            layers[("multiline", mp.index)] = self._text_layer(
+                ("multiline", mp.index), (_signature(mp), text), lambda d, mp=mp, text=text: self.engine._draw_multiline(d, mp, text))
+            order.append(("multiline", mp.index))
+
+        dirty: List[Box] = []
+        for key in set(self._layers) | set(layers):
+            old, new = self._layers.get(key), layers.get(key)
+            if old is not None and new is not None and old is new:
+                continue
+            for layer in (old, new):
+                if layer is not None and layer.box is not None:
+                    dirty.append(layer.box)
+        if order != self._order and not dirty:
+            # поменялся только порядок слоёв
+            dirty.append((0, 0) + self.size)
+        self._layers, self._order = layers, order
+        for box in dirty:
+            self._compose(box)
+        return dirty
+
+    def _reuse(self, key: Tuple[str, int], sig) -> Optional[_Layer]:
+        layer = self._layers.get(key)
+        return layer if layer is not None and layer.sig == sig else None
+
+    def _text_layer(self, key: Tuple[str, int], sig, paint) -> _Layer:
+        from PIL import Image, ImageDraw
+
+        layer = self._reuse(key, sig)
+        if layer is not None:
+            return layer
+        measure = _MeasureDraw()
+        paint(measure)
+        if measure.bbox is None:
+            return _Layer(sig)
+        W, H = self.size
+        box = _intersect((int(measure.bbox[0]), int(measure.bbox[1]),
+                          int(measure.bbox[2]) + 1, int(measure.bbox[3]) + 1), (0, 0, W, H))
+        if box is None:
+            return _Layer(sig)
+        mask = Image.new("L", (box[2] - box[0], box[3] - box[1]), 0)
+        draw = _MaskDraw(ImageDraw.Draw(mask), box[0], box[1])
+        paint(draw)
+        color = draw.color[:3] if isinstance(draw.color, tuple) else draw.color
+        return _Layer(sig, box, mask=mask, color=color)
+
+    @staticmethod
+    def _cached(cache: "OrderedDict[Any, Future]", key, size: int, submit) -> Future:
+        fut = cache.get(key)
+        if fut is None:
+            fut = cache[key] = submit()
+            while len(cache) > size:
+                cache.popitem(last=False)
+        else:
+            cache.move_to_end(key)
+        return fut
+
+    def _source(self, plan: RenderPlan, ib: ImageBoxPlan, url: str) -> Future:
+        # перемещение и размер зоны меняют только подготовку фото, байты берутся из памяти
+        raw = self._cached(self._raw, url, RAW_CACHE_SIZE,
+                           lambda: self._fetcher.submit(self._photo_engine._download, url))
+        key = (url, ib.remove_bg, ib.bg_color, ib.tolerance, ib.auto_crop, ib.bg_mode, ib.feather,
+               ib.prepare_box, ib.oversample)
+        return self._cached(self._sources, key, SOURCE_CACHE_SIZE,
+                            lambda: self._loader.submit(self._load_source, plan, url, raw))
+
+    def _load_source(self, plan: RenderPlan, url: str, raw: Future):
+        engine = self._photo_engine
+        engine._plan = plan
+        return engine.load_source(url, raw.result())
+
+    def _photo_layer(self, plan: RenderPlan, row: Dict[str, Any]) -> _Layer:
+        ib = plan.image_box
+        url = str(row.get(ib.source_column, "") or "").strip() if ib.source_column else ""
+        fut = self._source(plan, ib, url) if url else None
+        ready = fut is not None and fut.done() and fut.exception() is None
+        sig = (_signature(ib), url, ready)
+        layer = self._reuse(("image", 0), sig)
+        if layer is not None or not ready:
+            return layer or _Layer(sig)
+        resized, bw, bh = RenderEngine.fit_image(fut.result(), ib, self.size)
+        off_x = ib.x + (bw - resized.width) // 2
+        off_y = ib.y + (bh - resized.height) // 2
+        W, H = self.size
+        box = _intersect((off_x, off_y, off_x + resized.width, off_y + resized.height), (0, 0, W, H))
+        if box is None:
+            return _Layer(sig)
+        image = resized.crop((box[0] - off_x, box[1] - off_y, box[2] - off_x, box[3] - off_y))
+        mask = image.getchannel("A") if image.mode == "RGBA" else None
+        return _Layer(sig, box, image=image.convert("RGB"), mask=mask)
+
+    def _compose(self, region: Box) -> None:
+        """Возвращает шаблон в region и заново накладывает пересекающие его слои."""
+        self.frame.paste(self.base.crop(region), region[:2])
+        for key in self._order:
+            layer = self._layers[key]
+            if layer.box is None:
+                continue
+            inter = _intersect(layer.box, region)
+            if inter is None:
+                continue
+            lx, ly = layer.box[:2]
+            local = (inter[0] - lx, inter[1] - ly, inter[2] - lx, inter[3] - ly)
+            mask = layer.mask.crop(local) if layer.mask is not None else None
+            if layer.image is None:
+                self.frame.paste(layer.color, inter, mask)
+            else:
+                self.frame.paste(layer.image.crop(local), inter[:2], mask)
@@ -0,0 +1,578 @@
+"""Сервис рендера: engine остаётся в памяти между заданиями.
+
+    python -m imagegen serve --config conf.json --port 8777 --drop /srv/render/inbox
+
+Обычный запуск CLI каждый раз заново импортирует Pillow и NumPy, декодирует
+шаблон, загружает шрифты и прогревает кэши. Сервис делает это один раз:
+engine (план, базовый слой шаблона, шрифты, фото в памяти) хранится в LRU по
+конфигу и переиспользуется следующими заданиями с тем же конфигом, поэтому
+перерисовка одной карточки занимает время рендера самой строки.
+
+Задание — JSON-объект (по одному на строку в JSONL):
+
+    {"id": "pim-42", "priority": 10, "rows": [{"Артикул": "4IF106", ...}], "force": true}
+    {"config": "other.json", "input": "data.xlsx", "out": "output/other"}
+
+Задания выполняются по одному, сначала с большим priority, при равном — по
+порядку поступления. Принимаются по HTTP (serve_http) и из папки (DropFolder):
+
+    POST   /jobs[?wait=С]   задание (объект, массив или JSONL); wait — дождаться окончания
+    GET    /jobs            состояние всех заданий
+    GET    /jobs/<id>[?wait=С]
+    DELETE /jobs/<id>       отмена: задание из очереди снимается, идущее
+                            останавливается после текущей строки
+    GET    /status          очередь и engine в памяти
+
+В папке задания лежат файлами *.jsonl; строка {"cancel": "<id>"} отменяет
+задание. Состояние пишется в <папка>/status/<id>.json.
+"""
+import copy
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from .cache import cache_key
+from .config import DEFAULT_CONFIG, deep_merge, get_run_dir, load_config, resolve_resource
+from .engine import RenderEngine
+from .sources import open_rows
+
+
+JOB_STATES = ("queued", "running", "done", "failed", "cancelled")
+FINAL_STATES = ("done", "failed", "cancelled")
+# ключи задания; остальные — ошибка, чтобы опечатка не превращалась в молчаливый рендер по умолчанию
+JOB_KEYS = ("id", "priority", "config", "input", "rows", "out", "force", "workers")
+
+
+@dataclass
+class Job:
+    """Задание сервиса и его состояние (state — одно из JOB_STATES)."""
+    id: str
+    spec: Dict[str, Any]
+    priority: int = 0
+    origin: str = "http"
+    state: str = "queued"
+    submitted: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    total: int = 0
+    done: int = 0
+    rendered: int = 0
+    skipped: int = 0
+    failed: int = 0
+    # строки, нарисованные без фото: загрузка или разбор фото не удались
+    photo_errors: int = 0
+    errors: Dict[str, str] = field(default_factory=dict)
+    outputs: List[str] = field(default_factory=list)
+    message: str = ""
+    cancel: threading.Event = field(default_factory=threading.Event, repr=False)
+    ended: threading.Event = field(default_factory=threading.Event, repr=False)
+    # счётчики и списки меняет поток рендера, а читают потоки HTTP и папки заданий
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def status(self, outputs: bool = True) -> Dict[str, Any]:
+        """Состояние для ответа HTTP и файла status/<id>.json (снимок под lock)."""
+        with self.lock:
+            status = {
+                "id": self.id, "state": self.state, "priority": self.priority, "origin": self.origin,
+                "submitted": _stamp(self.submitted), "started": _stamp(self.started),
+                "finished": _stamp(self.finished),
+                "seconds": round((self.finished or time.time()) - self.started, 3) if self.started else None,
+                "total": self.total, "done": self.done, "rendered": self.rendered,
+                "skipped": self.skipped, "failed": self.failed, "photo_errors": self.photo_errors,
+                "errors": dict(self.errors),
+                "message": self.message,
+            }
+            if outputs:
+                status["outputs"] = list(self.outputs)
+        return status
+
+
+def _stamp(t: Optional[float]) -> Optional[str]:
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t)) if t else None
+
+
+def _write_json(path: str, data: Dict[str, Any]) -> None:
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1, default=str)
+    os.replace(tmp, path)
+
+
+def parse_jobs(text: str) -> List[Dict[str, Any]]:
+    """Задания из тела запроса или файла: JSON-объект, массив объектов или JSONL.
+
+    Бросает ValueError с номером строки, если JSON не разбирается.
+    """
+    text = text.strip()
+    if not text:
+        return []
+    try:
+        data = json.loads(text)
+    except ValueError:
+        data = None
+        items = []
+        for n, line in enumerate(text.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError as e:
+                raise ValueError(f"строка {n}: {e}") from None
+    else:
+        items = data if isinstance(data, list) else [data]
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError("задание должно быть JSON-объектом")
+    return items
+
+
+class EngineCache:
+    """RenderEngine по конфигу (LRU): прогретые шаблон, шрифты и кэши переживают задание.
+
+    Ключ включает mtime шаблона, так что изменённый на диске шаблон подхватывается
+    новым engine.
+    """
+
+    def __init__(self, maxsize: int = 4) -> None:
+        self.maxsize = max(1, int(maxsize))
+        self._engines: "OrderedDict[str, RenderEngine]" = OrderedDict()
+        self.stats = {"hit": 0, "miss": 0}
+
+    def get(self, config: Dict[str, Any], search_dirs: List[str]) -> RenderEngine:
+        template = resolve_resource(config.get("template", "template.jpg"), search_dirs)
+        try:
+            mtime = os.stat(template).st_mtime_ns
+        except OSError:
+            mtime = 0
+        key = cache_key(json.dumps(config, sort_keys=True, ensure_ascii=False, default=str),
+                        *search_dirs, mtime)
+        engine = self._engines.get(key)
+        if engine is not None:
+            self._engines.move_to_end(key)
+            self.stats["hit"] += 1
+            return engine
+        self.stats["miss"] += 1
+        engine = RenderEngine(config, "", search_dirs=search_dirs)
+        engine.check()
+        self._engines[key] = engine
+        while len(self._engines) > self.maxsize:
+            self._engines.popitem(last=False)
+        return engine
+
+    def __len__(self) -> int:
+        return len(self._engines)
+
+
+class RenderService:
+    """Очередь заданий с приоритетами и поток, который выполняет их по одному.
+
+    config и search_dirs — конфиг по умолчанию для заданий без "config";
+    output_dir — папка вывода по умолчанию (иначе output_dir из конфига).
+    on_log(text) получает строки лога; on_change(job) вызывается при смене
+    состояния задания и не чаще раза в секунду во время рендера.
+    """
+
+    def __init__(self, config: Dict[str, Any], search_dirs: Optional[List[str]] = None,
+                 output_dir: Optional[str] = None, engines: Optional[int] = None,
+                 keep_jobs: Optional[int] = None,
+                 on_log: Optional[Callable[[str], None]] = None) -> None:
+        svc_cfg = config.get("service", {}) or {}
+        self.config = config
+        self.search_dirs = list(search_dirs or [])
+        self.output_dir = output_dir
+        self.engines = EngineCache(engines if engines is not None else int(svc_cfg.get("engines", 4) or 1))
+        self.keep_jobs = int(keep_jobs if keep_jobs is not None else svc_cfg.get("keep_jobs", 1000) or 0)
+        self.memory_ttl = float(svc_cfg.get("memory_ttl", 300) or 0)
+        self.on_log = on_log or (lambda text: None)
+        self.listeners: List[Callable[[Job], None]] = []
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._queue: List[Tuple[int, int, Job]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._running: Optional[Job] = None
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, warm: bool = True) -> None:
+        """Запускает поток заданий; warm — заранее загрузить engine конфига по умолчанию."""
+        if warm:
+            engine = self.engines.get(self.config, self.search_dirs)
+            engine.base_layer()
+        self._thread = threading.Thread(target=self._loop, name="render-service", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Останавливает поток; идущее задание отменяется после текущей строки."""
+        with self._cond:
+            self._stopped = True
+            if self._running is not None:
+                self._running.cancel.set()
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def submit(self, spec: Dict[str, Any], origin: str = "http") -> Job:
+        """Ставит задание в очередь. Бросает ValueError при ошибке в описании задания."""
+        return self.submit_many([spec], origin)[0]
+
+    def submit_many(self, specs: List[Dict[str, Any]], origin: str = "http") -> List[Job]:
+        """Ставит задания в очередь все или ни одного.
+
+        Бросает ValueError с номером задания, если хоть одно описание с
+        ошибкой или id повторяется; тогда в очередь не попадает ничего.
+        """
+        checked: List[Tuple[str, int]] = []
+        for n, spec in enumerate(specs, 1):
+            try:
+                checked.append(self._check(spec))
+            except ValueError as e:
+                raise ValueError(f"задание {n}: {e}" if len(specs) > 1 else str(e)) from None
+        ids = [job_id for job_id, _ in checked]
+        if len(set(ids)) != len(ids):
+            raise ValueError("id заданий в одном запросе повторяются")
+        jobs: List[Job] = []
+        with self._cond:
+            for job_id in ids:
+                old = self._jobs.get(job_id)
+                if old is not None and old.state not in FINAL_STATES:
+                    raise ValueError(f"задание {job_id} уже в работе")
+            for spec, (job_id, priority) in zip(specs, checked):
+                job = Job(job_id, spec, priority=priority, origin=origin)
+                self._jobs.pop(job_id, None)
+                self._jobs[job_id] = job
+                heapq.heappush(self._queue, (-priority, next(self._seq), job))
+                jobs.append(job)
+            self._forget_old()
+            self._cond.notify_all()
+        for job in jobs:
+            self._changed(job)
+        return jobs
+
+    @staticmethod
+    def _check(spec: Dict[str, Any]) -> Tuple[str, int]:
+        """(id, приоритет) задания; ValueError при ошибке в описании."""
+        unknown = sorted(set(spec) - set(JOB_KEYS))
+        if unknown:
+            raise ValueError(f"неизвестные ключи задания: {', '.join(unknown)}")
+        if ("input" in spec) == ("rows" in spec):
+            raise ValueError("нужен ровно один из ключей input и rows")
+        if "rows" in spec and not (isinstance(spec["rows"], list)
+                                   and all(isinstance(r, dict) for r in spec["rows"])):
+            raise ValueError("rows: ожидается список объектов")
+        try:
+            priority = int(spec.get("priority", 0) or 0)
+        except (TypeError, ValueError):
+            raise ValueError("priority: ожидается целое число") from None
+        return str(spec.get("id") or uuid.uuid4().hex[:12]), priority
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Отменяет задание; None, если такого нет. Завершённое задание не меняется."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.state in FINAL_STATES:
+                return job
+            job.cancel.set()
+            if job.state == "queued":
+                # из кучи задание уберёт поток, когда до него дойдёт очередь
+                self._finish(job, "cancelled")
+        if job.state == "cancelled":
+            self._changed(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def jobs(self) -> List[Job]:
+        with self._cond:
+            return list(self._jobs.values())
+
+    def summary(self) -> Dict[str, Any]:
+        with self._cond:
+            states = {s: 0 for s in JOB_STATES}
+            for job in self._jobs.values():
+                states[job.state] += 1
+            running = self._running.id if self._running is not None else None
+        return {"jobs": states, "running": running, "engines": len(self.engines),
+                "engine_hits": self.engines.stats["hit"], "engine_misses": self.engines.stats["miss"]}
+
+    def _forget_old(self) -> None:
+        # завершённые задания хранятся для запросов состояния, но не бесконечно
+        if self.keep_jobs <= 0:
+            return
+        extra = len(self._jobs) - self.keep_jobs
+        for job_id in [j.id for j in self._jobs.values() if j.state in FINAL_STATES][:max(0, extra)]:
+            del self._jobs[job_id]
+
+    def _finish(self, job: Job, state: str) -> None:
+        with job.lock:
+            job.state = state
+            job.finished = time.time()
+        job.ended.set()
+
+    def _changed(self, job: Job) -> None:
+        for listener in self.listeners:
+            try:
+                listener(job)
+            except Exception as e:
+                self.on_log(f"Ошибка обработчика задания {job.id}: {type(e).__name__}: {e}")
+
+    def _next(self) -> Optional[Job]:
+        with self._cond:
+            while True:
+                while self._queue and self._queue[0][2].state != "queued":
+                    heapq.heappop(self._queue)
+                if self._stopped:
+                    return None
+                if self._queue:
+                    job = heapq.heappop(self._queue)[2]
+                    job.state, job.started = "running", time.time()
+                    self._running = job
+                    return job
+                self._cond.wait()
+
+    def _loop(self) -> None:
+        while True:
+            job = self._next()
+            if job is None:
+                return
+            self._changed(job)
+            try:
+                self._run(job)
+            except Exception as e:
+                job.message = f"{type(e).__name__}: {e}"
+                if not isinstance(e, (OSError, ValueError)):
+                    self.on_log(traceback.format_exc())
+                state = "failed"
+            else:
+                state = "cancelled" if job.cancel.is_set() else "done"
+            with self._cond:
+                self._running = None
+                self._finish(job, state)
+            self.on_log(f"Задание {job.id}: {state}, {job.rendered} сохранено, {job.skipped} без изменений, "
+                        f"{job.failed} с ошибками, {job.photo_errors} без фото "
+                        f"({job.status(outputs=False)['seconds']} с)")
+            self._changed(job)
+
+    def _job_config(self, spec: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+        config = spec.get("config")
+        if config is None:
+            return self.config, self.search_dirs
+        if isinstance(config, str):
+            return load_config(config), [os.path.dirname(os.path.abspath(config)), os.getcwd()]
+        if isinstance(config, dict):
+            return deep_merge(copy.deepcopy(DEFAULT_CONFIG), config), self.search_dirs
+        raise ValueError("config: ожидается путь к JSON или объект")
+
+    def _job_rows(self, spec: Dict[str, Any], config: Dict[str, Any]) -> Tuple[Iterator, int]:
+        if "rows" in spec:
+            return iter(list(enumerate(spec["rows"]))), len(spec["rows"])
+        rows = open_rows(spec["input"], config)
+        return iter(rows), rows.total
+
+    def _run(self, job: Job) -> None:
+        spec = job.spec
+        config, search_dirs = self._job_config(spec)
+        out_dir = spec.get("out") or self.output_dir or os.path.join(get_run_dir(), config.get("output_dir", "output"))
+        engine = self.engines.get(config, search_dirs)
+        engine.set_output_dir(out_dir)
+        rows, job.total = self._job_rows(spec, config)
+        self.on_log(f"Задание {job.id}: строк {job.total}, папка {out_dir}")
+        force = bool(spec.get("force"))
+        # фото из памяти прошлых заданий свежи memory_ttl секунд; force берёт всё заново
+        events = engine.run_rows(rows, job.total, workers=spec.get("workers"), force=force,
+                                 memory_ttl=0 if force else self.memory_ttl)
+        reported = time.monotonic()
+        try:
+            for ev in events:
+                if job.cancel.is_set():
+                    break
+                with job.lock:
+                    if ev.kind == "row":
+                        job.rendered += 1
+                        job.outputs.extend(ev.out_names)
+                    elif ev.kind == "skip":
+                        job.skipped += 1
+                        job.outputs.extend(ev.out_names)
+                    elif ev.kind == "error":
+                        job.failed += 1
+                        job.errors[str(ev.index)] = ev.message
+                    elif ev.kind == "done":
+                        job.message = ev.message
+                    if ev.kind in ("row", "error"):
+                        job.photo_errors += ev.stats.get("photo_error", 0)
+                    if ev.kind != "start":
+                        job.done = ev.done
+                if time.monotonic() - reported >= 1.0:
+                    reported = time.monotonic()
+                    self._changed(job)
+        finally:
+            # прерванный прогон дожидается записи уже нарисованных строк и не оставляет архива
+            events.close()
+
+
+class DropFolder:
+    """Задания из папки: файлы *.jsonl забираются переименованием в accepted/.
+
+    Переименование удаётся ровно одному процессу, так что папку могут
+    смотреть несколько сервисов. Состояние заданий из папки пишется в
+    status/<id>.json; ошибки разбора файла — в status/<файл>.error.json.
+    """
+
+    def __init__(self, service: RenderService, path: str, poll: float = 1.0) -> None:
+        self.service = service
+        self.path = path
+        self.poll = float(poll)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        for sub in ("accepted", "status"):
+            os.makedirs(os.path.join(path, sub), exist_ok=True)
+        service.listeners.append(self._write_status)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._loop, name="drop-folder", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _write_status(self, job: Job) -> None:
+        if job.origin == "drop":
+            _write_json(os.path.join(self.path, "status", f"{job.id}.json"), job.status())
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            self.scan()
+            self._stop.wait(self.poll)
+
+    def scan(self) -> int:
+        """Забирает и ставит в очередь файлы заданий; возвращает число принятых заданий."""
+        accepted = 0
+        try:
+            names = sorted(n for n in os.listdir(self.path) if n.endswith(".jsonl"))
+        except OSError:
+            return 0
+        for name in names:
+            claimed = os.path.join(self.path, "accepted", f"{time.strftime('%Y%m%d-%H%M%S')}-{name}")
+            try:
+                os.replace(os.path.join(self.path, name), claimed)
+            except OSError:
+                # файл забрал другой сервис
+                continue
+            accepted += self._accept(name, claimed)
+        return accepted
+
+    def _accept(self, name: str, path: str) -> int:
+        errors: List[str] = []
+        accepted = 0
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                specs = parse_jobs(f.read())
+        except (OSError, ValueError) as e:
+            specs, errors = [], [str(e)]
+        for n, spec in enumerate(specs, 1):
+            if set(spec) == {"cancel"}:
+                if self.service.cancel(str(spec["cancel"])) is None:
+                    errors.append(f"задание {n}: нет задания {spec['cancel']}")
+                continue
+            try:
+                self.service.submit(spec, origin="drop")
+                accepted += 1
+            except ValueError as e:
+                errors.append(f"задание {n}: {e}")
+        if errors:
+            _write_json(os.path.join(self.path, "status", f"{name}.error.json"), {"file": name, "errors": errors})
+            for error in errors:
+                self.service.on_log(f"{name}: {error}")
+        return accepted
+
+
+def _handler(service: RenderService):
+    class Handler(BaseHTTPRequestHandler):
+        server_version = "imagegen"
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+        def _reply(self, code: int, data: Dict[str, Any]) -> None:
+            body = json.dumps(data, ensure_ascii=False, default=str).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _route(self) -> Tuple[List[str], float]:
+            url = urlsplit(self.path)
+            try:
+                wait = float(parse_qs(url.query).get("wait", ["0"])[0])
+            except ValueError:
+                wait = 0.0
+            return [p for p in url.path.split("/") if p], wait
+
+        def do_GET(self) -> None:
+            parts, wait = self._route()
+            if parts == ["status"]:
+                return self._reply(200, service.summary())
+            if parts == ["jobs"]:
+                return self._reply(200, {"jobs": [j.status(outputs=False) for j in service.jobs()]})
+            if len(parts) == 2 and parts[0] == "jobs":
+                job = service.get(parts[1])
+                if job is None:
+                    return self._reply(404, {"error": f"нет задания {parts[1]}"})
+                if wait > 0:
+                    job.ended.wait(wait)
+                return self._reply(200, job.status())
+            self._reply(404, {"error": "неизвестный путь"})
+
+        def do_POST(self) -> None:
+            parts, wait = self._route()
+            if parts != ["jobs"]:
+                return self._reply(404, {"error": "неизвестный путь"})
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                specs = parse_jobs(self.rfile.read(length).decode("utf-8"))
+                if not specs:
+                    raise ValueError("пустой запрос")
+                jobs = service.submit_many(specs)
+            except (UnicodeDecodeError, ValueError) as e:
+                return self._reply(400, {"error": str(e)})
+            if wait > 0:
+                deadline = time.monotonic() + wait
+                for job in jobs:
+                    job.ended.wait(max(0.0, deadline - time.monotonic()))
+            done = all(job.state in FINAL_STATES for job in jobs)
+            self._reply(200 if done else 202, {"jobs": [job.status() for job in jobs]})
+
+        def do_DELETE(self) -> None:
+            parts, _ = self._route()
+            if len(parts) != 2 or parts[0] != "jobs":
+                return self._reply(404, {"error": "неизвестный путь"})
+            job = service.cancel(parts[1])
+            if job is None:
+                return self._reply(404, {"error": f"нет задания {parts[1]}"})
+            self._reply(200, job.status(outputs=False))
+
+    return Handler
+
+
+def serve_http(service: RenderService, host: str = "127.0.0.1", port: int = 8777) -> ThreadingHTTPServer:
+    """HTTP-сервер заданий (без авторизации — по умолчанию слушает только localhost).
+
+    Возвращает сервер; обработка запросов — server.serve_forever().
+    """
+    server = ThreadingHTTPServer((host, port), _handler(service))
+    server.daemon_threads = True
+    return server
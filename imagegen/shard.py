@@ -0,0 +1,351 @@
+"""Распределённый рендер через общую папку, без брокера.
+
+Координатор (init_queue) один раз читает файл данных и раскладывает строки
+по шардам фиксированного размера; шаблон и файлы шрифтов копируются в очередь,
+так что все узлы рисуют одними и теми же файлами:
+
+    job.json               конфиг, число шардов и строк, папка вывода
+    resources/             шаблон и шрифты координатора
+    shards/00000.jsonl     строки шарда: {"index": row_index, "row": {...}}
+    claims/00000.lock      захват шарда (создаётся атомарно, O_EXCL)
+    done/00000.json        запись о завершении шарда
+
+Воркеры (run_worker) на любых узлах захватывают свободные шарды, рендерят
+их в общую папку вывода и пишут запись о завершении. Пока шард в работе,
+воркер раз в heartbeat секунд обновляет mtime своего lock-файла. Захват,
+mtime которого не менялся stale_after секунд по часам наблюдателя (часы
+узлов сравнивать не нужно), считается брошенным: lock-файл переименовывается
+(это удаётся ровно одному воркеру), и шард снова свободен. Воркер, у которого
+отобрали захват, бросает шард, не записав результат.
+
+У каждого шарда свой манифест (.manifest.<шард>.jsonl), поэтому подхваченный
+шард продолжается с места остановки (при записи в архив, output.sink, у
+шарда свой архив images.<шард>.<ext>, и он рисуется заново целиком). Шард с ошибками в строках тоже
+считается завершённым; чтобы повторить его, удалите done/<шард>.json.
+"""
+import copy
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .engine import RenderEngine, RenderEvent
+from .sources import open_rows
+
+
+JOB_NAME = "job.json"
+JOB_VERSION = 1
+
+
+def shard_name(shard: int) -> str:
+    return f"{shard:05d}"
+
+
+def _write_json(path: str, data: Dict[str, Any]) -> None:
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1, default=str)
+    os.replace(tmp, path)
+
+
+def _read_json(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _copy_resource(src: str, queue_dir: str, name: str) -> str:
+    ext = os.path.splitext(src)[1]
+    rel = os.path.join("resources", name + ext)
+    shutil.copyfile(src, os.path.join(queue_dir, rel))
+    return rel.replace(os.sep, "/")
+
+
+def init_queue(config: Dict[str, Any], input_path: str, queue_dir: str,
+               shard_rows: Optional[int] = None, output_dir: Optional[str] = None,
+               search_dirs: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Создаёт очередь шардов в queue_dir и возвращает описание задания (job.json).
+
+    output_dir — общая папка вывода; относительный путь считается от queue_dir
+    (по умолчанию queue_dir/output). Бросает FileExistsError, если очередь уже есть.
+    """
+    if os.path.exists(os.path.join(queue_dir, JOB_NAME)):
+        raise FileExistsError(f"Очередь уже создана: {queue_dir}")
+    engine = RenderEngine(config, "", search_dirs=search_dirs)
+    engine.check()
+    if shard_rows is None:
+        shard_rows = int((config.get("shard", {}) or {}).get("rows", 500) or 500)
+    shard_rows = max(1, int(shard_rows))
+    for sub in ("resources", "shards", "claims", "done"):
+        os.makedirs(os.path.join(queue_dir, sub), exist_ok=True)
+
+    job_config = copy.deepcopy(config)
+    job_config["template"] = _copy_resource(engine.template_path, queue_dir, "template")
+    font_cfg = job_config.setdefault("font", {})
+    path = engine.fonts.path()
+    font_cfg["ttf_path"] = _copy_resource(path, queue_dir, "font") if path else None
+    variants = {}
+    for i, variant in enumerate(font_cfg.get("variants") or {}):
+        path = engine.fonts.path(variant)
+        variants[variant] = _copy_resource(path, queue_dir, f"font-{i}") if path else None
+    if variants:
+        font_cfg["variants"] = variants
+
+    shards = rows = 0
+    out = None
+    try:
+        for idx, row in open_rows(input_path, config):
+            if rows % shard_rows == 0:
+                if out is not None:
+                    out.close()
+                out = open(os.path.join(queue_dir, "shards", shard_name(shards) + ".jsonl"),
+                           "w", encoding="utf-8")
+                shards += 1
+            out.write(json.dumps({"index": idx, "row": row}, ensure_ascii=False, default=str) + "\n")
+            rows += 1
+    finally:
+        if out is not None:
+            out.close()
+
+    job = {
+        "version": JOB_VERSION,
+        "input": os.path.basename(input_path),
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "shards": shards,
+        "rows": rows,
+        "shard_rows": shard_rows,
+        "output_dir": output_dir or "output",
+        "config": job_config,
+    }
+    # job.json пишется последним: воркеры не начнут, пока шарды не разложены
+    _write_json(os.path.join(queue_dir, JOB_NAME), job)
+    return job
+
+
+def load_job(queue_dir: str) -> Dict[str, Any]:
+    job = _read_json(os.path.join(queue_dir, JOB_NAME))
+    if job is None:
+        raise FileNotFoundError(f"Нет задания {JOB_NAME} в {queue_dir}")
+    if job.get("version") != JOB_VERSION:
+        raise ValueError(f"Неподдерживаемая версия задания: {job.get('version')}")
+    return job
+
+
+def shard_rows_of(queue_dir: str, shard: int) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    with open(os.path.join(queue_dir, "shards", shard_name(shard) + ".jsonl"), "r", encoding="utf-8") as f:
+        for line in f:
+            rec = json.loads(line)
+            yield rec["index"], rec["row"]
+
+
+class Claim:
+    """Захват шарда: lock-файл с токеном и поток, обновляющий его mtime."""
+
+    def __init__(self, path: str, token: str, heartbeat: float) -> None:
+        self.path = path
+        self.token = token
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._beat, args=(heartbeat,), daemon=True,
+                                        name="shard-heartbeat")
+        self._thread.start()
+
+    def owned(self) -> bool:
+        rec = _read_json(self.path)
+        return rec is not None and rec.get("token") == self.token
+
+    def _beat(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            if not self.owned():
+                self.lost.set()
+                return
+            try:
+                os.utime(self.path)
+            except OSError:
+                self.lost.set()
+                return
+
+    def release(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        if self.owned():
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+class ShardQueue:
+    """Захват шардов и поиск брошенных захватов в папке очереди."""
+
+    def __init__(self, queue_dir: str, worker_id: Optional[str] = None,
+                 stale_after: float = 120.0, heartbeat: float = 10.0) -> None:
+        self.queue_dir = queue_dir
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.stale_after = float(stale_after)
+        self.heartbeat = float(heartbeat)
+        self.job = load_job(queue_dir)
+        # шард -> (mtime lock-файла, когда он впервые увиден таким) по часам этого процесса
+        self._seen: Dict[int, Tuple[int, float]] = {}
+
+    def _lock_path(self, shard: int) -> str:
+        return os.path.join(self.queue_dir, "claims", shard_name(shard) + ".lock")
+
+    def done_path(self, shard: int) -> str:
+        return os.path.join(self.queue_dir, "done", shard_name(shard) + ".json")
+
+    def done_shards(self) -> set:
+        names = os.listdir(os.path.join(self.queue_dir, "done"))
+        return {int(n[:-5]) for n in names if n.endswith(".json") and n[:-5].isdigit()}
+
+    def try_claim(self, shard: int) -> Optional[Claim]:
+        path = self._lock_path(shard)
+        token = uuid.uuid4().hex
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return None
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"worker": self.worker_id, "token": token, "claimed": time.time()}, f)
+        if os.path.exists(self.done_path(shard)):
+            # шард завершили между проверкой и захватом
+            os.remove(path)
+            return None
+        return Claim(path, token, self.heartbeat)
+
+    def requeue_stale(self, shard: int) -> bool:
+        """Освобождает шард, если его захват не обновлялся stale_after секунд."""
+        path = self._lock_path(shard)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            self._seen.pop(shard, None)
+            return False
+        now = time.monotonic()
+        seen = self._seen.get(shard)
+        if seen is None or seen[0] != mtime:
+            self._seen[shard] = (mtime, now)
+            return False
+        if now - seen[1] < self.stale_after:
+            return False
+        stale = f"{path}.stale.{uuid.uuid4().hex}"
+        try:
+            os.rename(path, stale)
+        except OSError:
+            # захват уже освободил другой воркер
+            return False
+        self._seen.pop(shard, None)
+        os.remove(stale)
+        return True
+
+
+def queue_status(queue_dir: str) -> Dict[str, Any]:
+    """Сводка очереди: шарды по состояниям, строки и ошибки из записей о завершении."""
+    job = load_job(queue_dir)
+    queue = ShardQueue(queue_dir)
+    done = queue.done_shards()
+    claimed = {}
+    for shard in range(job["shards"]):
+        if shard in done:
+            continue
+        rec = _read_json(queue._lock_path(shard))
+        if rec is not None:
+            claimed[shard] = rec.get("worker")
+    status = {"shards": job["shards"], "rows": job["rows"], "done": len(done), "claimed": claimed,
+              "pending": job["shards"] - len(done) - len(claimed),
+              "rendered": 0, "skipped": 0, "failed": 0, "errors": {}}
+    for shard in sorted(done):
+        rec = _read_json(queue.done_path(shard)) or {}
+        for k in ("rendered", "skipped", "failed"):
+            status[k] += int(rec.get(k, 0))
+        status["errors"].update(rec.get("errors", {}))
+    return status
+
+
+def _shard_options(job: Dict[str, Any], stale_after: Optional[float], heartbeat: Optional[float],
+                   poll: Optional[float]) -> Tuple[float, float, float]:
+    cfg = job["config"].get("shard", {}) or {}
+    return (float(stale_after if stale_after is not None else cfg.get("stale_after", 120)),
+            float(heartbeat if heartbeat is not None else cfg.get("heartbeat", 10)),
+            float(poll if poll is not None else cfg.get("poll", 2)))
+
+
+def run_worker(queue_dir: str, output_dir: Optional[str] = None, workers: Optional[int] = None,
+               force: bool = False, on_event: Optional[Callable[[int, RenderEvent], None]] = None,
+               stale_after: Optional[float] = None, heartbeat: Optional[float] = None,
+               poll: Optional[float] = None) -> Dict[str, int]:
+    """Берёт и рендерит шарды, пока все не завершены; возвращает счётчики этого воркера.
+
+    on_event(shard, event) получает события рендера каждого шарда.
+    Параметры по умолчанию — из секции "shard" конфига задания.
+    """
+    job = load_job(queue_dir)
+    stale_after, heartbeat, poll = _shard_options(job, stale_after, heartbeat, poll)
+    queue = ShardQueue(queue_dir, stale_after=stale_after, heartbeat=heartbeat)
+    out_dir = output_dir or job["output_dir"]
+    if not os.path.isabs(out_dir):
+        out_dir = os.path.join(queue_dir, out_dir)
+    # шаблон и шрифты задания лежат в queue_dir/resources; engine один на все шарды воркера
+    engine = RenderEngine(job["config"], out_dir, search_dirs=[queue_dir])
+    engine.check()
+    totals = {"shards": 0, "rendered": 0, "skipped": 0, "failed": 0, "requeued": 0}
+    while True:
+        done = queue.done_shards()
+        pending = [s for s in range(job["shards"]) if s not in done]
+        if not pending:
+            return totals
+        claim = None
+        for shard in pending:
+            claim = queue.try_claim(shard)
+            if claim is not None:
+                break
+        if claim is None:
+            totals["requeued"] += sum(queue.requeue_stale(s) for s in pending)
+            time.sleep(poll)
+            continue
+        try:
+            record = _render_shard(engine, queue_dir, shard, job, claim, workers, force, on_event)
+            if record is not None and claim.owned():
+                record["worker"] = queue.worker_id
+                _write_json(queue.done_path(shard), record)
+                totals["shards"] += 1
+                for k in ("rendered", "skipped", "failed"):
+                    totals[k] += record[k]
+        finally:
+            claim.release()
+
+
+def _render_shard(engine: RenderEngine, queue_dir: str, shard: int, job: Dict[str, Any], claim: Claim,
+                  workers: Optional[int], force: bool,
+                  on_event: Optional[Callable[[int, RenderEvent], None]]) -> Optional[Dict[str, Any]]:
+    """Рендерит шард; None — захват потерян и результат писать нельзя."""
+    start = job["shard_rows"] * shard
+    total = min(job["shard_rows"], job["rows"] - start)
+    record: Dict[str, Any] = {"shard": shard, "rows": total, "rendered": 0, "skipped": 0, "failed": 0,
+                              "errors": {}, "started": time.strftime("%Y-%m-%d %H:%M:%S")}
+    events = engine.run_rows(shard_rows_of(queue_dir, shard), total, workers=workers, force=force,
+                             manifest_name=f".manifest.{shard_name(shard)}.jsonl",
+                             archive_part=shard_name(shard))
+    try:
+        for ev in events:
+            if claim.lost.is_set():
+                return None
+            if ev.kind == "row":
+                record["rendered"] += 1
+            elif ev.kind == "skip":
+                record["skipped"] += 1
+            elif ev.kind == "error":
+                record["failed"] += 1
+                record["errors"][str(ev.index)] = ev.message
+            if on_event is not None:
+                on_event(shard, ev)
+    finally:
+        events.close()
+    record["finished"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    return record
@@ -0,0 +1,173 @@
+"""Потоковое чтение файла данных.
+
+Строки отдаются по мере разбора, без загрузки всего файла в DataFrame:
+XLSX читается openpyxl в режиме read_only, XLS — xlrd, CSV — модулем csv.
+Каждая строка — обычный dict {колонка: значение}; пустые ячейки — None.
+Полностью пустые строки пропускаются, но номер строки (row_index) при этом
+всё равно увеличивается, как при чтении через pandas.
+"""
+import csv
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+Row = Dict[str, Any]
+
+
+def _header(values) -> List[str]:
+    """Имена колонок; пустые и повторяющиеся названия разводятся как в pandas."""
+    names: List[str] = []
+    seen: Dict[str, int] = {}
+    for i, v in enumerate(values):
+        name = "" if v is None else str(v).strip()
+        if not name:
+            name = f"Unnamed: {i}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _is_empty(values) -> bool:
+    return all(v is None or (isinstance(v, str) and not v.strip()) for v in values)
+
+
+class RowSource:
+    """Итерируемый источник строк (row_index, row) для XLSX/XLS/CSV.
+
+    total — оценка числа строк данных без разбора файла: для CSV — число
+    переводов строки, для XLSX — размер листа из его заголовка; columns —
+    заголовок файла.
+    """
+
+    def __init__(self, path: str, sheet: Optional[str] = None, delimiter: str = ",",
+                 encoding: str = "utf-8-sig") -> None:
+        self.path = path
+        self.sheet = sheet
+        self.delimiter = delimiter
+        self.encoding = encoding
+        lower = path.lower()
+        if lower.endswith(".csv"):
+            self.kind = "csv"
+        elif lower.endswith(".xls"):
+            self.kind = "xls"
+        else:
+            self.kind = "xlsx"
+        self._total: Optional[int] = None
+        self._columns: Optional[List[str]] = None
+
+    @property
+    def columns(self) -> List[str]:
+        if self._columns is None:
+            for values in self._raw_rows():
+                self._columns = _header(values)
+                break
+            else:
+                self._columns = []
+        return self._columns
+
+    @property
+    def total(self) -> int:
+        if self._total is None:
+            self._total = self._count()
+        return self._total
+
+    def _count(self) -> int:
+        if self.kind == "xlsx":
+            wb = self._open_xlsx()
+            try:
+                ws = self._xlsx_sheet(wb)
+                if ws.max_row is None:
+                    ws.calculate_dimension(force=True)
+                return max(0, (ws.max_row or 1) - 1)
+            finally:
+                wb.close()
+        if self.kind == "csv":
+            # кавычки с переводами строк внутри дают завышенную оценку — это допустимо
+            lines = 0
+            last = b"\n"
+            with open(self.path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    lines += chunk.count(b"\n")
+                    last = chunk[-1:]
+            if last != b"\n":
+                lines += 1
+            return max(0, lines - 1)
+        return max(0, sum(1 for _ in self._raw_rows()) - 1)
+
+    def __iter__(self) -> Iterator[Tuple[int, Row]]:
+        rows = self._raw_rows()
+        header = None
+        idx = -1
+        for values in rows:
+            if header is None:
+                header = _header(values)
+                self._columns = header
+                continue
+            idx += 1
+            if _is_empty(values):
+                continue
+            row = {}
+            for name, v in zip(header, values):
+                if isinstance(v, str) and self.kind == "csv" and v == "":
+                    v = None
+                row[name] = v
+            yield idx, row
+
+    def _raw_rows(self) -> Iterator[Any]:
+        if self.kind == "csv":
+            with open(self.path, "r", encoding=self.encoding, newline="") as f:
+                yield from csv.reader(f, delimiter=self.delimiter)
+        elif self.kind == "xls":
+            import xlrd
+
+            book = xlrd.open_workbook(self.path, on_demand=True)
+            try:
+                sh = book.sheet_by_name(self.sheet) if self.sheet else book.sheet_by_index(0)
+                for r in range(sh.nrows):
+                    yield [None if c.ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK) else c.value
+                           for c in sh.row(r)]
+            finally:
+                book.release_resources()
+        else:
+            wb = self._open_xlsx()
+            try:
+                yield from self._xlsx_sheet(wb).iter_rows(values_only=True)
+            finally:
+                wb.close()
+
+    def _open_xlsx(self):
+        from openpyxl import load_workbook
+
+        return load_workbook(self.path, read_only=True, data_only=True)
+
+    def _xlsx_sheet(self, wb):
+        return wb[self.sheet] if self.sheet else wb.worksheets[0]
+
+
+def open_rows(path: str, config: Optional[Dict[str, Any]] = None) -> RowSource:
+    """RowSource по секции "input" конфига (sheet, csv_delimiter, encoding)."""
+    in_cfg = (config or {}).get("input", {}) or {}
+    return RowSource(
+        path,
+        sheet=in_cfg.get("sheet"),
+        delimiter=in_cfg.get("csv_delimiter") or ",",
+        encoding=in_cfg.get("encoding") or "utf-8-sig",
+    )
+
+
+def read_columns(path: str, config: Optional[Dict[str, Any]] = None) -> List[str]:
+    """Только заголовок файла данных (для списка колонок в редакторе зон)."""
+    return open_rows(path, config).columns
+
+
+def read_row(path: str, index: int, config: Optional[Dict[str, Any]] = None) -> Optional[Row]:
+    """Строка с номером index (row_index) или None, если её нет или она пустая."""
+    for idx, row in open_rows(path, config):
+        if idx == index:
+            return row
+        if idx > index:
+            break
+    return None
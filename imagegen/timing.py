@@ -0,0 +1,170 @@
+"""Замеры времени по стадиям рендера и экспорт трассы.
+
+Timings собирает суммарное время и число вызовов по стадиям (download,
+decode, remove_bg, resize, paste, text, encode, write), байты загрузок и,
+если включено, события трассы в формате Chrome trace event (открываются в
+chrome://tracing или Perfetto). Счётчики уходят в общие stats прогона,
+поэтому суммируются и по процессам-воркерам; события трассы каждый процесс
+дописывает в свой файл <trace>.parts/<pid>.jsonl, а родитель в конце прогона
+склеивает их в один JSON.
+
+Выключенный Timings отдаёт из span() один и тот же пустой контекст, так что
+цена замера сводится к вызову метода.
+"""
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+
+STAGES = ("download", "decode", "remove_bg", "resize", "paste", "text", "encode", "write")
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        return None
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("timings", "name", "args", "start")
+
+    def __init__(self, timings: "Timings", name: str, args: Optional[Dict[str, Any]]) -> None:
+        self.timings = timings
+        self.name = name
+        self.args = args
+
+    def __enter__(self) -> "_Span":
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.timings._add(self.name, self.start, time.perf_counter_ns() - self.start, self.args)
+
+
+class Timings:
+    """Счётчики стадий одного процесса; trace_path — куда в итоге пишется трасса."""
+
+    def __init__(self, enabled: bool = False, trace_path: Optional[str] = None) -> None:
+        self.enabled = bool(enabled or trace_path)
+        self.trace_path = trace_path
+        self.stats: Counter = Counter()
+        self._events: List[Dict[str, Any]] = []
+        self._threads: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def span(self, name: str, args: Optional[Dict[str, Any]] = None):
+        """with timings.span("decode"): ... — замер стадии name."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def count(self, name: str, value: float) -> None:
+        if self.enabled:
+            with self._lock:
+                self.stats[name] += value
+
+    def _add(self, name: str, start_ns: int, dur_ns: int, args: Optional[Dict[str, Any]]) -> None:
+        with self._lock:
+            self.stats["time_" + name] += dur_ns / 1e9
+            self.stats["calls_" + name] += 1
+            if self.trace_path:
+                tid = threading.get_ident()
+                if tid not in self._threads:
+                    self._threads[tid] = threading.current_thread().name
+                event = {"name": name, "ph": "X", "ts": start_ns // 1000, "dur": dur_ns // 1000,
+                         "pid": os.getpid(), "tid": tid}
+                if args:
+                    event["args"] = args
+                self._events.append(event)
+
+    def take_stats(self) -> Counter:
+        """Счётчики с прошлого вызова; события трассы при этом сбрасываются в файл процесса."""
+        with self._lock:
+            stats, self.stats = self.stats, Counter()
+            events, self._events = self._events, []
+            threads = dict(self._threads)
+        if events:
+            self._flush(events, threads)
+        return stats
+
+    def _flush(self, events: List[Dict[str, Any]], threads: Dict[int, str]) -> None:
+        parts = self.trace_path + ".parts"
+        os.makedirs(parts, exist_ok=True)
+        pid = os.getpid()
+        with open(os.path.join(parts, f"{pid}.jsonl"), "a", encoding="utf-8") as f:
+            f.write(json.dumps({"name": "process_name", "ph": "M", "pid": pid, "tid": 0,
+                                "args": {"name": multiprocessing.current_process().name}}) + "\n")
+            for tid, name in threads.items():
+                f.write(json.dumps({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                                    "args": {"name": name}}) + "\n")
+            for event in events:
+                f.write(json.dumps(event) + "\n")
+
+    def write_trace(self) -> Optional[str]:
+        """Склеивает файлы процессов в trace_path (Chrome trace JSON)."""
+        if not self.trace_path:
+            return None
+        self.take_stats()
+        parts = self.trace_path + ".parts"
+        events: List[Dict[str, Any]] = []
+        seen_meta = set()
+        if os.path.isdir(parts):
+            for name in sorted(os.listdir(parts)):
+                with open(os.path.join(parts, name), "r", encoding="utf-8") as f:
+                    for line in f:
+                        event = json.loads(line)
+                        if event["ph"] == "M":
+                            key = (event["name"], event["pid"], event["tid"])
+                            if key in seen_meta:
+                                continue
+                            seen_meta.add(key)
+                        events.append(event)
+            shutil.rmtree(parts, ignore_errors=True)
+        folder = os.path.dirname(os.path.abspath(self.trace_path))
+        os.makedirs(folder, exist_ok=True)
+        with open(self.trace_path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        return self.trace_path
+
+
+def stage_report(stats: Counter, wall: float) -> Dict[str, Any]:
+    """Сводка по стадиям для JSON-отчёта: время, вызовы, среднее, доля от прогона."""
+    stages = {}
+    for name in STAGES + tuple(sorted({k[5:] for k in stats if k.startswith("time_")} - set(STAGES))):
+        total = stats.get("time_" + name, 0.0)
+        calls = stats.get("calls_" + name, 0)
+        if not calls:
+            continue
+        stages[name] = {
+            "calls": calls,
+            "total_s": round(total, 4),
+            "mean_ms": round(total * 1000.0 / calls, 3),
+            "share": round(total / wall, 4) if wall > 0 else None,
+        }
+    return {"wall_s": round(wall, 3), "download_bytes": int(stats.get("bytes_download", 0)),
+            "stages": stages}
+
+
+def format_stage_table(stats: Counter, wall: float) -> str:
+    """Таблица по стадиям для лога. Сумма может превышать время прогона:
+    загрузки, запись и воркеры работают параллельно с рендером."""
+    report = stage_report(stats, wall)
+    lines = [f"{'Стадия':<10} {'вызовов':>8} {'всего, с':>9} {'среднее, мс':>12} {'доля':>6}"]
+    for name, s in report["stages"].items():
+        share = f"{s['share'] * 100:5.1f}%" if s["share"] is not None else "     -"
+        lines.append(f"{name:<10} {s['calls']:>8} {s['total_s']:>9.3f} {s['mean_ms']:>12.2f} {share:>6}")
+    mb = report["download_bytes"] / (1024 * 1024)
+    lines.append(f"Прогон: {report['wall_s']:.2f} с, загружено {mb:.1f} МБ")
+    return "\n".join(lines)
@@ -0,0 +1,349 @@
+"""Проверка файла данных без растра: отчёт о проблемах до дорогого рендера.
+
+    python -m imagegen check --config conf.json --input data.xlsx --report report.csv
+
+Текст раскладывается теми же функциями, что и при рендере (TextLayout,
+clean_multiline_parts), но только по метрикам шрифта: ничего не рисуется и
+не кодируется, шаблон не декодируется (размер берётся из заголовка). Находит:
+
+    empty        пустое значение поля
+    overflow     текст не влез в зону: слова за высотой поля, строки
+                 multiline_fields сверх max_lines или высоты зоны
+    too_wide     слово шире зоны поля или текст выходит за край шаблона
+    clamped      строки multiline_fields, обрезанные по max_chars
+    truncated    строки, обрезанные многоточием по ширине (fit_width)
+    hidden       заголовок multiline_fields не влезает, поле не рисуется
+    no_article   нет артикула, имя файла строится по номеру строки
+    bad_filename имя файла не строится по filename_pattern
+    collision    имя файла совпадает с другой строкой (перезапишет её)
+    no_image     пустая ссылка на фото
+    image_missing, image_error
+                 фото недоступно: HTTP-код >= 400 или ошибка соединения
+
+Фото проверяются по кэшу на диске, а чего там нет — запросом HEAD, по одному
+на уникальный URL, в пуле потоков (download.concurrency).
+"""
+import csv
+import json
+import math
+import os
+import re
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .engine import ARTICLE_COLUMNS, RenderEngine, clean_multiline_parts
+from .layout import TextLayout
+from .plan import FieldPlan, MultilinePlan
+
+
+ISSUES = {
+    "empty": "пустое значение",
+    "overflow": "текст не влез в зону",
+    "too_wide": "шире зоны или шаблона",
+    "clamped": "обрезано по max_chars",
+    "truncated": "обрезано по ширине",
+    "hidden": "поле не рисуется",
+    "no_article": "нет артикула",
+    "bad_filename": "ошибка в имени файла",
+    "collision": "совпадает имя файла",
+    "no_image": "нет ссылки на фото",
+    "image_missing": "фото не найдено",
+    "image_error": "фото недоступно",
+}
+IMAGE_MODES = ("head", "cache", "off")
+# доля размера шрифта, внутри которой оценка ширины по символам перепроверяется точно
+CHAR_BAND = 0.15
+
+
+class CharLayout(TextLayout):
+    """Раскладка по ширинам символов: слово не измеряется FreeType целиком.
+
+    Артикулы и названия почти не повторяются, и точное измерение каждого
+    нового слова стоит дороже всей остальной проверки. Ширина слова здесь —
+    сумма advance символов (без кернинга и выносных элементов), поэтому
+    решения у самой границы зоны (CHAR_BAND от размера шрифта) проверяются
+    точным измерением, как в TextLayout.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._chars: Dict[int, Dict[str, float]] = {}
+
+    def band(self, font) -> float:
+        return max(3.0, getattr(font, "size", 0) * CHAR_BAND)
+
+    def word_metrics(self, font, word: str) -> Tuple[float, int]:
+        chars = self._chars.get(self._font_id(font))
+        if chars is None:
+            chars = self._chars[id(font)] = {}
+        adv = 0.0
+        for ch in word:
+            w = chars.get(ch)
+            if w is None:
+                w = chars[ch] = font.getlength(ch)
+            adv += w
+        return adv, math.ceil(adv)
+
+    def extent(self, font, text: str, anchor: str) -> Tuple[float, float]:
+        """Оценка (левый, правый) края строки относительно точки привязки."""
+        w = self.text_width(font, text)
+        h = (anchor or "la")[0]
+        if h == "m":
+            return -w / 2, w / 2
+        if h == "r":
+            return -w, 0.0
+        return 0.0, w
+
+
+@dataclass
+class Issue:
+    code: str
+    field: str = ""
+    detail: str = ""
+
+
+@dataclass
+class RowReport:
+    """Проблемы одной строки данных; files — имена её файлов."""
+    index: int
+    files: List[str]
+    issues: List[Issue] = field(default_factory=list)
+
+
+@dataclass
+class ValidationResult:
+    rows: List[RowReport]
+    stats: Counter
+    seconds: float
+
+    @property
+    def problem_rows(self) -> List[RowReport]:
+        return [r for r in self.rows if r.issues]
+
+
+class Validator:
+    """Проверки строк по плану engine (и его вариантов) без рисования.
+
+    images — "head" (кэш, затем HEAD), "cache" (только кэш на диске, остальное
+    не проверяется) или "off".
+    """
+
+    def __init__(self, engine: RenderEngine, images: str = "head") -> None:
+        if images not in IMAGE_MODES:
+            raise ValueError(f"images: ожидается одно из {', '.join(IMAGE_MODES)}")
+        self.engine = engine
+        self.images = images
+        # варианты с одинаковой разметкой проверяются один раз
+        renderers: Dict[int, Tuple[str, RenderEngine]] = {}
+        for v in engine.variants:
+            renderers.setdefault(id(v.renderer), (v.name, v.renderer))
+        self.renderers = list(renderers.values()) or [("", engine)]
+        self.stats: Counter = Counter()
+        self._names: Dict[str, int] = {}
+        self._collided: set = set()
+        self.layout = CharLayout()
+        # вертикальные границы строки по шрифту и привязке (от текста почти не зависят)
+        self._heights: Dict[Tuple[int, str], Tuple[int, int]] = {}
+
+    def run(self, rows: Iterable[Tuple[int, Dict[str, Any]]]) -> ValidationResult:
+        started = time.perf_counter()
+        reports: List[RowReport] = []
+        by_index: Dict[int, RowReport] = {}
+        urls: Dict[str, List[int]] = {}
+        for idx, row in rows:
+            report = self.check_row(idx, row, by_index)
+            reports.append(report)
+            by_index[idx] = report
+            url = self.engine.source_url(row)
+            if url:
+                urls.setdefault(url, []).append(idx)
+        for url, issue in self.check_images(urls).items():
+            for idx in urls[url]:
+                by_index[idx].issues.append(issue)
+        stats = self.stats + Counter(i.code for r in reports for i in r.issues)
+        stats["rows"] = len(reports)
+        stats["problem_rows"] = sum(1 for r in reports if r.issues)
+        return ValidationResult(reports, stats, time.perf_counter() - started)
+
+    def check_row(self, idx: int, row: Dict[str, Any],
+                  by_index: Optional[Dict[int, RowReport]] = None) -> RowReport:
+        """Проверки текста и имени файла одной строки (фото — в check_images)."""
+        engine = self.engine
+        try:
+            files = engine.output_names(idx, row)
+        except Exception as e:
+            return RowReport(idx, [], [Issue("bad_filename", "filename_pattern", f"{type(e).__name__}: {e}")])
+        report = RowReport(idx, files)
+        for name, renderer in self.renderers:
+            prefix = f"{name}:" if len(self.renderers) > 1 else ""
+            for fp in renderer.plan.fields:
+                self._check_field(renderer, fp, row, prefix, report.issues)
+            for mp in renderer.plan.multiline_fields:
+                self._check_multiline(renderer, mp, row, prefix, report.issues)
+        self._check_names(idx, row, files, report, by_index or {})
+        ib = engine.plan.image_box
+        if ib is not None and ib.source_column and not engine.source_url(row):
+            report.issues.append(Issue("no_image", ib.source_column))
+        return report
+
+    def _check_field(self, engine: RenderEngine, fp: FieldPlan, row: Dict[str, Any], prefix: str,
+                     issues: List[Issue]) -> None:
+        text = engine._field_text(fp, row)
+        where = prefix + fp.name
+        if not text.strip():
+            if fp.text is None:
+                issues.append(Issue("empty", where))
+            return
+        layout = self.layout
+        if fp.boxed:
+            # центрирование не меняет переносы, а требует точного измерения каждой строки
+            ops = layout.wrap_box(text, fp.font, fp.width, fp.height, fp.step, False)
+            words = len(text.split())
+            placed = sum(len(line.split()) for _, _, line in ops)
+            if placed < words:
+                issues.append(Issue("overflow", where, f"не влезло слов: {words - placed} из {words}"))
+            for _, _, line in ops:
+                if not layout.fits(fp.font, line, fp.width):
+                    issues.append(Issue("too_wide", where, f"«{line}» шире зоны {fp.width} px"))
+            return
+        # поле без зоны рисуется одной строкой от точки привязки
+        W, H = engine.plan.size
+        key = (id(fp.font), fp.anchor)
+        top, bottom = self._heights.get(key) or self._heights.setdefault(key, fp.font.getbbox("Йg", anchor=fp.anchor)[1::2])
+        left, right = layout.extent(fp.font, text, fp.anchor)
+        band = layout.band(fp.font)
+        out = max(-(fp.x + left), fp.x + right - W, -(fp.y + top), fp.y + bottom - H)
+        if out > -band:
+            bbox = fp.font.getbbox(text, anchor=fp.anchor)
+            out = max(-(fp.x + bbox[0]), fp.x + bbox[2] - W, -(fp.y + bbox[1]), fp.y + bbox[3] - H)
+        if out > 0:
+            issues.append(Issue("too_wide", where, f"выходит за шаблон на {out} px"))
+
+    def _check_multiline(self, engine: RenderEngine, mp: MultilinePlan, row: Dict[str, Any], prefix: str,
+                         issues: List[Issue]) -> None:
+        raw = row.get(mp.name, "")
+        text = "" if raw is None else str(raw)
+        where = prefix + mp.name
+        parts = clean_multiline_parts(text, mp.delimiter)
+        if not parts:
+            issues.append(Issue("empty", where))
+            return
+        if not mp.title_fits:
+            issues.append(Issue("hidden", where, "заголовок не влезает в зону"))
+            return
+        # то же, что RenderEngine._draw_multiline, без рисования
+        lines = list(parts)
+        if mp.max_chars > 0:
+            clamped = sum(1 for p in parts if len(p) > mp.max_chars)
+            if clamped:
+                issues.append(Issue("clamped", where, f"строк длиннее {mp.max_chars} символов: {clamped}"))
+                lines = [p[:max(1, mp.max_chars - 3)] + "..." if len(p) > mp.max_chars else p for p in parts]
+        if mp.fit_width and mp.width > 0:
+            cut = sum(1 for ln in lines if not self.layout.fits(mp.font, ln, mp.width))
+            if cut:
+                issues.append(Issue("truncated", where, f"строк шире зоны: {cut}"))
+        shown = min(len(lines), max(0, mp.max_lines))
+        if mp.height > 0:
+            # первая строка под заголовком, каждая должна целиком влезть в высоту зоны
+            shown = min(shown, max(0, mp.height // mp.step - 1))
+        if shown < len(lines):
+            issues.append(Issue("overflow", where, f"показано строк {shown} из {len(lines)}"))
+
+    def _check_names(self, idx: int, row: Dict[str, Any], files: List[str], report: RowReport,
+                     by_index: Dict[int, RowReport]) -> None:
+        if any("{article_clean}" in r.plan.filename_pattern for _, r in self.renderers):
+            article = next((row.get(c) for c in ARTICLE_COLUMNS if row.get(c)), None)
+            if not re.sub(r"[^0-9A-Za-z]+", "", str(article or "")):
+                report.issues.append(Issue("no_article", "", f"имя по номеру строки: {files[0] if files else ''}"))
+        for name in files:
+            first = self._names.setdefault(name, idx)
+            if first == idx:
+                continue
+            report.issues.append(Issue("collision", name, f"как у строки {first}"))
+            other = by_index.get(first)
+            if other is not None and name not in self._collided:
+                self._collided.add(name)
+                other.issues.append(Issue("collision", name, f"как у строки {idx}"))
+
+    def check_images(self, urls: Dict[str, List[int]]) -> Dict[str, Issue]:
+        """Недоступные фото по URL: сначала кэш на диске, затем HEAD (в режиме "head")."""
+        engine = self.engine
+        if self.images == "off" or not urls:
+            return {}
+        self.stats["image_urls"] = len(urls)
+        pending = []
+        for url in urls:
+            if engine.is_cached(url):
+                self.stats["image_cached"] += 1
+            elif self.images == "head":
+                pending.append(url)
+            else:
+                self.stats["image_unchecked"] += 1
+        if not pending:
+            return {}
+        dl_cfg = engine.config.get("download", {}) or {}
+        workers = max(1, int(dl_cfg.get("concurrency", 8) or 1))
+        found: Dict[str, Issue] = {}
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="head") as pool:
+            futures: Dict[str, Future] = {url: pool.submit(engine.http.head, url) for url in pending}
+            for url, fut in futures.items():
+                self.stats["image_head"] += 1
+                try:
+                    status = fut.result()
+                except Exception as e:
+                    found[url] = Issue("image_error", url, f"{type(e).__name__}: {e}")
+                    continue
+                if status >= 400:
+                    found[url] = Issue("image_missing", url, f"HTTP {status}")
+        return found
+
+
+def validate(engine: RenderEngine, rows: Iterable[Tuple[int, Dict[str, Any]]], images: str = "head") -> ValidationResult:
+    """Проверяет строки (row_index, row) и возвращает отчёт по всем строкам."""
+    engine.check()
+    return Validator(engine, images).run(rows)
+
+
+def write_report(path: str, result: ValidationResult, all_rows: bool = False) -> str:
+    """Пишет отчёт: JSON (по расширению .json) или CSV — строка на каждую проблему.
+
+    all_rows — включить и строки без проблем.
+    """
+    rows = result.rows if all_rows else result.problem_rows
+    folder = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder, exist_ok=True)
+    if path.lower().endswith(".json"):
+        data = {
+            "summary": dict(result.stats, seconds=round(result.seconds, 3)),
+            "rows": [{"row": r.index, "files": r.files,
+                      "issues": [{"code": i.code, "field": i.field, "detail": i.detail} for i in r.issues]}
+                     for r in rows],
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        return path
+    # utf-8-sig — чтобы Excel открывал кириллицу без мастера импорта
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["row", "files", "code", "field", "detail"])
+        for r in rows:
+            files = "; ".join(r.files)
+            for i in r.issues or [Issue("")]:
+                writer.writerow([r.index, files, i.code, i.field, i.detail])
+    return path
+
+
+def format_summary(result: ValidationResult) -> List[str]:
+    """Строки сводки для лога: проблемные строки и число проблем по видам."""
+    stats = result.stats
+    lines = [f"Проверено строк: {stats['rows']} за {result.seconds:.2f} с, с проблемами: {stats['problem_rows']}"]
+    for code, title in ISSUES.items():
+        if stats.get(code):
+            lines.append(f"  {code:<14} {stats[code]:>7}  {title}")
+    if stats.get("image_urls"):
+        lines.append(f"Фото: уникальных ссылок {stats['image_urls']}, в кэше {stats.get('image_cached', 0)}, "
+                     f"проверено HEAD {stats.get('image_head', 0)}, не проверено {stats.get('image_unchecked', 0)}")
+    return lines
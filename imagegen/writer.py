@@ -0,0 +1,330 @@
+"""Кодирование и запись готовых картинок.
+
+write_image() кодирует картинку во временный файл рядом с целевым и
+переименовывает его (os.replace), поэтому в папке вывода не бывает
+недописанных файлов. WriterPool выполняет запись в фоновых потоках, пока
+рендерится следующая строка: Pillow отпускает GIL на время кодирования,
+а запись на сетевой диск не останавливает цикл рендера. Очередь ограничена:
+если потоки записи не успевают, submit() ждёт освобождения места.
+
+Вместо отдельных файлов картинки можно писать в один архив (output.sink):
+ZIP, tar или pack-файл с индексом смещений (см. PackSink). Имя внутри архива
+— имя файла из filename_pattern. Архив пишется во временный файл и
+переименовывается в конце прогона, как и отдельные картинки.
+"""
+import io
+import json
+import os
+import struct
+import tarfile
+import threading
+import time
+import zipfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from .plan import OutputPlan
+from .timing import Timings
+
+
+def output_format(out_name: str, output: OutputPlan) -> str:
+    """Формат Pillow для файла: из output.format или по расширению имени."""
+    if output.format:
+        return output.format
+    from PIL import Image
+
+    ext = os.path.splitext(out_name)[1].lower()
+    fmt = Image.registered_extensions().get(ext)
+    if fmt is None:
+        raise ValueError(f"Неизвестный формат файла: {os.path.basename(out_name)}")
+    return fmt
+
+
+_NO_TIMINGS = Timings()
+
+
+def _prepare(img, fmt: str):
+    if fmt == "JPEG" and img.mode not in ("RGB", "L", "CMYK"):
+        return img.convert("RGB")
+    return img
+
+
+def encode_image(img, out_name: str, output: OutputPlan, timings: Optional[Timings] = None) -> bytes:
+    """Кодирует img в байты с параметрами формата из output."""
+    fmt = output_format(out_name, output)
+    img = _prepare(img, fmt)
+    buf = io.BytesIO()
+    with (timings or _NO_TIMINGS).span("encode"):
+        img.save(buf, format=fmt, **output.save_kwargs(fmt))
+    return buf.getvalue()
+
+
+def write_image(img, out_path: str, output: OutputPlan, timings: Optional[Timings] = None) -> str:
+    """Атомарно сохраняет img в out_path с параметрами формата из output.
+
+    С включёнными timings кодирование идёт в память, чтобы стадии encode
+    и write замерялись отдельно.
+    """
+    fmt = output_format(out_path, output)
+    img = _prepare(img, fmt)
+    folder, name = os.path.split(out_path)
+    if folder and not os.path.isdir(folder):
+        # подпапка из filename_pattern (например, у вариантов вывода)
+        os.makedirs(folder, exist_ok=True)
+    tmp = os.path.join(folder, f".{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        if timings is not None and timings.enabled:
+            buf = io.BytesIO()
+            with timings.span("encode"):
+                img.save(buf, format=fmt, **output.save_kwargs(fmt))
+            with timings.span("write"):
+                with open(tmp, "wb") as f:
+                    f.write(buf.getbuffer())
+                os.replace(tmp, out_path)
+        else:
+            img.save(tmp, format=fmt, **output.save_kwargs(fmt))
+            os.replace(tmp, out_path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    return out_path
+
+
+class WriterPool:
+    """Фоновая запись с ограниченной очередью.
+
+    write(img, out_name) выполняется в одном из workers потоков; одновременно
+    в очереди и в работе не больше max_pending картинок.
+    """
+
+    def __init__(self, write: Callable[..., str], workers: int = 2, max_pending: int = 8) -> None:
+        self.write = write
+        self._slots = threading.BoundedSemaphore(max(1, int(max_pending)))
+        self._executor: Optional[ThreadPoolExecutor] = ThreadPoolExecutor(
+            max_workers=max(1, int(workers)), thread_name_prefix="writer")
+
+    def submit(self, img, out_name: str, write: Optional[Callable[..., str]] = None) -> Future:
+        """Ставит запись в очередь; write заменяет функцию записи пула для этой картинки."""
+        self._slots.acquire()
+        try:
+            fut = self._executor.submit(write or self.write, img, out_name)
+        except BaseException:
+            self._slots.release()
+            raise
+        fut.add_done_callback(lambda _: self._slots.release())
+        return fut
+
+    def close(self) -> None:
+        """Дожидается записи всех отправленных картинок."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+class ArchiveSink:
+    """Запись картинок в один файл-архив path.
+
+    write(name, data) потокобезопасен: кодирование идёт параллельно, в архив
+    байты попадают по одному файлу. Пока архив не закрыт, он лежит во
+    временном файле рядом; close() дописывает оглавление и переименовывает
+    его в path, close(commit=False) удаляет недописанный архив.
+    """
+    kind = ""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.count = 0
+        self.bytes = 0
+        folder, name = os.path.split(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._tmp = os.path.join(folder, f".{name}.{os.getpid()}.tmp")
+        self._lock = threading.Lock()
+        self._closed = False
+        self._open()
+
+    def write(self, name: str, data: bytes) -> None:
+        member = name.replace(os.sep, "/")
+        with self._lock:
+            if self._closed:
+                raise ValueError(f"Архив закрыт: {self.path}")
+            self._write(member, data)
+            self.count += 1
+            self.bytes += len(data)
+
+    def close(self, commit: bool = True) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            try:
+                self._close()
+            except BaseException:
+                commit = False
+                raise
+            finally:
+                if commit:
+                    os.replace(self._tmp, self.path)
+                else:
+                    try:
+                        os.remove(self._tmp)
+                    except OSError:
+                        pass
+
+    def _open(self) -> None:
+        raise NotImplementedError
+
+    def _write(self, member: str, data: bytes) -> None:
+        raise NotImplementedError
+
+    def _close(self) -> None:
+        raise NotImplementedError
+
+
+class ZipSink(ArchiveSink):
+    """ZIP без сжатия: JPEG/PNG/WebP уже сжаты, deflate только тратит CPU."""
+    kind = "zip"
+
+    def _open(self) -> None:
+        self._zip = zipfile.ZipFile(self._tmp, "w", compression=zipfile.ZIP_STORED, allowZip64=True)
+
+    def _write(self, member: str, data: bytes) -> None:
+        info = zipfile.ZipInfo(member, date_time=time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_STORED
+        info.external_attr = 0o644 << 16
+        self._zip.writestr(info, data)
+
+    def _close(self) -> None:
+        self._zip.close()
+
+
+class TarSink(ArchiveSink):
+    """Несжатый tar (формат PAX): файлы пишутся подряд, без оглавления."""
+    kind = "tar"
+
+    def _open(self) -> None:
+        self._tar = tarfile.open(self._tmp, "w", format=tarfile.PAX_FORMAT)
+
+    def _write(self, member: str, data: bytes) -> None:
+        info = tarfile.TarInfo(member)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        self._tar.addfile(info, io.BytesIO(data))
+
+    def _close(self) -> None:
+        self._tar.close()
+
+
+PACK_MAGIC = b"IGPACK1\n"
+PACK_INDEX_MAGIC = b"IGPKIDX\n"
+_PACK_FOOTER = struct.Struct("<Q8s")
+
+
+class PackSink(ArchiveSink):
+    """Pack-файл: байты картинок подряд и индекс смещений в конце.
+
+    Формат: заголовок PACK_MAGIC, данные файлов без разделителей, индекс —
+    JSON {"files": [[имя, смещение, размер], ...]} в UTF-8, затем 16 байт:
+    смещение индекса (uint64 little-endian) и PACK_INDEX_MAGIC. Читается
+    PackReader; файл можно раздать по HTTP Range-запросам по индексу.
+    """
+    kind = "pack"
+
+    def _open(self) -> None:
+        self._file = open(self._tmp, "wb")
+        self._file.write(PACK_MAGIC)
+        self._offset = len(PACK_MAGIC)
+        self._index: List[Tuple[str, int, int]] = []
+
+    def _write(self, member: str, data: bytes) -> None:
+        self._file.write(data)
+        self._index.append((member, self._offset, len(data)))
+        self._offset += len(data)
+
+    def _close(self) -> None:
+        try:
+            index = json.dumps({"files": self._index}, ensure_ascii=False).encode("utf-8")
+            self._file.write(index)
+            self._file.write(_PACK_FOOTER.pack(self._offset, PACK_INDEX_MAGIC))
+        finally:
+            self._file.close()
+
+
+class PackReader:
+    """Чтение pack-файла: names(), read(name), iter() в порядке записи.
+
+    При повторяющемся имени read() отдаёт последнюю запись, как при
+    перезаписи файла в папке.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            if self._file.read(len(PACK_MAGIC)) != PACK_MAGIC:
+                raise ValueError(f"Не pack-файл: {path}")
+            self._file.seek(-_PACK_FOOTER.size, os.SEEK_END)
+            end = self._file.tell()
+            index_offset, magic = _PACK_FOOTER.unpack(self._file.read(_PACK_FOOTER.size))
+            if magic != PACK_INDEX_MAGIC or not len(PACK_MAGIC) <= index_offset <= end:
+                raise ValueError(f"Pack-файл недописан или повреждён: {path}")
+            self._file.seek(index_offset)
+            files = json.loads(self._file.read(end - index_offset).decode("utf-8"))["files"]
+        except BaseException:
+            self._file.close()
+            raise
+        self.entries: List[Tuple[str, int, int]] = [tuple(e) for e in files]
+        self._by_name: Dict[str, Tuple[int, int]] = {name: (off, size) for name, off, size in self.entries}
+
+    def names(self) -> List[str]:
+        return [name for name, _, _ in self.entries]
+
+    def read(self, name: str) -> bytes:
+        offset, size = self._by_name[name]
+        self._file.seek(offset)
+        return self._file.read(size)
+
+    def iter(self) -> Iterator[Tuple[str, bytes]]:
+        for name, offset, size in self.entries:
+            self._file.seek(offset)
+            yield name, self._file.read(size)
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self) -> "PackReader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+SINKS = {"zip": ZipSink, "tar": TarSink, "pack": PackSink}
+
+
+def archive_path(output: OutputPlan, output_dir: str, part: Optional[str] = None) -> Optional[str]:
+    """Путь архива для output.sink или None для записи отдельными файлами.
+
+    part — суффикс перед расширением (у шардов imagegen.shard свой архив на шард).
+    """
+    if output.sink == "dir":
+        return None
+    path = output.archive or f"images.{output.sink}"
+    if not os.path.isabs(path):
+        path = os.path.join(output_dir, path)
+    if part:
+        root, ext = os.path.splitext(path)
+        path = f"{root}.{part}{ext}"
+    return path
+
+
+def open_sink(output: OutputPlan, output_dir: str, part: Optional[str] = None) -> Optional[ArchiveSink]:
+    """Открывает архив из output.sink; None — картинки пишутся отдельными файлами."""
+    path = archive_path(output, output_dir, part)
+    if path is None:
+        return None
+    return SINKS[output.sink](path)